@@ -0,0 +1,154 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Caches of parsed configuration files.
+
+The parsed content of a file is reused as long as the modification time,
+the size and the inode of the file are unchanged. The inode catches
+files replaced by a rename within the mtime granularity. FileCache
+keeps the parsed files in memory for a long-lived server. DiskCache
+also stores them as pickles in a directory so successive CGI processes
+do not have to parse them again.
+
+Cached values are shared: callers must copy them before modifying
+them.
+'''
+
+import cPickle
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+
+
+def _stamp(path):
+    'Return the (inode, mtime, size) of a file or None if it is missing.'
+    try:
+        stat = os.stat(path)
+    except OSError as xcpt:
+        if xcpt.errno != errno.ENOENT:
+            raise
+        return None
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+def _loader_name(loader):
+    return '%s.%s' % (loader.__module__, loader.__name__)
+
+
+class FileCache(object):
+    'In-memory cache of parsed files.'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key, stamp):
+        with self._lock:
+            entry = self._data.get(key)
+        if entry and entry[0] == stamp:
+            return entry
+        return None
+
+    def _store(self, key, stamp, value):
+        with self._lock:
+            self._data[key] = (stamp, value)
+
+    def get(self, path, loader, depends=()):
+        '''Return the content of path parsed by loader.
+
+depends lists other files read by loader: the content is also parsed
+again when one of them changes.
+'''
+        key = (path, _loader_name(loader))
+        stamp = _stamp(path)
+        if depends:
+            stamp = (stamp,) + tuple([_stamp(dep) for dep in depends])
+        entry = self._lookup(key, stamp)
+        if entry:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = loader(path)
+        self._store(key, stamp, value)
+        return value
+
+    def put(self, path, loader, value):
+        '''Record value as the parsed content of path.
+
+To be called after writing path to avoid parsing it again.
+'''
+        self._store((path, _loader_name(loader)), _stamp(path), value)
+
+    def clear(self):
+        'Forget all the parsed files.'
+        with self._lock:
+            self._data = {}
+
+
+class DiskCache(FileCache):
+    'Cache of parsed files also stored as pickles in a directory.'
+
+    def __init__(self, cache_dir):
+        FileCache.__init__(self)
+        self.cache_dir = cache_dir
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1('\0'.join(key)).hexdigest())
+
+    def _lookup(self, key, stamp):
+        entry = FileCache._lookup(self, key, stamp)
+        if entry:
+            return entry
+        try:
+            with open(self._filename(key), 'rb') as cache_file:
+                entry = cPickle.load(cache_file)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+        if entry[0] != stamp:
+            return None
+        FileCache._store(self, key, stamp, entry[1])
+        return entry
+
+    def _store(self, key, stamp, value):
+        FileCache._store(self, key, stamp, value)
+        # the disk cache is only an optimization: ignore errors
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.cache_dir)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as cache_file:
+                cPickle.dump((stamp, value), cache_file,
+                             cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, self._filename(key))
+        except (IOError, OSError, cPickle.PicklingError):
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+
+
+def create(cache_dir=None):
+    'Return a DiskCache if cache_dir is set else a FileCache.'
+    if cache_dir:
+        return DiskCache(cache_dir)
+    return FileCache()
+
+# cache.py ends here
@@ -0,0 +1,80 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Hash indexes of the used entries of CMDB files.
+
+The index of a CMDB maps each key of its used entries (ip, hostname,
+mac...) to a dict of the values to the index of the entry having them,
+so finding if a value is used does not scan the CMDB. The system names
+recorded in the journal are indexed under the sysname key. Indexes are
+kept in a cache.FileCache and built again when the CMDB or its journal
+changes.
+'''
+
+import cache
+import journal
+import lazycmdb
+
+
+def build(filename):
+    'Return the index of the used entries of a CMDB file.'
+    dbase = lazycmdb.parse(open(filename).read(-1))
+    records = journal.read(filename)
+    journal.apply_cmdb(dbase, records)
+    index = {}
+    for idx, entry in lazycmdb.allocated_items(dbase):
+        if entry['used'] != 1:
+            continue
+        for key, value in entry.items():
+            # values are compared to the strings given on the command line
+            if isinstance(value, basestring):
+                index.setdefault(key, {}).setdefault(value, idx)
+    for record in records:
+        idx = record['idx']
+        if (record.get('sysname') and idx < len(dbase) and
+                dbase[idx] == record['entry']):
+            index.setdefault('sysname', {})[record['sysname']] = idx
+    return index
+
+
+class CmdbIndex(object):
+    '''Indexes of a list of CMDB files.
+
+The files are checked for modifications on each query.
+'''
+
+    def __init__(self, filenames, fcache=None):
+        self.filenames = filenames
+        self.cache = fcache or cache.FileCache()
+
+    def _index(self, filename):
+        return self.cache.get(filename, build,
+                              [journal.journal_filename(filename)])
+
+    def find(self, key, value):
+        '''Return the CMDB file and the index of the used entry whose key
+is value or None.
+'''
+        for filename in self.filenames:
+            idx = self._index(filename).get(key, {}).get(value)
+            if idx is not None:
+                return filename, idx
+        return None
+
+    def is_used(self, key, value):
+        'Return True if a used entry has value for key.'
+        return self.find(key, value) is not None
+
+# cmdbindex.py ends here
@@ -0,0 +1,99 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Stable fingerprints of the hardware of a host.
+
+The fingerprint is a hash of the lines identifying the host and its
+layout: system serial, name and vendor, MAC addresses, disk sizes, CPU
+counts and models and the total memory. Volatile lines like IP
+addresses or temperatures are ignored, as well as the order of the
+lines.
+
+The assignment of a fingerprint (profile, CMDB index and entry, and the
+variables sent in the configure script) is stored in a file named after
+the fingerprint so it can be found again without reading the others.
+'''
+
+import errno
+import hashlib
+import os
+import tempfile
+
+
+def _selected(item):
+    'Return True if a hardware line is part of the fingerprint.'
+    if len(item) != 4:
+        return False
+    if item[0] == 'system':
+        return (item[1] == 'product' and
+                item[2] in ('serial', 'name', 'vendor'))
+    if item[0] == 'network':
+        return item[2] == 'serial'
+    if item[0] == 'disk':
+        return item[2] == 'size'
+    if item[0] == 'cpu':
+        return item[2] in ('number', 'product')
+    if item[0] == 'memory':
+        return item[1] == 'total' and item[2] == 'size'
+    return False
+
+
+def fingerprint(hw_items):
+    'Return the fingerprint of a list of hardware items.'
+    lines = sorted(set(['\t'.join([str(field) for field in item])
+                        for item in hw_items if _selected(item)]))
+    return hashlib.sha1('\n'.join(lines)).hexdigest()
+
+
+def _filename(fpr_dir, fpr):
+    return os.path.join(fpr_dir, fpr[:2], fpr)
+
+
+def load(fpr_dir, fpr):
+    'Return the assignment stored for a fingerprint or None.'
+    try:
+        return eval(open(_filename(fpr_dir, fpr)).read(-1))
+    except IOError as xcpt:
+        if xcpt.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def save(fpr_dir, fpr, assignment):
+    'Store the assignment of a fingerprint atomically.'
+    fname = _filename(fpr_dir, fpr)
+    try:
+        os.mkdir(os.path.dirname(fname))
+    except OSError as xcpt:
+        if xcpt.errno != errno.EEXIST:
+            raise
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(fname),
+                                   prefix='.tmp')
+    try:
+        os.write(fd, repr(assignment) + '\n')
+    finally:
+        os.close(fd)
+    os.rename(tmpname, fname)
+
+
+def remove(fpr_dir, fpr):
+    'Forget the assignment of a fingerprint.'
+    try:
+        os.unlink(_filename(fpr_dir, fpr))
+    except OSError as xcpt:
+        if xcpt.errno != errno.ENOENT:
+            raise
+
+# fingerprint.py ends here
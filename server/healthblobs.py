@@ -0,0 +1,143 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Deduplicated storage of the health check results.
+
+A result is split into a template and the values of its measurements
+(benchmark results and volatile lines like IP addresses or the link
+state). The template is the list of the hardware items where the
+values of the measurements are replaced by None: it only holds the
+inventory (models, sizes, serials, firmwares...) and the names of the
+measurements. Templates are stored once in a blob directory under the
+hash of their content, so running the health check again on the same
+hosts only stores the measured values.
+
+A .hwref file holds the hash of the template of a result, the list of
+its measured values and their positions so load() gives back the
+original list of hardware items, even when an inventory item really
+holds None.
+'''
+
+import errno
+import hashlib
+import os
+import pprint
+import re
+import tempfile
+
+MEASUREMENT_REGEXP = re.compile(
+    r'bandwidth|loops_per_sec|bogomips|_IOps$|_KBps$')
+VOLATILE = (('network', 'ipv4'), ('network', 'ipv4-cidr'),
+            ('network', 'ipv4-netmask'), ('network', 'ipv4-network'),
+            ('network', 'link'))
+
+REF_EXTENSION = '.hwref'
+
+
+def is_measurement(item):
+    'Return True if the value of a hardware item is not inventory.'
+    return len(item) == 4 and ((item[0], item[2]) in VOLATILE or
+                               MEASUREMENT_REGEXP.search(item[2]) is not None)
+
+
+def split(hw_items):
+    '''Split hardware items into a template and measured values.
+
+Returns the template, the list of the values and the list of their
+positions in hw_items.
+'''
+    template = []
+    values = []
+    positions = []
+    for idx, item in enumerate(hw_items):
+        if is_measurement(item):
+            template.append(tuple(item[:3]) + (None,))
+            values.append(item[3])
+            positions.append(idx)
+        else:
+            template.append(item)
+    return template, values, positions
+
+
+def join(template, values, positions):
+    'Return the hardware items split by split().'
+    items = list(template)
+    for idx, value in zip(positions, values):
+        items[idx] = items[idx][:3] + (value,)
+    return items
+
+
+def _blob_filename(blob_dir, digest):
+    return os.path.join(blob_dir, digest[:2], digest)
+
+
+def _write(filename, content):
+    'Write a file atomically.'
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                   prefix='.tmp')
+    try:
+        os.write(fd, content)
+    finally:
+        os.close(fd)
+    os.rename(tmpname, filename)
+
+
+def put(blob_dir, items):
+    '''Store a list of items in the blob directory.
+
+Returns the hash of the blob. Nothing is written if the blob is
+already stored.
+'''
+    content = pprint.pformat(items) + '\n'
+    digest = hashlib.sha1(content).hexdigest()
+    fname = _blob_filename(blob_dir, digest)
+    if os.path.exists(fname):
+        return digest
+    try:
+        os.makedirs(os.path.dirname(fname))
+    except OSError as xcpt:
+        if xcpt.errno != errno.EEXIST:
+            raise
+    _write(fname, content)
+    return digest
+
+
+def get(blob_dir, digest):
+    'Return the list of items of a blob.'
+    return eval(open(_blob_filename(blob_dir, digest)).read(-1))
+
+
+def save(blob_dir, filename, hw_items):
+    '''Store hardware items as a .hwref file and a template blob.
+
+The blob directory is recorded in the .hwref file.
+'''
+    template, values, positions = split(hw_items)
+    ref = {'blobs': os.path.abspath(blob_dir),
+           'template': put(blob_dir, template),
+           'values': values,
+           'positions': positions}
+    _write(filename, repr(ref) + '\n')
+
+
+def load(filename):
+    'Return the hardware items of a .hw or a .hwref file.'
+    content = eval(open(filename).read(-1))
+    if not filename.endswith(REF_EXTENSION):
+        return content
+    return join(get(content['blobs'], content['template']),
+                content['values'], content['positions'])
+
+# healthblobs.py ends here
@@ -0,0 +1,251 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Columnar store of the results of the health checks of a session.
+
+A store is a directory holding:
+
+- keys: the (level1, level2, level3) keys, one per line.
+- hosts: the (sysname, date) of each ingested result, one per line, the
+  line number being the id of the host.
+- hosts.idx: the offset of the end of each line of hosts as an array
+  of unsigned longs, so the id of the next host is known from its size.
+- <column>.v and <column>.h: the numeric values of a key as an array
+  of doubles and the ids of the hosts they come from as an array of
+  unsigned ints. The column name is a hash of the key, so a key is
+  known from the existence of its files.
+
+Results are only appended, under a lock, so reading the values of a
+key for all the hosts is a read of two arrays. Ingesting a result only
+touches the ends of the files: its cost does not grow with the number
+of hosts. Lines whose value is not a number are only kept in the .hw
+files.
+'''
+
+import array
+import ast
+import hashlib
+import os
+
+import locking
+
+VALUE_TYPE = 'd'
+HOST_TYPE = 'I'
+OFFSET_TYPE = 'L'
+BLOCK_SIZE = 4096
+
+
+def _read_lines(filename, size=-1):
+    '''Return the records of a file with a Python literal per line.
+
+Only the first size bytes are read if size is not negative.
+'''
+    try:
+        content = open(filename).read(size)
+    except IOError:
+        return []
+    # an interrupted append leaves a line without a newline
+    return [ast.literal_eval(line) for line in content.split('\n')[:-1]]
+
+
+def _append(filename, data):
+    with open(filename, 'ab') as out:
+        out.write(data)
+
+
+def _lines_end(filename):
+    'Return the offset of the end of the last complete line of a file.'
+    try:
+        in_file = open(filename, 'rb')
+    except IOError:
+        return 0
+    with in_file:
+        in_file.seek(0, os.SEEK_END)
+        end = in_file.tell()
+        if end == 0:
+            return 0
+        in_file.seek(end - 1)
+        if in_file.read(1) == '\n':
+            return end
+        # an interrupted append: look for the end of the previous line
+        while end > 0:
+            start = max(0, end - BLOCK_SIZE)
+            in_file.seek(start)
+            pos = in_file.read(end - start).rfind('\n')
+            if pos >= 0:
+                return start + pos + 1
+            end = start
+        return 0
+
+
+def _append_lines(filename, records):
+    'Append records as lines dropping the line of an interrupted append.'
+    _truncate(filename, _lines_end(filename))
+    _append(filename, ''.join([repr(record) + '\n' for record in records]))
+
+
+def _column_name(key):
+    'Return the name of the files of the column of a key.'
+    return hashlib.sha1('\0'.join([unicode(level).encode('utf-8')
+                                   for level in key])).hexdigest()
+
+
+def _read_array(filename, typecode):
+    result = array.array(typecode)
+    try:
+        content = open(filename, 'rb').read(-1)
+    except IOError:
+        return result
+    result.fromstring(content[:len(content) - len(content) %
+                              result.itemsize])
+    return result
+
+
+def _size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def _truncate(filename, size):
+    'Truncate a file to size bytes if it is longer.'
+    if _size(filename) > size:
+        with open(filename, 'r+b') as out:
+            out.truncate(size)
+
+
+def _align(prefix):
+    'Drop the values of an interrupted ingestion from a column.'
+    count = _size(prefix + '.h') // array.array(HOST_TYPE).itemsize
+    _truncate(prefix + '.h', count * array.array(HOST_TYPE).itemsize)
+    _truncate(prefix + '.v', count * array.array(VALUE_TYPE).itemsize)
+
+
+def _number(value):
+    'Return value as a float or None if it is not a number.'
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if number != number:
+        # NaN
+        return None
+    return number
+
+
+class HealthStore(object):
+    'Columnar store of the health check results in a directory.'
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def _filename(self, name):
+        return os.path.join(self.dirname, name)
+
+    def _hosts_end(self):
+        '''Return the number of hosts and the end of the last one in hosts.
+
+Drops the offset of an interrupted append from hosts.idx.
+'''
+        filename = self._filename('hosts.idx')
+        itemsize = array.array(OFFSET_TYPE).itemsize
+        count = _size(filename) // itemsize
+        if count == 0:
+            return 0, 0
+        _truncate(filename, count * itemsize)
+        offsets = array.array(OFFSET_TYPE)
+        with open(filename, 'rb') as in_file:
+            in_file.seek((count - 1) * itemsize)
+            offsets.fromfile(in_file, 1)
+        return count, offsets[0]
+
+    def keys(self):
+        '''Return the dict of the column names indexed by
+(level1, level2, level3).'''
+        return dict([(key, _column_name(key))
+                     for key in _read_lines(self._filename('keys'))])
+
+    def hosts(self):
+        'Return the list of the (sysname, date) of the results.'
+        return _read_lines(self._filename('hosts'), self._hosts_end()[1])
+
+    def ingest(self, sysname, date, hw_items):
+        '''Append the numeric values of a health check result.
+
+Returns the id of the host.
+'''
+        if not os.path.isdir(self.dirname):
+            os.makedirs(self.dirname)
+        columns = {}
+        for item in hw_items:
+            if len(item) != 4:
+                continue
+            value = _number(item[3])
+            if value is not None:
+                columns.setdefault(tuple(item[:3]), []).append(value)
+        with locking.QueueLock(self._filename('lock')):
+            host, end = self._hosts_end()
+            new_keys = sorted([key for key in columns if not os.path.exists(
+                self._filename(_column_name(key) + '.h'))])
+            # the host is recorded before the values so an interrupted
+            # ingestion never gets its id reused. The line of a host
+            # missing from hosts.idx is dropped.
+            line = repr((sysname, date)) + '\n'
+            _truncate(self._filename('hosts'), end)
+            _append(self._filename('hosts'), line)
+            _append(self._filename('hosts.idx'),
+                    array.array(OFFSET_TYPE, [end + len(line)]).tostring())
+            # a key line without a column is written again, keys()
+            # ignores the duplicates
+            _append_lines(self._filename('keys'), new_keys)
+            for key, values in columns.items():
+                prefix = self._filename(_column_name(key))
+                _align(prefix)
+                # values first: the values without a host id are
+                # ignored by column()
+                _append(prefix + '.v',
+                        array.array(VALUE_TYPE, values).tostring())
+                _append(prefix + '.h',
+                        array.array(HOST_TYPE,
+                                    [host] * len(values)).tostring())
+        return host
+
+    def column(self, key):
+        '''Return the arrays of the host ids and of the values of a key.
+
+The arrays are empty if the key is unknown.
+'''
+        prefix = self._filename(_column_name(key))
+        hosts = _read_array(prefix + '.h', HOST_TYPE)
+        values = _read_array(prefix + '.v', VALUE_TYPE)
+        del values[len(hosts):]
+        return hosts, values
+
+    def select(self, level1=None, level2=None, level3=None):
+        '''Return the columns of the keys matching the given levels.
+
+Returns a list of (key, host ids, values) sorted by key. A level set
+to None matches any value.
+'''
+        result = []
+        for key in sorted(self.keys()):
+            if ((level1 is None or key[0] == level1) and
+                    (level2 is None or key[1] == level2) and
+                    (level3 is None or key[2] == level3)):
+                result.append((key,) + self.column(key))
+        return result
+
+# healthstore.py ends here
@@ -0,0 +1,131 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Append-only journals of the state and CMDB updates.
+
+Instead of rewriting a whole file for each allocation, a one line
+record is appended to <file>.journal and synced to disk. Records are
+applied on top of the file when it is read and are folded back into it
+by a compaction.
+
+Records can be applied several times, so a crash between the rewrite
+of the file and the removal of its journal is harmless: state records
+hold the new count of a profile and CMDB records hold the entry before
+and after the allocation.
+'''
+
+import ast
+import errno
+import logging
+import os
+import time
+
+LOG = logging.getLogger('edeploy.journal')
+
+# number of records triggering a compaction when reading a file
+COMPACT_RECORDS = 256
+
+
+def journal_filename(filename):
+    'Return the name of the journal of filename.'
+    return filename + '.journal'
+
+
+def append(filename, *records):
+    'Append records to the journal of filename and sync it to disk.'
+    fd = os.open(journal_filename(filename),
+                 os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        # a single write so records are never interleaved
+        os.write(fd, ''.join([repr(record) + '\n' for record in records]))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read(filename):
+    'Return the list of records of the journal of filename.'
+    try:
+        journal_file = open(journal_filename(filename), 'r')
+    except IOError as xcpt:
+        if xcpt.errno != errno.ENOENT:
+            raise
+        return []
+    records = []
+    with journal_file:
+        for line in journal_file:
+            try:
+                if not line.endswith('\n'):
+                    raise SyntaxError('truncated record')
+                records.append(ast.literal_eval(line))
+            except (SyntaxError, ValueError):
+                # interrupted append: the next records cannot be trusted
+                LOG.error('ignoring invalid record in %s: %s' %
+                          (journal_filename(filename), line.strip()))
+                break
+    return records
+
+
+def remove(filename):
+    'Remove the journal of filename once it has been folded into it.'
+    try:
+        os.unlink(journal_filename(filename))
+    except OSError as xcpt:
+        if xcpt.errno != errno.ENOENT:
+            raise
+
+
+def state_record(name, times):
+    'Return the record setting the count of a profile.'
+    return {'name': name, 'times': times, 'time': time.time()}
+
+
+def apply_state(data, records):
+    'Apply state records to a list of (profile, count) in place.'
+    for record in records:
+        for idx, (name, _) in enumerate(data):
+            if name == record['name']:
+                data[idx] = (name, record['times'])
+                break
+
+
+def cmdb_record(idx, orig, entry, sysname):
+    'Return the record replacing the CMDB entry orig at idx by entry.'
+    return {'idx': idx, 'orig': orig, 'entry': entry, 'sysname': sysname,
+            'time': time.time()}
+
+
+def apply_cmdb(dbase, records):
+    '''Apply CMDB records to a list of entries in place.
+
+A record is applied where the entry it replaces is found. Records
+whose entry is not found anymore, because they are already applied or
+because the CMDB was edited, are ignored.
+'''
+    for record in records:
+        idx = record['idx']
+        if idx < len(dbase) and dbase[idx] == record['entry']:
+            continue
+        if idx >= len(dbase) or dbase[idx] != record['orig']:
+            try:
+                idx = dbase.index(record['orig'])
+            except ValueError:
+                if record['entry'] not in dbase:
+                    LOG.error('cannot apply CMDB record for %s' %
+                              record['sysname'])
+                continue
+        dbase[idx] = record['entry']
+
+# journal.py ends here
@@ -0,0 +1,383 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Lazy CMDB generated from ranges.
+
+hardware.generate.generate() expands a model like {'ip':
+'10.66.6.100-109', 'hostname': 'hpceph1-10'} into the list of all its
+entries. LazyCmdb keeps the model instead and computes the entry at a
+given index on demand. Only the allocated entries are stored, with a
+bitmap of the used slots to find the next free entry.
+
+Once an entry is allocated, the CMDB is saved as:
+
+lazy_cmdb(<model>, entries={<index>: <entry>, ...})
+
+Use parse() to read a .cmdb file in either format.
+'''
+
+import pprint
+import re
+
+from hardware import cmdb
+from hardware import generate as hw_generate
+
+# same regexps as hardware.generate
+_RANGE_REGEXP = re.compile(r'^(.*?)([0-9]+-[0-9]+(:([0-9]+-[0-9]+))*)(.*)$')
+_IPV4_RANGE_REGEXP = re.compile(r'^[0-9:\-.]+$')
+
+# number of times hardware.generate repeats a non range value
+_REPEAT = 16387064
+
+
+class _NumRange(object):
+    'Values of a range like 10-12:20-30 surrounded by head and foot.'
+
+    def __init__(self, num_range, head='', foot=''):
+        self._head = head
+        self._foot = foot
+        self._segments = []
+        for rang in num_range.split(':'):
+            boundaries = rang.split('-')
+            segment = None
+            if len(boundaries) == 2:
+                try:
+                    if boundaries[0][0] == '0':
+                        fmt = '%%0%dd' % len(boundaries[0])
+                    else:
+                        fmt = '%d'
+                    start = int(boundaries[0])
+                    stop = int(boundaries[1])
+                    segment = (start, 1 if stop >= start else -1,
+                               abs(stop - start) + 1, fmt)
+                except ValueError:
+                    pass
+            if segment is None:
+                # hardware.generate yields the whole range in this case
+                segment = (num_range, 0, 1, None)
+            self._segments.append(segment)
+        self._len = sum([seg[2] for seg in self._segments])
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        for start, step, count, fmt in self._segments:
+            if idx < count:
+                if fmt is None:
+                    value = start
+                else:
+                    value = fmt % (start + idx * step)
+                return self._head + value + self._foot
+            idx -= count
+        raise IndexError(idx)
+
+
+class _Ipv4Range(object):
+    'Values of an IPv4 range like 10.0.1-2.1-253.'
+
+    def __init__(self, parts):
+        self._octets = [_NumRange(part) for part in parts]
+        self._len = 1
+        for octet in self._octets:
+            self._len *= len(octet)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        if idx >= self._len:
+            raise IndexError(idx)
+        parts = []
+        for octet in reversed(self._octets):
+            idx, rem = divmod(idx, len(octet))
+            parts.append(octet[rem])
+        return '.'.join(reversed(parts))
+
+
+class _Repeat(object):
+    'A value repeated like hardware.generate does for non range values.'
+
+    def __init__(self, value):
+        self._value = value
+
+    def __len__(self):
+        return _REPEAT
+
+    def __getitem__(self, idx):
+        if idx >= _REPEAT:
+            raise IndexError(idx)
+        return self._value
+
+
+def _values(value):
+    '''Return the sequence of values generated for a model value.
+
+Returns None for the values not supported lazily.
+'''
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        return None
+    if isinstance(value, str):
+        parts = value.split('.')
+        if (_IPV4_RANGE_REGEXP.search(value) and len(parts) == 4 and
+                (':' in value or '-' in value)):
+            return _Ipv4Range(parts)
+        res = _RANGE_REGEXP.search(value)
+        if res:
+            return _NumRange(res.group(2), res.group(1),
+                             res.group(res.lastindex))
+    return _Repeat(value)
+
+
+class LazyCmdb(object):
+    '''List of CMDB entries generated from a model on demand.
+
+entries is a dict of the entries replacing the generated ones,
+indexed by their position.
+'''
+
+    def __init__(self, model, entries=None):
+        self._model = model
+        self._fixed = {}
+        self._seqs = {}
+        for key, value in model.items():
+            if isinstance(value, str) and not _RANGE_REGEXP.search(value):
+                self._fixed[key] = value
+            else:
+                seq = _values(value)
+                if seq is None:
+                    raise ValueError('unsupported value for %s' % key)
+                self._seqs[key] = seq
+        if not self._seqs:
+            raise ValueError('no range in model')
+        self._len = min([len(values) for values in self._seqs.values()])
+        self._entries = {}
+        # the generated entries are used if the model has a used key
+        fill = 0xff if 'used' in model else 0
+        self._used = bytearray([fill]) * ((self._len + 7) // 8)
+        # no free entry before this index
+        self._free = 0
+        for idx, entry in (entries or {}).items():
+            self[idx] = entry
+
+    def _generate(self, idx):
+        entry = dict(self._fixed)
+        for key, seq in self._seqs.items():
+            entry[key] = seq[idx]
+        return entry
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._len
+        if idx < 0 or idx >= self._len:
+            raise IndexError(idx)
+        try:
+            return self._entries[idx]
+        except KeyError:
+            return self._generate(idx)
+
+    def __setitem__(self, idx, entry):
+        if idx < 0:
+            idx += self._len
+        if idx < 0 or idx >= self._len:
+            raise IndexError(idx)
+        self._entries[idx] = entry
+        if 'used' in entry:
+            self._used[idx >> 3] |= 1 << (idx & 7)
+        else:
+            self._used[idx >> 3] &= ~(1 << (idx & 7)) & 0xff
+            self._free = min(self._free, idx)
+
+    def __iter__(self):
+        for idx in xrange(self._len):
+            yield self[idx]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return 'lazy_cmdb(%s,\n          entries=%s)' % (
+            pprint.pformat(self._model), pprint.pformat(self._entries))
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def copy(self):
+        'Return a copy sharing the model but not the entries.'
+        result = LazyCmdb.__new__(LazyCmdb)
+        result.__dict__.update(self.__dict__)
+        result._entries = dict([(idx, dict(entry))
+                                for idx, entry in self._entries.items()])
+        result._used = bytearray(self._used)
+        return result
+
+    def index(self, entry):
+        'Return the index of the first entry equal to entry.'
+        for idx, elt in enumerate(self):
+            if elt == entry:
+                return idx
+        raise ValueError('entry not in CMDB')
+
+    def allocated(self):
+        'Return the list of the entries replacing the generated ones.'
+        return [entry for _, entry in self.allocated_items()]
+
+    def allocated_items(self):
+        'Return the (index, entry) of the entries replacing generated ones.'
+        return [(idx, self._entries[idx]) for idx in sorted(self._entries)]
+
+    def find(self, pref):
+        '''Return the index of the first entry including pref.
+
+Returns None if there is none.
+'''
+        found = [idx for idx, entry in self._entries.items()
+                 if hw_generate.is_included(pref, entry)]
+        best = min(found) if found else self._len
+        for key, value in pref.items():
+            if key in self._fixed:
+                if self._fixed[key] != value:
+                    break
+            elif key not in self._seqs:
+                break
+        else:
+            # only the generated entries before best need to be checked
+            seqs = [(self._seqs[key], value) for key, value in pref.items()
+                    if key in self._seqs]
+            for idx in xrange(best):
+                if idx in self._entries:
+                    continue
+                for seq, value in seqs:
+                    if seq[idx] != value:
+                        break
+                else:
+                    best = idx
+                    break
+        if best < self._len:
+            return best
+        return None
+
+    def next_free(self):
+        'Return the index of the first unused entry or None.'
+        idx = self._free
+        while idx < self._len:
+            byte = self._used[idx >> 3]
+            if byte == 0xff:
+                idx = (idx | 7) + 1
+            elif byte & (1 << (idx & 7)):
+                idx += 1
+            else:
+                self._free = idx
+                return idx
+        self._free = self._len
+        return None
+
+
+def generate(model, prefix=None):
+    '''Lazy version of hardware.generate.generate.
+
+Returns a LazyCmdb or, if the model is not supported, the list built
+by hardware.generate.generate.
+'''
+    if prefix is None:
+        try:
+            return LazyCmdb(model)
+        except ValueError:
+            pass
+    return hw_generate.generate(model, prefix)
+
+
+def lazy_cmdb(model, entries=None):
+    'Build a saved LazyCmdb.'
+    return LazyCmdb(model, entries)
+
+
+def parse(content):
+    'Evaluate the content of a .cmdb file.'
+    return eval(content, {'generate': generate, 'lazy_cmdb': lazy_cmdb})
+
+
+def copy_cmdb(dbase):
+    'Return a copy of a CMDB whose entries can be replaced.'
+    if isinstance(dbase, LazyCmdb):
+        return dbase.copy()
+    return list(dbase)
+
+
+def allocated(dbase):
+    'Return the used entries of a CMDB.'
+    return [entry for _, entry in allocated_items(dbase)]
+
+
+def allocated_items(dbase):
+    'Return the (index, entry) of the used entries of a CMDB.'
+    if isinstance(dbase, LazyCmdb):
+        items = dbase.allocated_items()
+    else:
+        items = enumerate(dbase)
+    return [(idx, entry) for idx, entry in items if 'used' in entry]
+
+
+def _find(dbase, pref):
+    if isinstance(dbase, LazyCmdb):
+        return dbase.find(pref)
+    for idx, entry in enumerate(dbase):
+        if hw_generate.is_included(pref, entry):
+            return idx
+    return None
+
+
+def _next_free(dbase):
+    if isinstance(dbase, LazyCmdb):
+        return dbase.next_free()
+    for idx, entry in enumerate(dbase):
+        if 'used' not in entry:
+            return idx
+    return None
+
+
+def update_cmdb(dbase, var, pref, forced_find):
+    '''Allocate an entry like hardware.cmdb.update_cmdb.
+
+The entries are replaced instead of being modified in place so they
+can be shared with a cache. var is augmented with the allocated entry
+which is replaced by var. Returns the index of the allocated entry and
+the entry it replaced.
+'''
+    idx = _find(dbase, pref)
+    if idx is None:
+        # not looking for $$ type matches
+        if forced_find:
+            raise cmdb.CmdbError('No entry matched in the CMDB, aborting.')
+        idx = _next_free(dbase)
+        if idx is None:
+            raise cmdb.CmdbError('No more entry in the CMDB, aborting.')
+    orig = dbase[idx]
+    entry = dict(orig)
+    entry.update(var)
+    var.update(entry)
+    var['used'] = 1
+    dbase[idx] = var
+    return idx, orig
+
+# lazycmdb.py ends here
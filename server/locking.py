@@ -0,0 +1,210 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Blocking FIFO locks shared between processes and threads.
+
+A QueueLock is a queue of waiters built on flock(2). The lock is made
+of a <filename>.queue file holding the next ticket number and of a
+node file per waiter named after its ticket. Each waiter takes a
+ticket, creates and locks its node file, then blocks on the node files
+of all the older tickets, the previous one first. Releasing the lock
+unlocks and removes the node file, which wakes up the next waiter
+only. Waiters are served in arrival order and the kernel drops the
+flock of a dead process so a crashed holder or waiter never leaves a
+stale lock behind.
+
+filename itself is never created, so a process still using the old
+O_EXCL lock on it is not blocked by a QueueLock (but is not excluded
+either).
+
+Slots bound the number of processes doing something at the same time
+without making the others wait.
+'''
+
+import errno
+import fcntl
+import os
+import time
+
+
+def _flock(fd, operation):
+    'flock() retrying on EINTR.'
+    while True:
+        try:
+            fcntl.flock(fd, operation)
+            return
+        except IOError as xcpt:
+            if xcpt.errno != errno.EINTR:
+                raise
+
+
+def _unlink(filename):
+    'Remove a file if it still exists.'
+    try:
+        os.unlink(filename)
+    except OSError as xcpt:
+        if xcpt.errno != errno.ENOENT:
+            raise
+
+
+def _read_ticket(fd):
+    'Read the ticket number stored in a lock file.'
+    os.lseek(fd, 0, os.SEEK_SET)
+    content = os.read(fd, 32).strip()
+    try:
+        return int(content)
+    except ValueError:
+        return 0
+
+
+class QueueLock(object):
+    '''FIFO lock on a file name.
+
+wait_time is the number of seconds the last acquire() was blocked.
+'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.wait_time = 0.0
+        self._node = None
+        self._node_fd = None
+
+    def _node_name(self, ticket):
+        return '%s.queue.%d.wait' % (self.filename, ticket)
+
+    def _older_nodes(self, ticket):
+        '''Return the node files of the tickets before ticket, the most
+recent first.'''
+        dirname = os.path.dirname(self.filename) or '.'
+        prefix = os.path.basename(self.filename) + '.queue.'
+        tickets = []
+        for entry in os.listdir(dirname):
+            if entry.startswith(prefix) and entry.endswith('.wait'):
+                try:
+                    num = int(entry[len(prefix):-len('.wait')])
+                except ValueError:
+                    continue
+                if num < ticket:
+                    tickets.append(num)
+        tickets.sort(reverse=True)
+        return [self._node_name(older) for older in tickets]
+
+    def _wait_node(self, node):
+        'Block until the owner of a node file releases it or dies.'
+        try:
+            node_fd = os.open(node, os.O_RDWR)
+        except OSError as xcpt:
+            if xcpt.errno != errno.ENOENT:
+                raise
+            # already released
+            return
+        try:
+            _flock(node_fd, fcntl.LOCK_EX)
+        finally:
+            os.close(node_fd)
+        # the owner may have died without cleaning up
+        _unlink(node)
+
+    def acquire(self):
+        'Block until the lock is ours and return the waiting time.'
+        start = time.time()
+        guard_fd = os.open(self.filename + '.queue',
+                           os.O_CREAT | os.O_RDWR, 0644)
+        try:
+            _flock(guard_fd, fcntl.LOCK_EX)
+            ticket = _read_ticket(guard_fd)
+            os.lseek(guard_fd, 0, os.SEEK_SET)
+            os.ftruncate(guard_fd, 0)
+            os.write(guard_fd, '%d\n' % (ticket + 1))
+            self._node = self._node_name(ticket)
+            self._node_fd = os.open(self._node, os.O_CREAT | os.O_RDWR, 0644)
+            _flock(self._node_fd, fcntl.LOCK_EX)
+        finally:
+            os.close(guard_fd)
+
+        # The older nodes were all created and locked under the guard
+        # before our ticket was taken and none is locked again once
+        # released, so the lock is ours when each of them has been
+        # released. Waiting only for the previous one is not enough:
+        # a dead waiter would let us in while the holder still runs.
+        try:
+            for node in self._older_nodes(ticket):
+                self._wait_node(node)
+        except Exception:
+            self.release()
+            raise
+
+        self.wait_time = time.time() - start
+        return self.wait_time
+
+    def release(self):
+        'Release the lock and wake up the next waiter.'
+        if self._node_fd is not None:
+            _unlink(self._node)
+            os.close(self._node_fd)
+            self._node_fd = None
+            self._node = None
+
+    def locked(self):
+        'Return True if the lock is held by this object.'
+        return self._node_fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class Slots(object):
+    '''A fixed number of slots shared between processes.
+
+Each slot is a <filename>.slot.<n> file locked with flock(2) while it
+is in use, so the slots of a dead process are freed by the kernel.
+acquire() never blocks.
+'''
+
+    def __init__(self, filename, count):
+        self.filename = filename
+        self.count = count
+        self.slot = None
+        self._fd = None
+
+    def acquire(self):
+        'Take a free slot. Returns False if all the slots are in use.'
+        for slot in range(self.count):
+            fd = os.open('%s.slot.%d' % (self.filename, slot),
+                         os.O_CREAT | os.O_RDWR, 0644)
+            try:
+                _flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as xcpt:
+                os.close(fd)
+                if xcpt.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                continue
+            self.slot = slot
+            self._fd = fd
+            return True
+        return False
+
+    def release(self):
+        'Give the slot back.'
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self.slot = None
+
+# locking.py ends here
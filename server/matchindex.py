@@ -0,0 +1,132 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Index of hardware specs used to prune profiles before matching.
+
+A spec line like ('disk', '$disk', 'size', 'gt(100)') can only match a
+hardware line having the same constant fields, here 'disk' in position
+0 and 'size' in position 2. The other fields are variables or
+functions. Each spec line is compiled to a key made of its constant
+positions (the mask) and their values. As every spec line consumes a
+distinct hardware line, a profile can only match if the hardware list
+has at least as many lines with each key as the specs require. This is
+checked by counting the hardware lines per key once, instead of running
+the backtracking matcher on every profile.
+'''
+
+
+def _is_constant(field):
+    'Return True if a spec field must be equal to the hardware field.'
+    if not isinstance(field, basestring):
+        return True
+    return not (field.startswith('$') or field.endswith(')'))
+
+
+def spec_key(spec):
+    'Return the (mask, values) key of a spec line.'
+    mask = tuple([idx for idx in range(len(spec))
+                  if _is_constant(spec[idx])])
+    return (mask, tuple([spec[idx] for idx in mask]))
+
+
+def compile_specs(specs):
+    '''Compile specs into a list of (mask, values, count) requirements.
+
+count is the number of spec lines sharing the same key.
+'''
+    counts = {}
+    for spec in specs:
+        key = spec_key(spec)
+        counts[key] = counts.get(key, 0) + 1
+    return [(mask, values, count)
+            for (mask, values), count in counts.items()]
+
+
+def selective_first(requirements):
+    'Sort requirements to check the most selective ones first.'
+    return sorted(requirements, key=lambda req: -len(req[0]))
+
+
+def load_requirements(filename):
+    'Read a .specs file and compile it.'
+    return compile_specs(eval(open(filename, 'r').read(-1)))
+
+
+class HwCounts(object):
+    'Number of hardware lines per key, computed lazily for each mask.'
+
+    def __init__(self, hw_items):
+        self._hw_items = hw_items
+        self._counts = {}
+
+    def count(self, mask, values):
+        'Return the number of hardware lines matching the key.'
+        try:
+            counts = self._counts[mask]
+        except KeyError:
+            counts = {}
+            last = max(mask) if mask else -1
+            for line in self._hw_items:
+                if len(line) <= last:
+                    continue
+                key = tuple([line[idx] for idx in mask])
+                counts[key] = counts.get(key, 0) + 1
+            self._counts[mask] = counts
+        return counts.get(values, 0)
+
+    def satisfies(self, requirements):
+        'Return True if the hardware can fulfill the requirements.'
+        for mask, values, count in requirements:
+            if self.count(mask, values) < count:
+                return False
+        return True
+
+
+class SpecIndex(object):
+    '''Compiled requirements of a set of profiles.
+
+profiles is a dict associating a profile name to its compiled
+requirements (see compile_specs).
+'''
+
+    def __init__(self, profiles=None):
+        self._profiles = {}
+        for name, requirements in (profiles or {}).items():
+            self.add(name, requirements)
+
+    def add(self, name, requirements):
+        'Add or replace the requirements of a profile.'
+        self._profiles[name] = selective_first(requirements)
+
+    def __contains__(self, name):
+        return name in self._profiles
+
+    def candidates(self, hw_items, names=None):
+        '''Return the set of profiles that could match hw_items.
+
+Only the profiles listed in names are considered if given. Profiles
+unknown to the index are always returned.
+'''
+        if names is None:
+            names = self._profiles.keys()
+        hw_counts = HwCounts(hw_items)
+        result = set()
+        for name in names:
+            requirements = self._profiles.get(name)
+            if requirements is None or hw_counts.satisfies(requirements):
+                result.add(name)
+        return result
+
+# matchindex.py ends here
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Spool of the pxemngr registrations.
+
+upload.py stores each registration as a <sysname>.pxe file in the spool
+directory instead of running pxemngr while the host waits for its
+configure script. A later registration of the same system replaces the
+pending one. The worker drains all the pending registrations at each
+pass and retries the failed ones with an exponential backoff:
+
+$ pxequeue.py [-o] [-i <interval>] <spool directory>
+
+An entry being processed is renamed to <sysname>.pxe.work so a crashed
+worker never loses it. Entries failing MAX_TRIES times are moved to the
+failed sub-directory.
+'''
+
+import commands
+import errno
+import fcntl
+import getopt
+import logging
+import os
+import sys
+import tempfile
+import time
+
+LOG = logging.getLogger('edeploy.pxequeue')
+
+EXTENSION = '.pxe'
+WORK_EXTENSION = EXTENSION + '.work'
+
+# number of attempts before giving up on a registration
+MAX_TRIES = 8
+# delay before the first retry, doubled at each failure
+RETRY_DELAY = 15
+MAX_RETRY_DELAY = 3600
+
+
+def register(sysname, macs):
+    '''Register a system in pxemngr.
+
+Returns the status and the output of the command.
+'''
+    cmd = 'pxemngr addsystem %s %s' % (sysname, ' '.join(macs))
+    status, output = commands.getstatusoutput(cmd)
+    if status != 0:
+        LOG.error('%s -> %d / %s' % (cmd, status, output))
+    else:
+        LOG.info('added %s under pxemngr for MAC addresses %s'
+                 % (sysname, ' '.join(macs)))
+    return status, output
+
+
+def _entry_filename(spool_dir, sysname):
+    return os.path.join(spool_dir, sysname + EXTENSION)
+
+
+def _write_entry(spool_dir, entry, replace=True):
+    '''Write a spool entry durably.
+
+If replace is False, an existing entry of the same system is kept.
+Returns False in this case.
+'''
+    fd, tmpname = tempfile.mkstemp(dir=spool_dir, prefix='.tmp')
+    try:
+        os.write(fd, repr(entry) + '\n')
+        os.fsync(fd)
+        os.close(fd)
+        fd = None
+        fname = _entry_filename(spool_dir, entry['sysname'])
+        if replace:
+            os.rename(tmpname, fname)
+            return True
+        try:
+            os.link(tmpname, fname)
+        except OSError as xcpt:
+            if xcpt.errno != errno.EEXIST:
+                raise
+            return False
+        return True
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+
+
+def _read_entry(fname):
+    try:
+        return eval(open(fname).read(-1))
+    except Exception as xcpt:
+        LOG.error('invalid spool entry %s: %s' % (fname, str(xcpt)))
+        return None
+
+
+def spool(spool_dir, sysname, macs):
+    'Store a registration to be done by the worker.'
+    _write_entry(spool_dir, {'sysname': sysname, 'macs': list(macs),
+                             'tries': 0, 'next': 0})
+
+
+def pending(spool_dir):
+    'Return the names of the systems waiting for their registration.'
+    return sorted([fname[:-len(EXTENSION)]
+                   for fname in os.listdir(spool_dir)
+                   if fname.endswith(EXTENSION)])
+
+
+def _fail(spool_dir, work_name, entry, now):
+    'Reschedule a failed registration or give up on it.'
+    entry['tries'] += 1
+    if entry['tries'] >= MAX_TRIES:
+        failed_dir = os.path.join(spool_dir, 'failed')
+        if not os.path.isdir(failed_dir):
+            os.mkdir(failed_dir)
+        LOG.error('giving up on the registration of %s' % entry['sysname'])
+        os.rename(work_name, os.path.join(failed_dir,
+                                          entry['sysname'] + EXTENSION))
+        return
+    entry['next'] = now + min(
+        RETRY_DELAY * 2 ** (entry['tries'] - 1), MAX_RETRY_DELAY)
+    # a new registration of the system replaces the failed one
+    _write_entry(spool_dir, entry, replace=False)
+    os.unlink(work_name)
+
+
+def process(spool_dir, register_func=register, now=None):
+    '''Run the pending registrations of a spool directory.
+
+Returns the number of successful registrations.
+'''
+    if now is None:
+        now = time.time()
+    # recover the entries of a crashed worker
+    for fname in os.listdir(spool_dir):
+        if fname.endswith(WORK_EXTENSION):
+            work_name = os.path.join(spool_dir, fname)
+            entry = _read_entry(work_name)
+            if entry is not None:
+                _write_entry(spool_dir, entry, replace=False)
+            os.unlink(work_name)
+
+    done = 0
+    for sysname in pending(spool_dir):
+        fname = _entry_filename(spool_dir, sysname)
+        entry = _read_entry(fname)
+        if entry is None or entry['next'] > now:
+            continue
+        work_name = fname + '.work'
+        try:
+            os.rename(fname, work_name)
+        except OSError as xcpt:
+            if xcpt.errno != errno.ENOENT:
+                raise
+            continue
+        # the entry may have been replaced between the read and the rename
+        entry = _read_entry(work_name) or entry
+        status, _ = register_func(entry['sysname'], entry['macs'])
+        if status == 0:
+            os.unlink(work_name)
+            done += 1
+        else:
+            _fail(spool_dir, work_name, entry, now)
+    return done
+
+
+def run_worker(spool_dir, interval, once=False):
+    'Process the spool directory every interval seconds.'
+    lock_file = open(os.path.join(spool_dir, '.lock'), 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as xcpt:
+        if xcpt.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        LOG.error('another worker is processing %s' % spool_dir)
+        return False
+    while True:
+        done = process(spool_dir)
+        if done:
+            LOG.info('%d systems registered' % done)
+        if once:
+            return True
+        time.sleep(interval)
+
+
+def usage():
+    'Print the command line help.'
+    print 'pxequeue.py [-o] [-i <interval>] <spool directory>'
+
+
+def main():
+    'Worker entry point.'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hoi:',
+                                   ['help', 'once', 'interval='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    once = False
+    interval = 5
+
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+        elif opt in ('-o', '--once'):
+            once = True
+        elif opt in ('-i', '--interval'):
+            interval = float(arg)
+
+    if len(args) != 1:
+        usage()
+        sys.exit(2)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(asctime)s] [eDeploy] pxequeue.py: '
+                        '%(message)s')
+    if not run_worker(args[0], interval, once):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+# pxequeue.py ends here
@@ -0,0 +1,101 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache
+
+LOADS = []
+
+
+def load(filename):
+    LOADS.append(filename)
+    return open(filename).read(-1)
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'vm.specs')
+        self.write('first')
+        del LOADS[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, content):
+        # replace the file like upload_state does
+        with open(self.fname + '.tmp', 'w') as tmp_file:
+            tmp_file.write(content)
+        os.rename(self.fname + '.tmp', self.fname)
+
+    def test_hit(self):
+        fcache = cache.FileCache()
+        self.assertEqual(fcache.get(self.fname, load), 'first')
+        self.assertEqual(fcache.get(self.fname, load), 'first')
+        self.assertEqual(len(LOADS), 1)
+        self.assertEqual((fcache.hits, fcache.misses), (1, 1))
+
+    def test_modified(self):
+        fcache = cache.FileCache()
+        fcache.get(self.fname, load)
+        self.write('second')
+        self.assertEqual(fcache.get(self.fname, load), 'second')
+        self.assertEqual(len(LOADS), 2)
+
+    def test_put(self):
+        fcache = cache.FileCache()
+        fcache.get(self.fname, load)
+        self.write('second')
+        fcache.put(self.fname, load, 'second')
+        self.assertEqual(fcache.get(self.fname, load), 'second')
+        self.assertEqual(len(LOADS), 1)
+
+    def test_depends(self):
+        fcache = cache.FileCache()
+        dep = os.path.join(self.tmpdir, 'vm.specs.journal')
+        fcache.get(self.fname, load, [dep])
+        fcache.get(self.fname, load, [dep])
+        self.assertEqual(len(LOADS), 1)
+        open(dep, 'w').write('record\n')
+        fcache.get(self.fname, load, [dep])
+        self.assertEqual(len(LOADS), 2)
+
+    def test_disk(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        os.mkdir(cache_dir)
+        cache.DiskCache(cache_dir).get(self.fname, load)
+        dcache = cache.DiskCache(cache_dir)
+        self.assertEqual(dcache.get(self.fname, load), 'first')
+        self.assertEqual(len(LOADS), 1)
+        self.write('second')
+        self.assertEqual(dcache.get(self.fname, load), 'second')
+        self.assertEqual(len(LOADS), 2)
+
+    def test_disk_error(self):
+        dcache = cache.DiskCache(os.path.join(self.tmpdir, 'missing'))
+        self.assertEqual(dcache.get(self.fname, load), 'first')
+        self.assertEqual(dcache.get(self.fname, load), 'first')
+        self.assertEqual(len(LOADS), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_cache.py ends here
@@ -0,0 +1,80 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache
+import cmdbindex
+import journal
+
+
+class TestCmdbIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'vm.cmdb')
+        self.write("[{'ip': '10.0.0.1', 'mac': 'm1', 'used': 1},\n"
+                   " {'ip': '10.0.0.2'}]\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, content):
+        with open(self.fname + '.tmp', 'w') as tmp_file:
+            tmp_file.write(content)
+        os.rename(self.fname + '.tmp', self.fname)
+
+    def test_list(self):
+        index = cmdbindex.CmdbIndex([self.fname])
+        self.assertEqual(index.find('ip', '10.0.0.1'), (self.fname, 0))
+        self.assertTrue(index.is_used('mac', 'm1'))
+        self.assertFalse(index.is_used('ip', '10.0.0.2'))
+        self.assertFalse(index.is_used('hostname', '10.0.0.1'))
+
+    def test_lazy(self):
+        self.write("lazy_cmdb({'ip': '10.0.0-255.0-255'},\n"
+                   "          entries={4242: {'ip': '10.0.16.146',\n"
+                   "                          'used': 1}})\n")
+        index = cmdbindex.CmdbIndex([self.fname])
+        self.assertEqual(index.find('ip', '10.0.16.146'), (self.fname, 4242))
+        self.assertFalse(index.is_used('ip', '10.0.0.1'))
+
+    def test_journal(self):
+        fcache = cache.FileCache()
+        index = cmdbindex.CmdbIndex([self.fname], fcache)
+        self.assertFalse(index.is_used('ip', '10.0.0.2'))
+        entry = {'ip': '10.0.0.2', 'used': 1}
+        journal.append(self.fname, journal.cmdb_record(
+            1, {'ip': '10.0.0.2'}, entry, 'vm-S2'))
+        self.assertTrue(index.is_used('ip', '10.0.0.2'))
+        self.assertEqual(index.find('sysname', 'vm-S2'), (self.fname, 1))
+        self.assertTrue(index.is_used('ip', '10.0.0.1'))
+        self.assertEqual(fcache.misses, 2)
+
+    def test_modified(self):
+        index = cmdbindex.CmdbIndex([self.fname])
+        self.assertTrue(index.is_used('ip', '10.0.0.1'))
+        self.write("[{'ip': '10.0.0.1'}, {'ip': '10.0.0.2', 'used': 1}]\n")
+        self.assertFalse(index.is_used('ip', '10.0.0.1'))
+        self.assertTrue(index.is_used('ip', '10.0.0.2'))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_cmdbindex.py ends here
@@ -0,0 +1,108 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import pprint
+import shutil
+import tempfile
+import unittest
+
+import fingerprint
+import upload_state
+
+HW = [('disk', 'vda', 'size', '20'),
+      ('system', 'product', 'serial', 'S1'),
+      ('network', 'eth0', 'serial', '52:54:00:00:00:01'),
+      ('network', 'eth0', 'ipv4', '10.0.0.12')]
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_stable(self):
+        self.assertEqual(fingerprint.fingerprint(HW),
+                         fingerprint.fingerprint(list(reversed(HW))))
+        # volatile lines are ignored
+        self.assertEqual(fingerprint.fingerprint(HW),
+                         fingerprint.fingerprint(
+                             HW[:3] + [('network', 'eth0', 'ipv4',
+                                        '10.0.0.13')]))
+
+    def test_changed(self):
+        self.assertNotEqual(fingerprint.fingerprint(HW),
+                            fingerprint.fingerprint(
+                                HW[:2] + [('network', 'eth0', 'serial',
+                                           '52:54:00:00:00:02')]))
+        self.assertNotEqual(fingerprint.fingerprint(HW),
+                            fingerprint.fingerprint(
+                                HW + [('disk', 'vdb', 'size', '20')]))
+
+
+class TestKnownHardware(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cfg_dir = self.tmpdir + '/'
+        self.fpr_dir = os.path.join(self.tmpdir, 'fingerprints')
+        os.mkdir(self.fpr_dir)
+        self.write('state', [('vm', 2)])
+        self.write('vm.specs', [('disk', '$disk', 'size', '20')])
+        self.write('vm.cmdb', [{'ip': '10.0.0.1'}, {'ip': '10.0.0.2'}])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        with open(self.cfg_dir + name, 'w') as out:
+            pprint.pprint(data, stream=out)
+
+    def state(self):
+        state_obj = upload_state.State(
+            lockname=os.path.join(self.tmpdir, 'edeploy.lock'),
+            fingerprint_dir=self.fpr_dir)
+        state_obj.load(self.cfg_dir)
+        return state_obj
+
+    def test_reuse(self):
+        name, var = self.state().find_match(HW)
+        self.assertEqual((name, var['ip']), ('vm', '10.0.0.1'))
+        state_obj = self.state()
+        del state_obj.lock_waits[:]
+        self.assertEqual(state_obj.find_match(HW), (name, var))
+        # no count is consumed by a re-deploy
+        self.assertEqual(state_obj._data, [('vm', 1)])
+        # the CMDB is read under its lock
+        self.assertEqual([lock for lock, _ in state_obj.lock_waits],
+                         ['edeploy.lock.vm'])
+
+    def test_entry_changed(self):
+        self.state().find_match(HW)
+        # the administrator freed the entry
+        self.write('vm.cmdb', [{'ip': '10.0.0.1'}, {'ip': '10.0.0.2'}])
+        state_obj = self.state()
+        state_obj.find_match(HW)
+        self.assertEqual(state_obj._data, [('vm', 0)])
+
+    def test_forget(self):
+        self.state().find_match(HW)
+        self.state().forget(HW)
+        state_obj = self.state()
+        state_obj.find_match(HW)
+        self.assertEqual(state_obj._data, [('vm', 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_fingerprint.py ends here
@@ -0,0 +1,78 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import healthblobs
+
+HW = [('disk', 'sda', 'size', '300'),
+      ('disk', 'sda', 'standalone_randread_4k_IOps', '980 '),
+      ('disk', 'sda', 'vendor', 'HP'),
+      ('network', 'eth0', 'ipv4', '10.0.0.12'),
+      ('network', 'eth0', 'serial', '52:54:00:00:00:01'),
+      ('cpu', 'logical', 'bandwidth_1G', '6000')]
+
+
+class TestHealthBlobs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.blob_dir = os.path.join(self.tmpdir, 'blobs')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_split(self):
+        template, values, positions = healthblobs.split(HW)
+        self.assertEqual(template[:2], [HW[0], ('disk', 'sda',
+                                                'standalone_randread_4k_IOps',
+                                                None)])
+        self.assertEqual(values, ['980 ', '10.0.0.12', '6000'])
+        self.assertEqual(positions, [1, 3, 5])
+        self.assertEqual(healthblobs.join(template, values, positions), HW)
+
+    def test_none_value(self):
+        # an inventory item holding None is not taken for a measurement
+        hw_items = [('disk', 'sda', 'vendor', None)] + HW
+        fname = os.path.join(self.tmpdir, 'host1.hwref')
+        healthblobs.save(self.blob_dir, fname, hw_items)
+        self.assertEqual(healthblobs.load(fname), hw_items)
+
+    def test_dedup(self):
+        first = os.path.join(self.tmpdir, 'host1.hwref')
+        second = os.path.join(self.tmpdir, 'host2.hwref')
+        healthblobs.save(self.blob_dir, first, HW)
+        other = HW[:1] + [('disk', 'sda', 'standalone_randread_4k_IOps',
+                           '1012')] + HW[2:]
+        healthblobs.save(self.blob_dir, second, other)
+        self.assertEqual(len(glob.glob(os.path.join(self.blob_dir, '*', '*'))),
+                         1)
+        self.assertEqual(healthblobs.load(first), HW)
+        self.assertEqual(healthblobs.load(second), other)
+
+    def test_load_hw(self):
+        fname = os.path.join(self.tmpdir, 'host1.hw')
+        open(fname, 'w').write(repr(HW))
+        self.assertEqual(healthblobs.load(fname), HW)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_healthblobs.py ends here
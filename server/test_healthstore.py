@@ -0,0 +1,121 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import healthstore
+
+HW1 = [('disk', 'sda', 'standalone_randread_4k_IOps', '980 '),
+       ('disk', 'sdb', 'standalone_randread_4k_IOps', '1556 '),
+       ('disk', 'sda', 'vendor', 'HP'),
+       ('cpu', 'logical', 'number', '24')]
+HW2 = [('disk', 'sda', 'standalone_randread_4k_IOps', '1012'),
+       ('memory', 'total', 'size', '68719476736')]
+
+
+class TestHealthStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.tmpdir, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def fill(self):
+        store = healthstore.HealthStore(self.store_dir)
+        self.assertEqual(store.ingest('host1', '2015_01_01-10h00', HW1), 0)
+        self.assertEqual(store.ingest('host2', '2015_01_01-10h00', HW2), 1)
+
+    def test_column(self):
+        self.fill()
+        store = healthstore.HealthStore(self.store_dir)
+        hosts, values = store.column(('disk', 'sda',
+                                      'standalone_randread_4k_IOps'))
+        self.assertEqual(list(hosts), [0, 1])
+        self.assertEqual(list(values), [980.0, 1012.0])
+        self.assertEqual(store.hosts()[1], ('host2', '2015_01_01-10h00'))
+        # non numeric values are not stored
+        self.assertEqual(map(list, store.column(('disk', 'sda', 'vendor'))),
+                         [[], []])
+
+    def test_select(self):
+        self.fill()
+        store = healthstore.HealthStore(self.store_dir)
+        result = store.select('disk', level3='standalone_randread_4k_IOps')
+        self.assertEqual([(key[1], list(hosts), list(values))
+                          for key, hosts, values in result],
+                         [('sda', [0, 1], [980.0, 1012.0]),
+                          ('sdb', [0], [1556.0])])
+
+    def test_interrupted(self):
+        self.fill()
+        store = healthstore.HealthStore(self.store_dir)
+        column = store.keys()[('cpu', 'logical', 'number')]
+        # values and a partial host line written before a crash
+        with open(os.path.join(self.store_dir, '%s.v' % column),
+                  'ab') as out:
+            out.write('\0' * 12)
+        with open(os.path.join(self.store_dir, 'hosts'), 'ab') as out:
+            out.write("('host3'")
+        store.ingest('host4', '2015_01_02-10h00', HW1)
+        store = healthstore.HealthStore(self.store_dir)
+        self.assertEqual([host[0] for host in store.hosts()],
+                         ['host1', 'host2', 'host4'])
+        hosts, values = store.column(('cpu', 'logical', 'number'))
+        self.assertEqual(list(hosts), [0, 2])
+        self.assertEqual(list(values), [24.0, 24.0])
+
+    def test_interrupted_host(self):
+        self.fill()
+        # a host line whose offset was not recorded before a crash
+        with open(os.path.join(self.store_dir, 'hosts'), 'ab') as out:
+            out.write("('host3', '2015_01_02-10h00')\n")
+        store = healthstore.HealthStore(self.store_dir)
+        self.assertEqual(len(store.hosts()), 2)
+        self.assertEqual(store.ingest('host4', '2015_01_02-10h00', HW2), 2)
+        self.assertEqual([host[0] for host in store.hosts()],
+                         ['host1', 'host2', 'host4'])
+
+    def test_interrupted_key(self):
+        # a partial key line longer than a block
+        os.makedirs(self.store_dir)
+        with open(os.path.join(self.store_dir, 'keys'), 'w') as out:
+            out.write("('disk', 'sda', 'size')\n('x" +
+                      'x' * healthstore.BLOCK_SIZE)
+        self.fill()
+        store = healthstore.HealthStore(self.store_dir)
+        self.assertEqual(sorted(store.keys()),
+                         sorted(set([item[:3] for item in HW1 + HW2
+                                     if item[2] != 'vendor'] +
+                                    [('disk', 'sda', 'size')])))
+
+    def test_unicode_key(self):
+        self.fill()
+        store = healthstore.HealthStore(self.store_dir)
+        store.ingest('host3', '2015_01_02-10h00',
+                     [(u'cpu', u'logical', u'number', u'32')])
+        hosts, values = store.column(('cpu', 'logical', 'number'))
+        self.assertEqual(list(hosts), [0, 2])
+        self.assertEqual(len(store.keys()), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_healthstore.py ends here
@@ -0,0 +1,129 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import pprint
+import shutil
+import tempfile
+import unittest
+
+import journal
+import upload_state
+
+HW = [('disk', 'vda', 'size', '20'),
+      ('system', 'product', 'serial', 'S1')]
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'state')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_missing(self):
+        self.assertEqual(journal.read(self.fname), [])
+
+    def test_truncated(self):
+        journal.append(self.fname, journal.state_record('vm', 3))
+        with open(journal.journal_filename(self.fname), 'a') as jfile:
+            jfile.write("{'name': 'vm', 'ti")
+        records = journal.read(self.fname)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['times'], 3)
+
+    def test_apply_state(self):
+        data = [('hp', 3), ('vm', '*')]
+        journal.apply_state(data, [journal.state_record('hp', 2),
+                                   journal.state_record('hp', 1)])
+        self.assertEqual(data, [('hp', 1), ('vm', '*')])
+
+    def test_apply_cmdb_twice(self):
+        dbase = [{'ip': '10.0.0.1'}, {'ip': '10.0.0.1'}]
+        records = [journal.cmdb_record(0, {'ip': '10.0.0.1'},
+                                       {'ip': '10.0.0.1', 'used': 1}, 'S1')]
+        journal.apply_cmdb(dbase, records)
+        journal.apply_cmdb(dbase, records)
+        self.assertEqual(dbase, [{'ip': '10.0.0.1', 'used': 1},
+                                 {'ip': '10.0.0.1'}])
+
+    def test_apply_cmdb_moved(self):
+        dbase = [{'ip': '10.0.0.0'}, {'ip': '10.0.0.1'}]
+        journal.apply_cmdb(dbase, [journal.cmdb_record(
+            0, {'ip': '10.0.0.1'}, {'ip': '10.0.0.1', 'used': 1}, 'S1')])
+        self.assertEqual(dbase, [{'ip': '10.0.0.0'},
+                                 {'ip': '10.0.0.1', 'used': 1}])
+
+
+class TestJournalState(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cfg_dir = self.tmpdir + '/'
+        self.write('state', [('vm', 2)])
+        self.write('vm.specs', [('disk', '$disk', 'size', '20')])
+        self.write('vm.cmdb', [{'ip': '10.0.0.1'}, {'ip': '10.0.0.2'}])
+        self.lockname = os.path.join(self.tmpdir, 'edeploy.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        with open(self.cfg_dir + name, 'w') as out:
+            pprint.pprint(data, stream=out)
+
+    def read(self, name):
+        return eval(open(self.cfg_dir + name).read(-1))
+
+    def state(self, use_journal=True):
+        state_obj = upload_state.State(lockname=self.lockname,
+                                       journal=use_journal)
+        state_obj.load(self.cfg_dir)
+        return state_obj
+
+    def test_match(self):
+        name, var = self.state().find_match(HW)
+        self.assertEqual((name, var['ip']), ('vm', '10.0.0.1'))
+        # the files are untouched
+        self.assertEqual(self.read('state'), [('vm', 2)])
+        self.assertEqual(self.read('vm.cmdb'),
+                         [{'ip': '10.0.0.1'}, {'ip': '10.0.0.2'}])
+        name, var = self.state().find_match(
+            [('disk', 'vdb', 'size', '20')])
+        self.assertEqual(var['ip'], '10.0.0.2')
+        self.assertEqual(self.state()._data, [('vm', 0)])
+
+    def test_compact(self):
+        self.state().find_match(HW)
+        self.state().compact()
+        self.assertEqual(self.read('state'), [('vm', 1)])
+        self.assertEqual(self.read('vm.cmdb')[0]['used'], 1)
+        self.assertFalse(os.path.exists(self.cfg_dir + 'vm.cmdb.journal'))
+        self.assertFalse(os.path.exists(self.cfg_dir + 'state.journal'))
+
+    def test_disabled(self):
+        self.state().find_match(HW)
+        # the journals are folded back when not in journal mode
+        self.state(use_journal=False)
+        self.assertEqual(self.read('state'), [('vm', 1)])
+        self.assertFalse(os.path.exists(self.cfg_dir + 'state.journal'))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_journal.py ends here
@@ -0,0 +1,124 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import copy
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from hardware import cmdb
+from hardware import generate
+
+import lazycmdb
+import upload_state
+
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+MODEL = {'ip': '10.0.0.1-3',
+         'hostname': 'node1-3',
+         'gateway': '10.0.0.254'}
+
+
+class TestLazyCmdb(unittest.TestCase):
+
+    def assertSameGenerate(self, model):
+        self.assertEqual(list(lazycmdb.generate(copy.deepcopy(model))),
+                         generate.generate(copy.deepcopy(model)))
+
+    def test_ranges(self):
+        self.assertSameGenerate(MODEL)
+        self.assertSameGenerate({'ip': '10.0.1-2.250-3',
+                                 'name': 'node008-011:20-18.domain',
+                                 'disk': ['sda', 'sdb', 'sdc']})
+        self.assertSameGenerate({'ip': '10.0.0:1.1-2', 'hostname': 'x'})
+
+    def test_samples(self):
+        for fname in glob.glob(os.path.join(TOPDIR, 'config', '*.cmdb')):
+            content = open(fname).read(-1)
+            self.assertEqual(list(lazycmdb.parse(content)),
+                             eval(content, {'generate': generate.generate}))
+
+    def test_large(self):
+        dbase = lazycmdb.generate({'ip': '10.0-255.0-255.1',
+                                   'hostname': 'node1-65536'})
+        self.assertEqual(len(dbase), 65536)
+        self.assertEqual(dbase[65535], {'ip': '10.255.255.1',
+                                        'hostname': 'node65536'})
+
+    def test_update(self):
+        dbase = lazycmdb.generate(MODEL)
+        expected = generate.generate(copy.deepcopy(MODEL))
+        for var, pref, forced in (({'mac': 'm1'}, {'mac': 'm1'}, False),
+                                  ({'mac': 'm2'}, {'mac': 'm2'}, False),
+                                  ({'mac': 'm1'}, {'mac': 'm1'}, False),
+                                  ({'hostname': 'node3'},
+                                   {'hostname': 'node3'}, True)):
+            idx, orig = lazycmdb.update_cmdb(dbase, dict(var), pref, forced)
+            cmdb.update_cmdb(expected, dict(var), pref, forced)
+            self.assertEqual(list(dbase), expected)
+        self.assertRaises(cmdb.CmdbError, lazycmdb.update_cmdb,
+                          dbase, {}, {'mac': 'm4'}, False)
+
+    def test_saved(self):
+        dbase = lazycmdb.generate(MODEL)
+        lazycmdb.update_cmdb(dbase, {'mac': 'm1'}, {'mac': 'm1'}, False)
+        saved = lazycmdb.parse(repr(dbase))
+        self.assertEqual(list(saved), list(dbase))
+        self.assertEqual(lazycmdb.allocated(saved),
+                         [dict(dbase[0], used=1)])
+        self.assertEqual(saved.next_free(), 1)
+
+
+class TestSavedFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cfg_dir = self.tmpdir + '/'
+        with open(self.cfg_dir + 'state', 'w') as out:
+            out.write("[('vm', '*')]")
+        with open(self.cfg_dir + 'vm.specs', 'w') as out:
+            out.write("[('disk', '$disk', 'size', '20')]")
+        with open(self.cfg_dir + 'vm.cmdb', 'w') as out:
+            out.write('generate(%r)' % MODEL)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def match(self, lazy_cmdb):
+        state_obj = upload_state.State(
+            lockname=os.path.join(self.tmpdir, 'edeploy.lock'),
+            lazy_cmdb=lazy_cmdb)
+        state_obj.load(self.cfg_dir)
+        state_obj.find_match([('disk', 'vda', 'size', '20')])
+        return open(self.cfg_dir + 'vm.cmdb').read(-1)
+
+    def test_expanded(self):
+        # readable by hardware.cmdb by default
+        self.match(False)
+        expected = generate.generate(copy.deepcopy(MODEL))
+        expected[0].update({'disk': 'vda', 'used': 1})
+        self.assertEqual(cmdb.load_cmdb(self.cfg_dir, 'vm'), expected)
+
+    def test_lazy(self):
+        self.assertTrue(self.match(True).startswith('lazy_cmdb('))
+        self.assertTrue(self.match(True).startswith('lazy_cmdb('))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_lazycmdb.py ends here
@@ -0,0 +1,153 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+import locking
+
+
+class TestQueueLock(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lockname = os.path.join(self.tmpdir, 'edeploy.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _wait_ticket(self, ticket):
+        'Wait for the waiter of a ticket to create its node file.'
+        while not os.path.exists('%s.queue.%d.wait' % (self.lockname,
+                                                       ticket)):
+            time.sleep(0.01)
+
+    def test_acquire_release(self):
+        qlock = locking.QueueLock(self.lockname)
+        qlock.acquire()
+        self.assertTrue(qlock.locked())
+        qlock.release()
+        self.assertFalse(qlock.locked())
+        self.assertEquals(os.listdir(self.tmpdir), ['edeploy.lock.queue'])
+
+    def test_fifo(self):
+        order = []
+        first = locking.QueueLock(self.lockname)
+        first.acquire()
+
+        def waiter(idx):
+            with locking.QueueLock(self.lockname):
+                order.append(idx)
+
+        threads = []
+        for idx in range(5):
+            thr = threading.Thread(target=waiter, args=(idx,))
+            thr.start()
+            threads.append(thr)
+            # let the thread take its ticket before starting the next one
+            self._wait_ticket(idx + 1)
+        first.release()
+        for thr in threads:
+            thr.join()
+        self.assertEquals(order, range(5))
+
+    def test_wait_time(self):
+        first = locking.QueueLock(self.lockname)
+        first.acquire()
+        second = locking.QueueLock(self.lockname)
+        thr = threading.Thread(target=second.acquire)
+        thr.start()
+        time.sleep(0.2)
+        first.release()
+        thr.join()
+        second.release()
+        self.assertTrue(second.wait_time >= 0.2)
+
+    def test_stale_node(self):
+        # a holder that died leaves its node file behind unlocked
+        open(self.lockname + '.queue', 'w').write('4\n')
+        open('%s.queue.3.wait' % self.lockname, 'w').close()
+        qlock = locking.QueueLock(self.lockname)
+        qlock.acquire()
+        qlock.release()
+        self.assertEquals(os.listdir(self.tmpdir), ['edeploy.lock.queue'])
+
+    def test_dead_waiter(self):
+        # a waiter killed between the holder and us must not let us in
+        holder = locking.QueueLock(self.lockname)
+        holder.acquire()
+        pid = os.fork()
+        if pid == 0:
+            locking.QueueLock(self.lockname).acquire()
+            os._exit(0)
+        self._wait_ticket(1)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        acquired = threading.Event()
+        last = locking.QueueLock(self.lockname)
+
+        def waiter():
+            with last:
+                acquired.set()
+
+        thr = threading.Thread(target=waiter)
+        thr.start()
+        self._wait_ticket(2)
+        acquired.wait(0.3)
+        self.assertFalse(acquired.is_set())
+        holder.release()
+        thr.join()
+        self.assertTrue(acquired.is_set())
+        self.assertEquals(os.listdir(self.tmpdir), ['edeploy.lock.queue'])
+
+    def test_legacy_lockfile(self):
+        # the file of the old O_EXCL lock is neither used nor created
+        open(self.lockname, 'w').close()
+        with locking.QueueLock(self.lockname) as qlock:
+            self.assertTrue(qlock.locked())
+        os.unlink(self.lockname)
+        with locking.QueueLock(self.lockname):
+            self.assertFalse(os.path.exists(self.lockname))
+
+
+class TestSlots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lockname = os.path.join(self.tmpdir, 'edeploy.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_bounded(self):
+        slots = [locking.Slots(self.lockname, 2) for _ in range(3)]
+        self.assertTrue(slots[0].acquire())
+        self.assertTrue(slots[1].acquire())
+        self.assertFalse(slots[2].acquire())
+        self.assertEquals(sorted([slots[0].slot, slots[1].slot]), [0, 1])
+        slots[0].release()
+        self.assertTrue(slots[2].acquire())
+        self.assertEquals(slots[2].slot, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_locking.py ends here
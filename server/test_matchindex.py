@@ -0,0 +1,132 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import glob
+import os
+import pprint
+import shutil
+import tempfile
+import unittest
+
+from hardware import matcher
+
+import matchindex
+import upload_state
+
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+
+class TestMatchIndex(unittest.TestCase):
+
+    def test_spec_key(self):
+        self.assertEquals(
+            matchindex.spec_key(('disk', '$disk', 'size', 'gt(100)')),
+            ((0, 2), ('disk', 'size')))
+        self.assertEquals(
+            matchindex.spec_key(('network', '$eth', 'ipv4',
+                                 '$ip=network(10.0.0.0/8)')),
+            ((0, 2), ('network', 'ipv4')))
+
+    def test_count(self):
+        specs = [('disk', '$disk1', 'size', '100'),
+                 ('disk', '$disk2', 'size', '100'),
+                 ('cpu', 'logical', 'number', '$ncpus')]
+        index = matchindex.SpecIndex(
+            {'two': matchindex.compile_specs(specs)})
+        one_disk = [('disk', 'sda', 'size', '100'),
+                    ('cpu', 'logical', 'number', '8')]
+        two_disks = one_disk + [('disk', 'sdb', 'size', '100')]
+        self.assertEquals(index.candidates(one_disk), set())
+        self.assertEquals(index.candidates(two_disks), set(['two']))
+
+    def test_unknown_profile(self):
+        index = matchindex.SpecIndex()
+        self.assertEquals(index.candidates([], ['vm']), set(['vm']))
+
+    def test_samples(self):
+        # the index must never reject a profile the matcher accepts
+        specs = {}
+        for fname in glob.glob(os.path.join(TOPDIR, 'config', '*.specs')):
+            try:
+                specs[os.path.basename(fname)[:-6]] = eval(
+                    open(fname).read(-1))
+            except TypeError:
+                # some samples are not valid specs
+                continue
+        index = matchindex.SpecIndex(
+            dict([(name, matchindex.compile_specs(specs[name]))
+                  for name in specs]))
+        hw_files = (glob.glob(os.path.join(TOPDIR, 'config', 'hw', '*.hw')) +
+                    glob.glob(os.path.join(TOPDIR, 'health', '*.hw')))
+        for hw_file in hw_files:
+            hw_items = eval(open(hw_file).read(-1))
+            candidates = index.candidates(hw_items)
+            for name in specs:
+                if matcher.match_all(hw_items, specs[name], {}, {}):
+                    self.assertIn(name, candidates)
+
+
+class TestStateIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cfg_dir = self.tmpdir + '/'
+        self.write('vm.specs', [('disk', '$disk', 'size', '20')])
+        self.write('vm.cmdb', [{'ip': '10.0.0.1'}])
+        self.write('big.specs', [('disk', '$disk1', 'size', '20'),
+                                 ('disk', '$disk2', 'size', '20')])
+        self.lockname = os.path.join(self.tmpdir, 'edeploy.lock')
+        self.loaded = []
+        self.load_specs = upload_state.load_specs
+
+        def load_specs(filename):
+            self.loaded.append(os.path.basename(filename))
+            return self.load_specs(filename)
+
+        upload_state.load_specs = load_specs
+
+    def tearDown(self):
+        upload_state.load_specs = self.load_specs
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        with open(self.cfg_dir + name, 'w') as out:
+            pprint.pprint(data, stream=out)
+
+    def find_match(self, hw_items):
+        state_obj = upload_state.State(lockname=self.lockname)
+        state_obj.load(self.cfg_dir)
+        return state_obj.find_match(hw_items)[0]
+
+    def test_parsed_once(self):
+        # the rejected profile and the matching one are read once each
+        self.write('state', [('big', 1), ('vm', 1), ('other', 1)])
+        self.assertEqual(self.find_match([('disk', 'vda', 'size', '20')]),
+                         'vm')
+        self.assertEqual(self.loaded, ['big.specs', 'vm.specs'])
+
+    def test_broken_specs(self):
+        # a broken profile does not prevent matching the previous ones
+        self.write('state', [('vm', 2), ('broken', 1)])
+        with open(self.cfg_dir + 'broken.specs', 'w') as out:
+            out.write("[('disk', 'vda', 'size', '20') ('cpu')]")
+        self.assertEqual(self.find_match([('disk', 'vda', 'size', '20')]),
+                         'vm')
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_matchindex.py ends here
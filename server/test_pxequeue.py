@@ -0,0 +1,84 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pxequeue
+
+
+class TestPxeQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.calls = []
+        self.status = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def register(self, sysname, macs):
+        self.calls.append((sysname, macs))
+        return self.status, ''
+
+    def process(self, now=None):
+        return pxequeue.process(self.spool_dir, self.register, now)
+
+    def test_coalesce(self):
+        pxequeue.spool(self.spool_dir, 'S1', ['52:54:00:00:00:01'])
+        pxequeue.spool(self.spool_dir, 'S2', ['52:54:00:00:00:02'])
+        pxequeue.spool(self.spool_dir, 'S1', ['52:54:00:00:00:03'])
+        self.assertEqual(pxequeue.pending(self.spool_dir), ['S1', 'S2'])
+        self.assertEqual(self.process(), 2)
+        self.assertEqual(self.calls, [('S1', ['52:54:00:00:00:03']),
+                                      ('S2', ['52:54:00:00:00:02'])])
+        self.assertEqual(pxequeue.pending(self.spool_dir), [])
+
+    def test_retry(self):
+        pxequeue.spool(self.spool_dir, 'S1', ['52:54:00:00:00:01'])
+        self.status = 1
+        self.assertEqual(self.process(now=0), 0)
+        # not retried before its delay
+        self.process(now=0)
+        self.assertEqual(len(self.calls), 1)
+        self.status = 0
+        self.assertEqual(self.process(now=pxequeue.MAX_RETRY_DELAY * 2), 1)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_give_up(self):
+        pxequeue.spool(self.spool_dir, 'S1', ['52:54:00:00:00:01'])
+        self.status = 1
+        for attempt in range(pxequeue.MAX_TRIES):
+            self.process(now=attempt * pxequeue.MAX_RETRY_DELAY)
+        self.assertEqual(len(self.calls), pxequeue.MAX_TRIES)
+        self.assertEqual(pxequeue.pending(self.spool_dir), [])
+        self.assertTrue(os.path.exists(os.path.join(self.spool_dir, 'failed',
+                                                    'S1.pxe')))
+
+    def test_recover(self):
+        pxequeue.spool(self.spool_dir, 'S1', ['52:54:00:00:00:01'])
+        fname = os.path.join(self.spool_dir, 'S1.pxe')
+        # worker crashed while processing the entry
+        os.rename(fname, fname + '.work')
+        self.assertEqual(self.process(), 1)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_pxequeue.py ends here
@@ -0,0 +1,59 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+import timing
+
+
+class TestTiming(unittest.TestCase):
+
+    def test_line(self):
+        timer = timing.Timer()
+        with timer.phase('match'):
+            pass
+        timer.add('match', 1.0)
+        timer.record(profile='hp', size=1600)
+        data = timing.parse_line('[date] [eDeploy] upload.py(42): ' +
+                                 timer.line())
+        self.assertEqual(data['profile'], 'hp')
+        self.assertEqual(data['size'], 1600)
+        self.assertTrue(1.0 <= data['phases']['match'] < 1.1)
+        self.assertTrue('total' in data['phases'])
+
+    def test_parse_invalid(self):
+        self.assertEqual(timing.parse_line('lock wait: edeploy.lock=0s'),
+                         None)
+        self.assertEqual(timing.parse_line('timing: {"phases"'), None)
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(timing.percentile(values, 50), 50)
+        self.assertEqual(timing.percentile(values, 99), 99)
+        self.assertEqual(timing.percentile([3], 95), 3)
+        self.assertEqual(timing.percentile([], 95), None)
+
+    def test_summarize(self):
+        records = [{'phases': {'match': seconds, 'total': seconds * 2}}
+                   for seconds in (0.3, 0.1, 0.2)]
+        summary = timing.summarize(records, (50, 99))
+        self.assertEqual(summary['match'], (3, [0.2, 0.3], 0.3))
+        self.assertEqual(summary['total'][0], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_timing.py ends here
@@ -0,0 +1,118 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import json
+import os
+import pprint
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import upload
+import upload_state
+
+HW = [('disk', 'sda', 'size', '100'),
+      ('cpu', 'logical', 'number', 8),
+      ('system', 'product', 'name', u'caf\xe9 [1, 2]')]
+
+
+class TestReadHw(unittest.TestCase):
+
+    def setUp(self):
+        self.content = json.dumps(HW, indent=2)
+        self.expected = [('disk', 'sda', 'size', '100'),
+                         ('cpu', 'logical', 'number', 8),
+                         ('system', 'product', 'name', 'caf [1, 2]')]
+
+    def test_chunks(self):
+        # split the document at every position
+        for size in range(1, len(self.content)):
+            chunks = [self.content[idx:idx + size]
+                      for idx in range(0, len(self.content), size)]
+            self.assertEqual([upload._encode(elt) for elt in
+                              upload.iter_json_list(chunks)],
+                             self.expected)
+
+    def test_gzip(self):
+        data = StringIO.StringIO()
+        gzip_file = gzip.GzipFile(fileobj=data, mode='w')
+        gzip_file.write(self.content)
+        gzip_file.close()
+        data.seek(0)
+        self.assertEqual(upload.read_hw(data, True), self.expected)
+
+    def test_empty(self):
+        self.assertEqual(upload.read_hw(StringIO.StringIO(' [ ] ')), [])
+
+    def test_invalid(self):
+        for content in ('', '{}', '[["a"]', '[["a"] ["b"]]'):
+            self.assertRaises(upload.UploadError, upload.read_hw,
+                              StringIO.StringIO(content))
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cfg_dir = self.tmpdir + '/'
+        self.write('vm.specs', [('disk', '$disk', 'size', '20')])
+        self.lockname = os.path.join(self.tmpdir, 'edeploy.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        with open(self.cfg_dir + name, 'w') as out:
+            pprint.pprint(data, stream=out)
+
+    def read(self, name):
+        return eval(open(self.cfg_dir + name).read(-1))
+
+    def state(self, use_journal=True):
+        state_obj = upload_state.State(lockname=self.lockname,
+                                       journal=use_journal)
+        state_obj.load(self.cfg_dir)
+        return state_obj
+
+    def test_batch(self):
+        for use_journal in (True, False):
+            self.write('state', [('vm', 2)])
+            self.write('vm.cmdb', [{'ip': '10.0.0.1'}, {'ip': '10.0.0.2'}])
+            state_obj = self.state(use_journal)
+            del state_obj.lock_waits[:]
+            with state_obj.batch():
+                ips = [state_obj.find_match(
+                    [('disk', disk, 'size', '20')])[1]['ip']
+                    for disk in ('vda', 'vdb')]
+                self.assertRaises(upload_state.state.StateError,
+                                  state_obj.find_match,
+                                  [('disk', 'vdc', 'size', '20')])
+                # nothing is written before the end of the batch
+                self.assertEqual(self.read('state'), [('vm', 2)])
+            self.assertEqual(ips, ['10.0.0.1', '10.0.0.2'])
+            # the state lock and the profile lock are taken once
+            self.assertEqual(len(state_obj.lock_waits), 2)
+            self.state().compact()
+            self.assertEqual(self.read('state'), [('vm', 0)])
+            self.assertEqual([entry.get('used') for entry in
+                              self.read('vm.cmdb')], [1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# test_upload.py ends here
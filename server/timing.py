@@ -0,0 +1,108 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Timings of the phases of a request.
+
+A Timer accumulates the time spent in each phase of a request and
+some information like the payload size or the matched profile. It is
+logged as a single line:
+
+timing: {"phases": {"match": 0.012, ...}, "profile": "hp", ...}
+
+which is read back by parse_line() to compute percentiles per phase.
+'''
+
+import contextlib
+import json
+import time
+
+PREFIX = 'timing: '
+
+
+class Timer(object):
+    'Time spent in each phase of a request.'
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = {}
+        self.info = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        'Add the time spent in the with block to the phase name.'
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, seconds):
+        'Add seconds to the phase name.'
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def record(self, **info):
+        'Store information about the request.'
+        self.info.update(info)
+
+    def line(self):
+        'Return the line describing the request.'
+        data = dict(self.info)
+        data['time'] = round(self.start, 3)
+        data['phases'] = dict([(name, round(seconds, 6))
+                               for name, seconds in self.phases.items()])
+        data['phases']['total'] = round(time.time() - self.start, 6)
+        return PREFIX + json.dumps(data, sort_keys=True)
+
+
+def parse_line(line):
+    'Return the data of a timing line or None.'
+    pos = line.find(PREFIX)
+    if pos == -1:
+        return None
+    try:
+        data = json.loads(line[pos + len(PREFIX):])
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or 'phases' not in data:
+        return None
+    return data
+
+
+def percentile(values, pct):
+    'Return the nearest-rank percentile pct of a sorted list.'
+    if not values:
+        return None
+    rank = int(len(values) * pct / 100.0 + 0.5)
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summarize(records, percentiles=(50, 95, 99)):
+    '''Compute percentiles per phase over a list of parsed lines.
+
+Returns a dict of phase name to (count, [value per percentile], max).
+'''
+    values = {}
+    for data in records:
+        for name, seconds in data['phases'].items():
+            values.setdefault(name, []).append(seconds)
+    result = {}
+    for name, seconds in values.items():
+        seconds.sort()
+        result[name] = (len(seconds),
+                        [percentile(seconds, pct) for pct in percentiles],
+                        seconds[-1])
+    return result
+
+# timing.py ends here
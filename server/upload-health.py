@@ -40,6 +40,8 @@ import time
 
 from hardware import matcher
 
+import healthblobs
+import healthstore
 import upload
 
 
@@ -64,6 +66,7 @@ def main():
                      'health'))) + '/'
 
     # parse hw file given in argument or passed to cgi script
+    session = None
     if len(sys.argv) == 3 and sys.argv[1] == '-f':
         hw_file = open(sys.argv[2])
     else:
@@ -76,6 +79,7 @@ def main():
 
         fileitem = form['file']
         hw_file = fileitem.file
+        session = form.getvalue('session')
 
     try:
         json_hw_items = json.loads(hw_file.read(-1))
@@ -96,11 +100,11 @@ def main():
     filename_and_macs = matcher.generate_filename_and_macs(hw_items)
     dirname = time.strftime("%Y_%m_%d-%Hh%M", time.localtime())
 
-    if form.getvalue('session'):
-        dest_dir = (cfg_dir + os.path.basename(form.getvalue('session')) +
-                    '/' + dirname)
+    if session:
+        session_dir = cfg_dir + os.path.basename(session) + '/'
     else:
-        dest_dir = cfg_dir + '/' + dirname
+        session_dir = cfg_dir
+    dest_dir = session_dir + dirname
 
     try:
         if not os.path.isdir(dest_dir):
@@ -109,7 +113,35 @@ def main():
         upload.fatal_error("Cannot create %s directory (%s)" %
                            (dest_dir, e.errno))
 
-    upload.save_hw(hw_items, filename_and_macs['sysname'], dest_dir)
+    blob_dir = config_get('SERVER', 'HEALTHBLOBDIR', None)
+    # grapher and health-export.py read the .hwref files: the .hw files
+    # are only kept on demand, for cardiff
+    save_hw = (not blob_dir or
+               config_get('SERVER', 'HEALTHHWFILES', 'False') == 'True')
+    if blob_dir:
+        try:
+            healthblobs.save(blob_dir,
+                             os.path.join(dest_dir,
+                                          filename_and_macs['sysname'] +
+                                          healthblobs.REF_EXTENSION),
+                             hw_items)
+        except Exception as excpt:
+            upload.log('unable to store the blobs of %s: %s' %
+                       (filename_and_macs['sysname'], str(excpt)),
+                       module='upload-health.py')
+            save_hw = True
+    if save_hw:
+        upload.save_hw(hw_items, filename_and_macs['sysname'], dest_dir)
+
+    # the .hw or .hwref file is the reference: the store only speeds
+    # up queries
+    try:
+        healthstore.HealthStore(session_dir + 'store').ingest(
+            filename_and_macs['sysname'], dirname, hw_items)
+    except Exception as excpt:
+        upload.log('unable to store the results of %s: %s' %
+                   (filename_and_macs['sysname'], str(excpt)),
+                   module='upload-health.py')
 
 
 if __name__ == "__main__":
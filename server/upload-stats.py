@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Percentiles of the upload.py phases.
+
+Reads the timing lines logged by upload.py and upload_server.py, from
+the http server error logs given as arguments or from stdin, and
+prints the 50th, 95th and 99th percentiles of each phase:
+
+$ upload-stats.py [-m <minutes>] [-n <requests>] [-p <profile>] [<log>...]
+
+-m only keeps the requests of the last minutes of the logs, -n the last
+requests and -p the requests matching a profile.
+'''
+
+import fileinput
+import getopt
+import sys
+
+import timing
+
+PERCENTILES = (50, 95, 99)
+
+
+def read_records(lines, profile=None):
+    'Return the timing records found in lines.'
+    records = []
+    for line in lines:
+        data = timing.parse_line(line)
+        if data is None:
+            continue
+        if profile is not None and data.get('profile') != profile:
+            continue
+        records.append(data)
+    records.sort(key=lambda data: data.get('time', 0))
+    return records
+
+
+def window(records, minutes=None, count=None):
+    'Keep the records of the last minutes of the logs or the last count.'
+    if minutes is not None and records:
+        start = records[-1].get('time', 0) - minutes * 60
+        records = [data for data in records if data.get('time', 0) >= start]
+    if count is not None:
+        records = records[-count:]
+    return records
+
+
+def report(records, out=sys.stdout):
+    'Print the percentiles of each phase in milliseconds.'
+    summary = timing.summarize(records, PERCENTILES)
+    out.write('%-12s %7s' % ('phase', 'count') +
+              ''.join(['%10s' % ('p%d' % pct) for pct in PERCENTILES]) +
+              '%10s\n' % 'max')
+    # slowest phases first
+    for name in sorted(summary, key=lambda name: -summary[name][1][-1]):
+        count, values, maximum = summary[name]
+        out.write('%-12s %7d' % (name, count) +
+                  ''.join(['%10.1f' % (value * 1000) for value in values]) +
+                  '%10.1f\n' % (maximum * 1000))
+    sizes = sorted([data['size'] for data in records if 'size' in data])
+    if sizes:
+        out.write('%-12s %7d' % ('size(bytes)', len(sizes)) +
+                  ''.join(['%10d' % timing.percentile(sizes, pct)
+                           for pct in PERCENTILES]) +
+                  '%10d\n' % sizes[-1])
+
+
+def usage():
+    'Print the command line help.'
+    print('upload-stats.py [-m <minutes>] [-n <requests>] [-p <profile>] '
+          '[<log>...]')
+
+
+def main():
+    'Command line entry point.'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hm:n:p:',
+                                   ['help', 'minutes=', 'requests=',
+                                    'profile='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    minutes = None
+    count = None
+    profile = None
+
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+        elif opt in ('-m', '--minutes'):
+            minutes = float(arg)
+        elif opt in ('-n', '--requests'):
+            count = int(arg)
+        elif opt in ('-p', '--profile'):
+            profile = arg
+
+    records = window(read_records(fileinput.input(args), profile),
+                     minutes, count)
+    if not records:
+        sys.stderr.write('No timing found\n')
+        sys.exit(1)
+    report(records)
+
+
+if __name__ == "__main__":
+    main()
+
+# upload-stats.py ends here
@@ -30,47 +30,89 @@ On the to be configured host, it is usually called like that:
 $ curl -i -F name=test -F file=@/hw.lst http://localhost/cgi-bin/upload.py
 '''
 
-import atexit
 import ConfigParser
 import cgi
 import cgitb
 import commands
 from datetime import datetime
-import errno
 import json
 import os
 import pprint
+import shutil
 import sys
 import time
 import traceback
+import zlib
 
 from hardware import matcher
-from hardware import state
 
+import cache
+import locking
+import pxequeue
+import timing
+import upload_state
 
-def lock(filename):
-    '''Lock a file and return a file descriptor. Need to call unlock to release
-the lock.'''
-    count = 0
-    while True:
-        try:
-            lock_fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_RDWR)
-            break
-        except OSError, xcpt:
-            if xcpt.errno != errno.EEXIST:
-                raise
-            if count % 30 == 0:
-                log('waiting for lock %s' % filename)
-            time.sleep(1)
-            count += 1
-    return lock_fd
 
+CONFIG_FILE = '/etc/edeploy.conf'
+
+# size of the chunks read from the uploaded files
+CHUNK_SIZE = 65536
 
-def unlock(lock_fd, filename):
-    'Called after the lock function to release a lock.'
-    if lock_fd:
-        os.close(lock_fd)
-        os.unlink(filename)
+# hardware files accepted by upload.py -f <directory>
+HW_EXTENSIONS = ('.json', '.json.gz', '.hw')
+
+CONFIGURE_HEADER = '''
+import commands
+import os
+import sys
+import time
+
+from hardware import hpacucli
+from hardware import ipmi
+
+def run(cmd):
+    sys.stderr.write('+ ' + cmd + '\\n')
+    status, output = commands.getstatusoutput(cmd + ' </dev/null')
+    sys.stderr.write(output + '\\n')
+    if status != 0:
+        sys.stderr.write("Command '%s' failed\\n" % cmd)
+        sys.stderr.write("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\\n")
+        sys.stderr.write("!!! Configure script exited prematurely !!!\\n")
+        sys.stderr.write("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\\n")
+        sys.exit(status)
+
+def set_role(role, version, disk):
+    with open('/vars', 'a') as f:
+        f.write("ROLE=%s\\nVERS=%s\\nDISK=%s\\n" % (role,
+                                                    version,
+                                                    disk))
+        f.write("PROFILE=%s\\n" % var['edeploy-profile'])
+
+def grub_options(options):
+    f = open('/grub_options', 'w')
+    f.write(options)
+    f.close()
+
+def config(name, mode='w', basedir='/post_rsync', fmod=0644, uid=0, gid=0):
+    path = basedir + name
+    dir_ = '/'.join(path.split('/')[:-1])
+    if not os.path.exists(dir_):
+        os.makedirs(dir_)
+    f = open(path, mode)
+    os.fchmod(f.fileno(), fmod)
+    os.fchown(f.fileno(), uid, gid)
+    return f
+
+def inject_facts(vars, basedir='/post_rsync', prefix='hw_'):
+    dir_ = os.path.join(basedir, 'etc', 'facter', 'facts.d')
+    if not os.path.exists(dir_):
+        os.makedirs(dir_)
+    with open(os.path.join(dir_, 'edeploy.yaml'), 'w') as f:
+        f.write('---\\n')
+        for key in vars:
+            f.write('%s%s: %s\\n' % (prefix, key, vars[key]))
+
+var = '''
 
 
 def log(msg, prefix='eDeploy', module='upload.py'):
@@ -92,18 +134,29 @@ def save_hw(items, name, hwdir):
         log("exception while saving hw file: %s" % str(xcpt))
 
 
-def register_pxemngr(sysvars):
-    'Register the system in pxemngr.'
+def register_pxemngr(sysvars, spool_dir=None):
+    '''Register the system in pxemngr.
+
+If spool_dir is set, the registration is queued for pxequeue.py.
+'''
     # only use Ethernet mac addresses with pxemngr
-    macs = ' '.join(filter(lambda x: len(x) == 17, sysvars['serial']))
+    macs = filter(lambda x: len(x) == 17, sysvars['serial'])
+    if spool_dir:
+        try:
+            pxequeue.spool(spool_dir, sysvars['sysname'], macs)
+            log('queued %s for pxemngr' % sysvars['sysname'])
+            return
+        except Exception, xcpt:
+            log('unable to queue %s for pxemngr: %s'
+                % (sysvars['sysname'], str(xcpt)))
     cmd = 'pxemngr addsystem %s %s' % (sysvars['sysname'],
-                                       macs)
+                                       ' '.join(macs))
     status, output = commands.getstatusoutput(cmd)
     if status != 0:
         log('%s -> %d / %s' % (cmd, status, output))
     else:
         log('added %s under pxemngr for MAC addresses %s'
-            % (sysvars['sysname'], macs))
+            % (sysvars['sysname'], ' '.join(macs)))
 
 
 def warning_error(error):
@@ -129,232 +182,551 @@ def fatal_error(error):
     sys.exit(1)
 
 
-def main():
-    '''CGI entry point.'''
+class UploadError(Exception):
+    'Raised when a request cannot be served.'
+    pass
+
 
+class BusyError(UploadError):
+    'Raised when too many requests are being served.'
+
+    def __init__(self, retry_after):
+        UploadError.__init__(self, 'Server busy, retry in %d seconds' %
+                             retry_after)
+        self.retry_after = retry_after
+
+
+def load_config(filename=CONFIG_FILE):
+    'Read the eDeploy configuration file.'
     config = ConfigParser.ConfigParser()
-    config.read('/etc/edeploy.conf')
+    config.read(filename)
+    return config
 
-    def config_get(section, name, default):
-        'Secured config getter.'
-        try:
-            return config.get(section, name)
-        except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
-            return default
 
-    failure_role = None
-    section = 'SERVER'
+def config_get(config, section, name, default):
+    'Secured config getter.'
+    try:
+        return config.get(section, name)
+    except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
+        return default
 
-    # parse hw file given in argument or passed to cgi script
-    if len(sys.argv) >= 3 and sys.argv[1] == '-f':
-        hw_file = open(sys.argv[2])
-        if len(sys.argv) >= 5 and sys.argv[3] == '-F':
-            failure_role = sys.argv[4]
 
-        cfg_dir = os.path.normpath(config_get(
-            'SERVER', 'CONFIGDIR',
-            os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                         '..',
-                         'config'))) + '/'
+def get_cfg_dir(config, section):
+    'Return the directory holding the specs, cmdb and configure files.'
+    return os.path.normpath(config_get(
+        config, section, 'CONFIGDIR',
+        os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                     '..',
+                     'config'))) + '/'
 
-        hw_dir = os.path.normpath(config_get(
-            'SERVER', 'HWDIR', cfg_dir)) + '/'
 
-    else:
-        cgitb.enable()
+def get_dir(config, section, name, cfg_dir):
+    'Return a directory setting defaulting to cfg_dir.'
+    return os.path.normpath(config_get(config, section, name, cfg_dir)) + '/'
 
-        form = cgi.FieldStorage()
 
-        log('Called from %s' % os.getenv('REMOTE_ADDR', '<no address>'))
+def read_chunks(fileobj, compressed=False):
+    'Yield the content of fileobj by chunks, gunzipping it if compressed.'
+    decompressor = compressed and zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+        if chunk:
+            yield chunk
+    if decompressor:
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
 
-        print "Content-Type: text/x-python"     # HTML is following
-        print                                   # blank line, end of headers
 
-        # Log form fields
-        for key in form:
-            if key == 'file':
-                log('form[%s]: %d bytes' % (key, len(form.getvalue(key))))
+def iter_json_list(chunks):
+    '''Decode a JSON list read by chunks.
+
+Yields the elements of the list as soon as they are complete so the
+whole document is never held in memory.
+'''
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    eof = False
+    expect = '['
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\n\r':
+            pos += 1
+        token = buf[pos] if pos < len(buf) else None
+        if token is not None:
+            if expect == '[':
+                if token != '[':
+                    raise ValueError('the hardware file is not a list')
+                pos += 1
+                expect = 'first'
+                continue
+            elif expect == 'sep':
+                if token == ']':
+                    return
+                if token != ',':
+                    raise ValueError('unexpected %r at %d' % (token, pos))
+                pos += 1
+                expect = 'value'
+                continue
+            elif expect == 'first' and token == ']':
+                return
             else:
-                log('form[%s]: "%s"' % (key, form.getvalue(key)))
+                try:
+                    elt, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                    end = None
+                # a value ending the buffer may be truncated
+                if end is not None and (end < len(buf) or eof):
+                    yield elt
+                    pos = end
+                    expect = 'sep'
+                    continue
+        if eof:
+            raise ValueError('truncated hardware file')
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+        else:
+            buf = buf[pos:] + chunk
+            pos = 0
+
+
+def _encode(info):
+    'Encode the unicode strings of a hardware item as strings.'
+    return tuple([elt.encode('ascii', 'ignore') if isinstance(elt, unicode)
+                  else elt for elt in info])
+
+
+def read_hw(fileobj, compressed=False):
+    '''Decode the JSON hardware list sent by the remote host.
+
+The file is read and decoded by chunks. It is gunzipped on the fly if
+compressed.
+'''
+    try:
+        return [_encode(info)
+                for info in iter_json_list(read_chunks(fileobj, compressed))]
+    except Exception as excpt:
+        raise UploadError("'Invalid hardware file: %s'" % str(excpt))
+
+
+def is_compressed(fileitem):
+    'Return True if an uploaded file is gzipped.'
+    return ((fileitem.filename or '').endswith('.gz') or
+            fileitem.headers.get('content-encoding', '') == 'gzip')
+
+
+def upload_size(fileitem):
+    'Return the size of an uploaded file without reading it.'
+    fileobj = fileitem.file
+    pos = fileobj.tell()
+    fileobj.seek(0, 2)
+    size = fileobj.tell()
+    fileobj.seek(pos)
+    return size
+
+
+def save_log(logitem, log_dir):
+    'Save an uploaded .log.gz file in log_dir.'
+    filename = os.path.join(log_dir, os.path.basename(logitem.filename))
+    if os.path.exists(filename):
+        backupname = '%s.%s.log.gz' % \
+                     (filename[:-7],
+                      time.strftime('%Y%m%d%H%M%S',
+                                    time.gmtime(
+                                        os.path.getmtime(
+                                            filename))))
+        log('Renaming log file %s to %s' % (filename, backupname))
+        os.rename(filename, backupname)
+    with open(filename, 'w') as output_file:
+        shutil.copyfileobj(logitem.file, output_file, CHUNK_SIZE)
+    log('Log file %s saved' % logitem.filename)
+
+
+def load_configure(filename):
+    'Read a .configure template.'
+    return open(filename).read(-1)
+
+
+def generate_configure_script(name, var, cfg, pxemngr_url, metadata_url):
+    'Build the configure script sent back to the remote host.'
+    script = ['''#!/usr/bin/env python
+#EDEPLOY_PROFILE = %s
+''' % name, CONFIGURE_HEADER, pprint.pformat(var) + '\n', cfg]
 
-        section = form.getvalue('section', 'SERVER')
+    if pxemngr_url:
+        log("Adding pxemngr url to configure script: %s" % pxemngr_url)
+        script.append('''
+run('echo "PXEMNGR_URL=%s" >> /vars')
 
-        cfg_dir = os.path.normpath(config_get(
-            section, 'CONFIGDIR',
-            os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                         '..',
-                         'config'))) + '/'
+''' % pxemngr_url)
 
-        # If the filename ends with a .log, we need to process it as a log file
-        if ('file' in form) and (form['file'].filename.endswith('.log.gz')):
-            logitem = form['file']
-            logfile = logitem.file
-            try:
-                # Let's save the file in LOGDIR directory
-                log_dir = os.path.normpath(config_get(section,
-                                                      'LOGDIR',
-                                                      cfg_dir)) + '/'
-                filename = os.path.join(log_dir,
-                                        os.path.basename(logitem.filename))
-                if os.path.exists(filename):
-                    backupname = '%s.%s.log.gz' % \
-                                 (filename[:-7],
-                                  time.strftime('%Y%m%d%H%M%S',
-                                                time.gmtime(
-                                                    os.path.getmtime(
-                                                        filename))))
-                    log('Renaming log file %s to %s' % (filename, backupname))
-                    os.rename(filename, backupname)
-                output_file = open(filename, 'w')
-                output_file.write(logfile.read(-1))
-                output_file.close()
-            except Exception, xcpt:
-                # If we fails at saving, let's exit
-                fatal_error("exception while saving log file: %s" % str(xcpt))
-                sys.exit(1)
-            # If the succeed at saving log file, let's also exit
-            # In fact we have nothing more to do once its saved.
-            log('Log file %s saved' % logitem.filename)
-            sys.exit(0)
+    if metadata_url:
+        log("Adding metadata url to configure script: %s" % metadata_url)
+        script.append('''
+run('echo "METADATA_URL=%s" >> /vars')
 
-        if 'file' not in form:
-            fatal_error('No file passed to the CGI')
+''' % metadata_url)
 
-        fileitem = form['file']
-        hw_file = fileitem.file
+    return ''.join(script)
 
-        if form.getvalue('failure'):
-            failure_role = form.getvalue('failure')
 
-        hw_dir = os.path.normpath(config_get(
-            section, 'HWDIR', cfg_dir)) + '/'
+def log_lock_waits(state_obj):
+    'Log the time spent waiting for each lock during the request.'
+    if state_obj.lock_waits:
+        log('lock wait: %s' % ', '.join(['%s=%.3fs' % (name, wait)
+                                         for name, wait in
+                                         state_obj.lock_waits]))
 
-    try:
-        json_hw_items = json.loads(hw_file.read(-1))
-    except Exception as excpt:
-        fatal_error("'Invalid hardware file: %s'" % str(excpt))
 
-    def encode(elt):
-        'Encode unicode strings as strings else return the object'
-        try:
-            return elt.encode('ascii', 'ignore')
-        except AttributeError:
-            return elt
+def record_state(timer, state_obj):
+    'Record the lock waits and the file writes of a State in timer.'
+    timer.add('lock_wait', sum([wait for _, wait in state_obj.lock_waits]))
+    timer.add('save', state_obj.save_time)
 
-    hw_items = []
-    for info in json_hw_items:
-        hw_items.append(tuple(map(encode, info)))
 
-    # avoid concurrent accesses
-    lock_filename = config_get(section, 'LOCKFILE',
-                               '/var/run/httpd/edeploy.lock')
-    state_obj = state.State(lockname=lock_filename)
-    state_obj.load(cfg_dir)
+def get_lockfile(config, section):
+    'Return the name of the lock file of a section.'
+    return config_get(config, section, 'LOCKFILE',
+                      '/var/run/httpd/edeploy.lock')
 
-    def cleanup():
-        'Remove lock.'
-        state_obj.unlock()
 
-    atexit.register(cleanup)
+def acquire_slot(config, section):
+    '''Reserve one of the MAXINFLIGHT request slots of a section.
+
+Returns the held locking.Slots or None when the number of requests is
+not limited. Raises BusyError when all the slots are in use.
+'''
+    max_inflight = int(config_get(config, section, 'MAXINFLIGHT', 0))
+    if max_inflight <= 0:
+        return None
+    slots = locking.Slots(get_lockfile(config, section), max_inflight)
+    if not slots.acquire():
+        raise BusyError(int(config_get(config, section, 'RETRYAFTER', 10)))
+    return slots
+
+
+def new_state(config, section, cache=None):
+    'Return a State object configured for a section.'
+    # avoid concurrent accesses
+    lock_filename = get_lockfile(config, section)
+    use_journal = (config_get(config, section, 'JOURNAL', False) == 'True')
+    lazy_cmdb = (config_get(config, section, 'LAZYCMDB', False) == 'True')
+    return upload_state.State(
+        lockname=lock_filename, cache=cache, journal=use_journal,
+        fingerprint_dir=config_get(config, section, 'FINGERPRINTDIR', None),
+        lazy_cmdb=lazy_cmdb)
+
+
+def provision_host(config, section, state_obj, hw_items, failure_role,
+                   hw_dir, timer):
+    '''Match hw_items with a loaded State object.
+
+Returns the name of the matching profile and its configure script, or
+None and an empty string when a failure report has been recorded.
+Raises UploadError when no profile matches. The time spent in each
+phase is added to timer.
+'''
+    cfg_dir = get_cfg_dir(config, section)
 
     filename_and_macs = matcher.generate_filename_and_macs(hw_items)
-    save_hw(hw_items, filename_and_macs['sysname'], hw_dir)
+    with timer.phase('save_hw'):
+        save_hw(hw_items, filename_and_macs['sysname'], hw_dir)
 
-    use_pxemngr = (config_get(section, 'USEPXEMNGR', False) == 'True')
-    pxemngr_url = config_get(section, 'PXEMNGRURL', None)
-    metadata_url = config_get(section, 'METADATAURL', None)
+    use_pxemngr = (config_get(config, section,
+                              'USEPXEMNGR', False) == 'True')
+    pxemngr_url = config_get(config, section, 'PXEMNGRURL', None)
+    metadata_url = config_get(config, section, 'METADATAURL', None)
 
     if use_pxemngr:
-        register_pxemngr(filename_and_macs)
+        with timer.phase('pxemngr'):
+            register_pxemngr(filename_and_macs,
+                             config_get(config, section, 'PXEMNGRSPOOL',
+                                        None))
 
     if failure_role:
         if state_obj.failed_profile(failure_role):
+            # the count has been given back: do not reuse the assignment
+            state_obj.forget(hw_items)
             state_obj.save()
-            sys.exit(0)
+            return None, ''
 
     try:
-        name, var = state_obj.find_match(hw_items)
+        with timer.phase('match'):
+            name, var = state_obj.find_match(hw_items)
         var['edeploy-profile'] = name
     except Exception as excpt:
-        fatal_error(str(excpt))
+        raise UploadError(str(excpt))
 
-    sys.stdout.write('''#!/usr/bin/env python
-#EDEPLOY_PROFILE = %s
-''' % name)
+    with timer.phase('configure'):
+        cfg = state_obj.read_file(cfg_dir + name + '.configure',
+                                  load_configure)
 
-    cfg = open(cfg_dir + name + '.configure').read(-1)
+        script = generate_configure_script(
+            name, var, cfg,
+            use_pxemngr and pxemngr_url,
+            metadata_url)
 
-    sys.stdout.write('''
-import commands
-import os
-import sys
-import time
+    log('Sending configure script')
+    state_obj.save()
+    return name, script
 
-from hardware import hpacucli
-from hardware import ipmi
 
-def run(cmd):
-    sys.stderr.write('+ ' + cmd + '\\n')
-    status, output = commands.getstatusoutput(cmd + ' </dev/null')
-    sys.stderr.write(output + '\\n')
-    if status != 0:
-        sys.stderr.write("Command '%s' failed\\n" % cmd)
-        sys.stderr.write("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\\n")
-        sys.stderr.write("!!! Configure script exited prematurely !!!\\n")
-        sys.stderr.write("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\\n")
-        sys.exit(status)
+def provision(config, section, hw_items, failure_role=None, hw_dir=None,
+              cache=None, timer=None):
+    '''Match hw_items against the profiles of a section.
 
-def set_role(role, version, disk):
-    with open('/vars', 'a') as f:
-        f.write("ROLE=%s\\nVERS=%s\\nDISK=%s\\n" % (role,
-                                                    version,
-                                                    disk))
-        f.write("PROFILE=%s\\n" % var['edeploy-profile'])
+Returns the configure script to send back or an empty string when a
+failure report has been recorded. Raises UploadError when no profile
+matches. cache is an optional cache.FileCache used to avoid parsing
+the unchanged files again and timer an optional timing.Timer.
+'''
+    timer = timer or timing.Timer()
+    cfg_dir = get_cfg_dir(config, section)
+    if hw_dir is None:
+        hw_dir = get_dir(config, section, 'HWDIR', cfg_dir)
 
-def grub_options(options):
-    f = open('/grub_options', 'w')
-    f.write(options)
-    f.close()
+    state_obj = new_state(config, section, cache)
+    with timer.phase('load'):
+        state_obj.load(cfg_dir)
 
-def config(name, mode='w', basedir='/post_rsync', fmod=0644, uid=0, gid=0):
-    path = basedir + name
-    dir_ = '/'.join(path.split('/')[:-1])
-    if not os.path.exists(dir_):
-        os.makedirs(dir_)
-    f = open(path, mode)
-    os.fchmod(f.fileno(), fmod)
-    os.fchown(f.fileno(), uid, gid)
-    return f
+    try:
+        name, script = provision_host(config, section, state_obj, hw_items,
+                                      failure_role, hw_dir, timer)
+        timer.record(profile=name)
+        return script
+    finally:
+        state_obj.unlock()
+        log_lock_waits(state_obj)
+        record_state(timer, state_obj)
 
-def inject_facts(vars, basedir='/post_rsync', prefix='hw_'):
-    dir_ = os.path.join(basedir, 'etc', 'facter', 'facts.d')
-    if not os.path.exists(dir_):
-        os.makedirs(dir_)
-    with open(os.path.join(dir_, 'edeploy.yaml'), 'w') as f:
-        f.write('---\\n')
-        for key in vars:
-            f.write('%s%s: %s\\n' % (prefix, key, vars[key]))
 
-var = ''')
+def provision_batch(config, section, hw_loaders, hw_dir=None, cache=None,
+                    timer=None):
+    '''Match several hosts against the profiles of a section.
 
-    pprint.pprint(var)
+All the hosts are matched in a single transaction. hw_loaders is a list
+of (name, loader) where loader is a function returning the hardware
+items of a host. Returns a list of dicts with the name of each host
+and either its profile and configure script or an error.
+'''
+    timer = timer or timing.Timer()
+    cfg_dir = get_cfg_dir(config, section)
+    if hw_dir is None:
+        hw_dir = get_dir(config, section, 'HWDIR', cfg_dir)
 
-    sys.stdout.write(cfg)
+    state_obj = new_state(config, section, cache)
+    with timer.phase('load'):
+        state_obj.load(cfg_dir)
 
-    if use_pxemngr and pxemngr_url:
-        log("Adding pxemngr url to configure script: %s" % pxemngr_url)
-        print '''
-run('echo "PXEMNGR_URL=%s" >> /vars')
-''' % pxemngr_url
+    results = []
+    try:
+        with state_obj.batch():
+            for name, loader in hw_loaders:
+                log('Matching %s' % name)
+                try:
+                    with timer.phase('decode'):
+                        hw_items = loader()
+                    profile, script = provision_host(config, section,
+                                                     state_obj, hw_items,
+                                                     None, hw_dir, timer)
+                    results.append({'name': name, 'profile': profile,
+                                    'script': script})
+                except UploadError as excpt:
+                    log('Unable to match %s: %s' % (name, str(excpt)))
+                    results.append({'name': name, 'error': str(excpt)})
+    finally:
+        log_lock_waits(state_obj)
+        record_state(timer, state_obj)
+        timer.record(hosts=len(results))
+
+    return results
+
+
+def file_loader(path):
+    'Return a function reading a .json, .json.gz or .hw hardware file.'
+    def loader():
+        'Read the hardware items.'
+        try:
+            if path.endswith('.hw'):
+                return eval(open(path).read(-1))
+            with open(path) as hw_file:
+                return read_hw(hw_file, path.endswith('.gz'))
+        except UploadError:
+            raise
+        except Exception as excpt:
+            raise UploadError("'Invalid hardware file: %s'" % str(excpt))
+    return loader
 
-    if metadata_url:
-        log("Adding metadata url to configure script: %s" % metadata_url)
-        print '''
-run('echo "METADATA_URL=%s" >> /vars')
-''' % metadata_url
 
-    log('Sending configure script')
-    state_obj.save()
+def directory_loaders(directory):
+    'Return the (name, loader) list of the hardware files of a directory.'
+    return [(fname, file_loader(os.path.join(directory, fname)))
+            for fname in sorted(os.listdir(directory))
+            if fname.endswith(HW_EXTENSIONS)]
+
+
+def upload_loader(fileitem):
+    'Return a function reading an uploaded hardware file.'
+    return lambda: read_hw(fileitem.file, is_compressed(fileitem))
+
+
+def compact(config, section):
+    'Fold the journals of a section back into the state and CMDB files.'
+    state_obj = new_state(config, section)
+    state_obj.load(get_cfg_dir(config, section))
+    state_obj.compact()
+    log_lock_waits(state_obj)
+
+
+def main():
+    '''CGI entry point.'''
+
+    config = load_config(os.environ.get('EDEPLOY_CONF', CONFIG_FILE))
+
+    timer = timing.Timer()
+    failure_role = None
+    section = 'SERVER'
+    hw_dir = None
+
+    # compact the journals: upload.py -C [<section>]
+    if len(sys.argv) >= 2 and sys.argv[1] == '-C':
+        if len(sys.argv) >= 3:
+            section = sys.argv[2]
+        compact(config, section)
+        return
+
+    # match all the hardware files of a directory: upload.py -f <dir>
+    if (len(sys.argv) >= 3 and sys.argv[1] == '-f' and
+            os.path.isdir(sys.argv[2])):
+        cache_dir = config_get(config, section, 'CACHEDIR', None)
+        try:
+            print json.dumps(provision_batch(
+                config, section, directory_loaders(sys.argv[2]),
+                cache=cache_dir and cache.DiskCache(cache_dir),
+                timer=timer), indent=2)
+        finally:
+            log(timer.line())
+        return
+
+    # parse hw file given in argument or passed to cgi script
+    if len(sys.argv) >= 3 and sys.argv[1] == '-f':
+        hw_file = open(sys.argv[2])
+        compressed = sys.argv[2].endswith('.gz')
+        timer.record(size=os.path.getsize(sys.argv[2]))
+        if len(sys.argv) >= 5 and sys.argv[3] == '-F':
+            failure_role = sys.argv[4]
+
+        cfg_dir = get_cfg_dir(config, 'SERVER')
+        hw_dir = get_dir(config, 'SERVER', 'HWDIR', cfg_dir)
+
+    else:
+        cgitb.enable()
+
+        with timer.phase('form'):
+            form = cgi.FieldStorage()
+
+        log('Called from %s' % os.getenv('REMOTE_ADDR', '<no address>'))
+
+        fileitems = form['file'] if 'file' in form else []
+        if not isinstance(fileitems, list):
+            fileitems = [fileitems]
+
+        # several files or the batch field: match them in one transaction
+        batch = len(fileitems) > 1 or form.getvalue('batch')
+
+        section = form.getvalue('section', 'SERVER')
+
+        # If the filename ends with a .log, we need to process it as a log file
+        is_log = (not batch and fileitems and
+                  fileitems[0].filename.endswith('.log.gz'))
+
+        if not is_log:
+            try:
+                # the slot is released when the CGI process exits
+                acquire_slot(config, section)
+            except BusyError as excpt:
+                print 'Status: 503 Service Unavailable'
+                print 'Retry-After: %d' % excpt.retry_after
+                print 'Content-Type: text/x-python'
+                print
+                warning_error(str(excpt))
+                return
+
+        if batch:
+            print "Content-Type: application/json"
+        else:
+            print "Content-Type: text/x-python"     # HTML is following
+        print                                   # blank line, end of headers
+
+        # Log form fields
+        for key in form:
+            if key != 'file':
+                log('form[%s]: "%s"' % (key, form.getvalue(key)))
+        for fileitem in fileitems:
+            log('form[file]: %s %d bytes' % (fileitem.filename,
+                                             upload_size(fileitem)))
+        timer.record(size=sum([upload_size(fileitem)
+                               for fileitem in fileitems]))
+
+        cfg_dir = get_cfg_dir(config, section)
+
+        if batch:
+            cache_dir = config_get(config, section, 'CACHEDIR', None)
+            try:
+                print json.dumps(provision_batch(
+                    config, section,
+                    [(fileitem.filename, upload_loader(fileitem))
+                     for fileitem in fileitems],
+                    cache=cache_dir and cache.DiskCache(cache_dir),
+                    timer=timer))
+            finally:
+                log(timer.line())
+            return
+
+        if is_log:
+            try:
+                # Let's save the file in LOGDIR directory
+                save_log(fileitems[0], get_dir(config, section, 'LOGDIR',
+                                               cfg_dir))
+            except Exception, xcpt:
+                # If we fails at saving, let's exit
+                fatal_error("exception while saving log file: %s" % str(xcpt))
+            # If the succeed at saving log file, let's also exit
+            # In fact we have nothing more to do once its saved.
+            sys.exit(0)
+
+        if not fileitems:
+            fatal_error('No file passed to the CGI')
+
+        fileitem = fileitems[0]
+        hw_file = fileitem.file
+        compressed = is_compressed(fileitem)
+
+        if form.getvalue('failure'):
+            failure_role = form.getvalue('failure')
+
+    cache_dir = config_get(config, section, 'CACHEDIR', None)
+
+    try:
+        with timer.phase('decode'):
+            hw_items = read_hw(hw_file, compressed)
+        sys.stdout.write(provision(config, section, hw_items, failure_role,
+                                   hw_dir,
+                                   cache_dir and cache.DiskCache(cache_dir),
+                                   timer))
+    except UploadError as excpt:
+        fatal_error(str(excpt))
+    finally:
+        log(timer.line())
+
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Long-lived version of the upload.py CGI script.
+
+It speaks the same protocol as upload.py but keeps the configuration
+and the parsed state, specs, CMDB and configure files in memory between
+requests. Files are parsed again only when they change on disk. It can
+be used as a WSGI application (the application callable) or started as
+a standalone threaded HTTP server:
+
+$ upload_server.py [-c /etc/edeploy.conf] [-l <address>] [-p <port>]
+
+The remote hosts are then booted with HTTP_PORT=<port>. Sending SIGHUP
+to the standalone server reloads the configuration and flushes the
+parsed files.
+
+Several hardware files posted at once, or with the batch field set, are
+matched in a single transaction and answered with a JSON list.
+'''
+
+import cgi
+import getopt
+import json
+import signal
+import SocketServer
+import sys
+from wsgiref import simple_server
+
+import cache
+import timing
+import upload
+
+PYTHON_TYPE = 'text/x-python'
+JSON_TYPE = 'application/json'
+
+
+class Resident(object):
+    'Configuration and files kept between requests.'
+
+    def __init__(self, config_file=upload.CONFIG_FILE):
+        self.config_file = config_file
+        self.cache = cache.FileCache()
+        self.config = upload.load_config(self.config_file)
+
+    def reload(self):
+        'Re-read the configuration and flush the parsed files.'
+        upload.log('Reloading %s' % self.config_file,
+                   module='upload_server.py')
+        self.config = upload.load_config(self.config_file)
+        self.cache.clear()
+
+
+RESIDENT = None
+
+
+def get_resident(config_file=upload.CONFIG_FILE):
+    'Return the resident data, creating it on first use.'
+    global RESIDENT
+    if RESIDENT is None:
+        RESIDENT = Resident(config_file)
+    return RESIDENT
+
+
+def error_script(error):
+    'Return the shell script reporting an error to the remote host.'
+    upload.log('Aborting: ' + error, module='upload_server.py')
+    return '''#!/bin/sh
+
+cat <<EOF
+%s
+EOF
+
+exit 1
+''' % error
+
+
+def match_form(form, resident, fileitems):
+    'Match the hardware files of a form and return the response.'
+    config = resident.config
+    section = form.getvalue('section', 'SERVER')
+
+    timer = timing.Timer()
+    timer.record(size=sum([upload.upload_size(fileitem)
+                           for fileitem in fileitems]))
+
+    if len(fileitems) > 1 or form.getvalue('batch'):
+        try:
+            return JSON_TYPE, json.dumps(upload.provision_batch(
+                config, section,
+                [(fileitem.filename, upload.upload_loader(fileitem))
+                 for fileitem in fileitems],
+                cache=resident.cache, timer=timer))
+        finally:
+            upload.log(timer.line(), module='upload_server.py')
+
+    fileitem = fileitems[0]
+    try:
+        with timer.phase('decode'):
+            hw_items = upload.read_hw(fileitem.file,
+                                      upload.is_compressed(fileitem))
+        return PYTHON_TYPE, upload.provision(config, section, hw_items,
+                                             form.getvalue('failure'),
+                                             cache=resident.cache,
+                                             timer=timer)
+    except upload.UploadError as excpt:
+        return PYTHON_TYPE, error_script(str(excpt))
+    finally:
+        upload.log(timer.line(), module='upload_server.py')
+
+
+def handle_form(form, resident, remote_addr):
+    '''Process a parsed upload form.
+
+Returns the content type and the body of the response: a configure
+script or, for a batch of hardware files, a JSON list of results.
+Raises upload.BusyError when too many requests are being matched.
+'''
+    upload.log('Called from %s' % remote_addr, module='upload_server.py')
+
+    config = resident.config
+    section = form.getvalue('section', 'SERVER')
+    cfg_dir = upload.get_cfg_dir(config, section)
+
+    if 'file' not in form:
+        return PYTHON_TYPE, error_script('No file passed to the CGI')
+
+    fileitems = form['file']
+    if not isinstance(fileitems, list):
+        fileitems = [fileitems]
+
+    fileitem = fileitems[0]
+
+    if (len(fileitems) == 1 and fileitem.filename and
+            fileitem.filename.endswith('.log.gz')):
+        try:
+            upload.save_log(fileitem, upload.get_dir(config, section,
+                                                     'LOGDIR', cfg_dir))
+        except Exception as xcpt:
+            return PYTHON_TYPE, error_script(
+                "exception while saving log file: %s" % str(xcpt))
+        return PYTHON_TYPE, ''
+
+    slots = upload.acquire_slot(config, section)
+    try:
+        return match_form(form, resident, fileitems)
+    finally:
+        if slots:
+            slots.release()
+
+
+def application(environ, start_response):
+    '''WSGI entry point.
+
+The configuration file can be overridden with the EDEPLOY_CONF
+variable of the WSGI environment.
+'''
+    resident = get_resident(environ.get('EDEPLOY_CONF', upload.CONFIG_FILE))
+
+    if environ.get('REQUEST_METHOD', 'GET') == 'POST':
+        form = cgi.FieldStorage(fp=environ['wsgi.input'],
+                                environ=environ,
+                                keep_blank_values=True)
+    else:
+        form = cgi.FieldStorage(environ=environ, keep_blank_values=True)
+
+    status = '200 OK'
+    headers = []
+    try:
+        content_type, body = handle_form(
+            form, resident, environ.get('REMOTE_ADDR', '<no address>'))
+    except upload.BusyError as excpt:
+        status = '503 Service Unavailable'
+        headers = [('Retry-After', str(excpt.retry_after))]
+        content_type, body = PYTHON_TYPE, error_script(str(excpt))
+    except Exception as excpt:
+        content_type, body = PYTHON_TYPE, error_script(str(excpt))
+
+    start_response(status, headers + [('Content-Type', content_type),
+                                      ('Content-Length', str(len(body)))])
+    return [body]
+
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn,
+                          simple_server.WSGIServer):
+    'WSGI server handling each request in its own thread.'
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietHandler(simple_server.WSGIRequestHandler):
+    'Request handler logging through upload.log.'
+
+    def log_message(self, fmt, *args):
+        upload.log(fmt % args, module='upload_server.py')
+
+
+def usage():
+    'Print the command line help.'
+    print 'upload_server.py [-c <config file>] [-l <address>] [-p <port>]'
+
+
+def main():
+    '''Standalone server entry point.'''
+    global RESIDENT
+
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], 'hc:l:p:',
+                                ['help', 'config=', 'listen=', 'port='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    config_file = upload.CONFIG_FILE
+    address = ''
+    port = 8080
+
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+        elif opt in ('-c', '--config'):
+            config_file = arg
+        elif opt in ('-l', '--listen'):
+            address = arg
+        elif opt in ('-p', '--port'):
+            port = int(arg)
+
+    RESIDENT = Resident(config_file)
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: RESIDENT.reload())
+
+    server = simple_server.make_server(address, port, application,
+                                       server_class=ThreadingWSGIServer,
+                                       handler_class=QuietHandler)
+    upload.log('Serving on %s:%d' % (address or '*', port),
+               module='upload_server.py')
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
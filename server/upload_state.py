@@ -0,0 +1,514 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''State handling used by the upload.py server.
+
+Extends hardware.state.State to read the state, specs and CMDB files
+through an optional cache (see cache.py) so they are not parsed again
+while they are unchanged. The state and CMDB files are replaced
+atomically when modified and the written content is recorded in the
+cache, and a CMDB is only written when an entry has been allocated.
+
+In journal mode, allocations are appended to journals (see journal.py)
+instead of rewriting the files, and the journals are folded back into
+the files every journal.COMPACT_RECORDS records or by compact().
+Existing journals are always applied when reading the files and are
+folded back at once when the journal mode is disabled.
+
+batch() matches several hosts in a single transaction: the locks are
+held for the whole batch and the files are read and written once.
+
+Locking is sharded: the lock file protects the state file only and is
+held for short read-modify-write transactions. Each profile has its
+own lock (<lockfile>.<profile>) protecting its CMDB, so hosts matching
+different profiles never wait for each other. The time spent waiting
+for each lock is recorded in lock_waits and the time spent writing the
+files in save_time.
+
+Before running the matcher on a profile, its specs are checked
+against the hardware with the requirements of matchindex. The specs
+file is parsed once for both, only when the profile is reached. With
+a fingerprint directory, a host whose hardware fingerprint (see
+fingerprint.py) is known gets its previous assignment back without
+matching, as long as its CMDB entry is unchanged.
+'''
+
+import contextlib
+import copy
+import errno
+import os
+import pprint
+import shutil
+import time
+
+from hardware import cmdb
+from hardware import matcher
+from hardware import state
+
+import cache
+import fingerprint
+import journal
+import lazycmdb
+import locking
+import matchindex
+
+_INVALID_SPECS = [('<unknown>', '<unknown>', '<unknown>', '<unknown>')]
+
+LOG = state.LOG
+
+
+def load_specs(filename):
+    'Read a .specs file.'
+    return eval(open(filename, 'r').read(-1))
+
+
+def load_compiled_specs(filename):
+    '''Read a .specs file and compile it for the match index.
+
+Returns the specs and their requirements (see matchindex.compile_specs)
+or None as requirements if they cannot be compiled.
+'''
+    specs = load_specs(filename)
+    try:
+        requirements = matchindex.selective_first(
+            matchindex.compile_specs(specs))
+    except Exception as excpt:
+        # the matcher reports the error if it is a real one
+        LOG.error('Unable to index %s: %s' % (filename, excpt))
+        requirements = None
+    return specs, requirements
+
+
+def load_state(filename):
+    'Read a state file.'
+    return eval(open(filename, 'r').read(-1))
+
+
+def load_cmdb(filename):
+    '''Read a .cmdb file. Returns None if it does not exist.
+
+Like hardware.cmdb.load_cmdb, a CMDB written as a generate() call is
+first copied to a .orig file. Generated CMDBs are returned as
+lazycmdb.LazyCmdb objects.
+'''
+    try:
+        content = open(filename, 'r').read(-1)
+    except IOError as xcpt:
+        if xcpt.errno != errno.ENOENT:
+            LOG.error('exception while processing CMDB %s' % str(xcpt))
+        return None
+    if 'generate(' in content[:20]:
+        shutil.copy2(filename, filename + '.orig')
+    return lazycmdb.parse(content)
+
+
+class State(state.State):
+    '''State object reading its files through a cache.
+
+cache is a cache.FileCache or None to always read the files from disk.
+journal enables the journal mode. fingerprint_dir is the directory
+storing the assignments of the known hardware or None. lazy_cmdb
+enables writing the generated CMDBs as lazy_cmdb() calls, which only
+upload_state and the server tools can read. Without it, a generated
+CMDB is written expanded on its first allocation, so the later loads
+are no longer lazy.
+'''
+
+    def __init__(self, data=None, cfg_dir=None, filename=None, lockname=None,
+                 cache=None, journal=False, fingerprint_dir=None,
+                 lazy_cmdb=False):
+        state.State.__init__(self, data, cfg_dir, filename, lockname)
+        self._cache = cache
+        self._journal = journal
+        self._lazy_cmdb = lazy_cmdb
+        self._fingerprint_dir = fingerprint_dir
+        # batch state: held locks, new counts and CMDB changes
+        self._batch_locks = None
+        self._batch_times = {}
+        self._batch_cmdbs = {}
+        self._qlock = None
+        self.lock_waits = []
+        # time spent writing the state and CMDB files
+        self.save_time = 0.0
+
+    def read_file(self, filename, loader):
+        'Return filename parsed by loader, through the cache if any.'
+        if self._cache:
+            return self._cache.get(filename, loader)
+        return loader(filename)
+
+    def _write(self, filename, data, loader):
+        'Replace filename by the pretty-printed data.'
+        # the caller holds the lock of the file so the name is unique
+        tmpname = filename + '.tmp'
+        with open(tmpname, 'w') as tmp_file:
+            pprint.pprint(data, stream=tmp_file)
+        try:
+            shutil.copymode(filename, tmpname)
+        except OSError:
+            pass
+        os.rename(tmpname, filename)
+        if self._cache:
+            self._cache.put(filename, loader, copy.deepcopy(data))
+
+    def _specs_filename(self, name):
+        return os.path.join(self._cfg_dir, name + '.specs')
+
+    def _load_specs(self, name):
+        '''Return the specs of a profile and their compiled requirements.
+
+The file is parsed once for both, when the matcher reaches the profile.
+'''
+        if self._cfg_dir:
+            fname = self._specs_filename(name)
+            if os.path.exists(fname):
+                return self.read_file(fname, load_compiled_specs)
+
+            LOG.info('Specs file %s not found' % fname)
+
+        return _INVALID_SPECS, None
+
+    def _acquire(self, lockname):
+        'Acquire the queue lock named lockname and record the waiting time.'
+        qlock = locking.QueueLock(lockname)
+        self.lock_waits.append((os.path.basename(lockname),
+                                qlock.acquire()))
+        return qlock
+
+    @contextlib.contextmanager
+    def _locked(self, lockname):
+        'Hold the queue lock named lockname.'
+        qlock = self._acquire(lockname)
+        try:
+            yield
+        finally:
+            qlock.release()
+
+    def _profile_lockname(self, name):
+        return '%s.%s' % (self._lockname, name)
+
+    def _must_compact(self, records, compact):
+        return records and (compact or not self._journal or
+                            len(records) >= journal.COMPACT_RECORDS)
+
+    def _read_state(self, compact=False):
+        self._data = list(self.read_file(self._state_filename, load_state))
+        records = journal.read(self._state_filename)
+        journal.apply_state(self._data, records)
+        if self._must_compact(records, compact):
+            self._write(self._state_filename, self._data, load_state)
+            journal.remove(self._state_filename)
+
+    def _save_times(self, times):
+        'Write the new counts given as a dict.'
+        start = time.time()
+        if self._journal:
+            journal.append(self._state_filename,
+                           *[journal.state_record(name, times[name])
+                             for name in sorted(times)])
+        else:
+            self._write(self._state_filename, self._data, load_state)
+        self.save_time += time.time() - start
+
+    def _save_cmdb(self, filename, dbase, records):
+        'Write the allocations of a CMDB given as journal records.'
+        start = time.time()
+        if self._journal:
+            journal.append(filename, *records)
+        else:
+            self._write_cmdb(filename, dbase)
+        self.save_time += time.time() - start
+
+    def _write_cmdb(self, filename, dbase):
+        '''Replace a CMDB file.
+
+A LazyCmdb is written expanded, in the format of hardware.cmdb, unless
+lazy_cmdb is set.
+'''
+        if isinstance(dbase, lazycmdb.LazyCmdb) and not self._lazy_cmdb:
+            dbase = list(dbase)
+        self._write(filename, dbase, load_cmdb)
+
+    def _read_cmdb(self, filename, compact=False):
+        'Return a copy of a CMDB with its journal applied.'
+        orig = self.read_file(filename, load_cmdb)
+        if not orig:
+            return orig
+        # cached entries are shared: work on a copy and replace them
+        dbase = lazycmdb.copy_cmdb(orig)
+        records = journal.read(filename)
+        journal.apply_cmdb(dbase, records)
+        if self._must_compact(records, compact):
+            self._write_cmdb(filename, dbase)
+            journal.remove(filename)
+        return dbase
+
+    def load(self, cfg_dir):
+        'Load a state file from the given directory'
+        self._cfg_dir = cfg_dir
+        self._state_filename = os.path.join(cfg_dir, 'state')
+        self._validate_lockname()
+        LOG.info('Reading state from %s' % self._state_filename)
+        with self._locked(self._lockname):
+            self._read_state()
+
+    def _change_times(self, name, delta, changes):
+        '''Add delta to the count of a profile in memory.
+
+The new count is stored in the changes dict. Returns False if the count
+of the profile is exhausted.
+'''
+        for idx, (prof, times) in enumerate(self._data):
+            if prof == name:
+                if times == '*':
+                    return True
+                if int(times) + delta < 0:
+                    return False
+                self._data[idx] = (prof, int(times) + delta)
+                changes[prof] = int(times) + delta
+                return True
+        return False
+
+    def _update_times(self, name, delta):
+        '''Add delta to the count of a profile in the state file.
+
+Returns False if the count of the profile is exhausted.
+'''
+        if self._batch_locks is not None:
+            return self._change_times(name, delta, self._batch_times)
+        with self._locked(self._lockname):
+            self._read_state()
+            changes = {}
+            result = self._change_times(name, delta, changes)
+            if changes:
+                self._save_times(changes)
+        return result
+
+    def failed_profile(self, prof):
+        '''If we get a failure report, let's reincrement the counter
+
+The state file is updated immediately. Returns True if it was modified.
+'''
+        LOG.info("Received failure for role %s" % prof)
+        for name, times in self._data:
+            if name == prof:
+                # Only consider if time in a numeric entry
+                if times != '*':
+                    return self._update_times(prof, 1)
+                return False
+        return False
+
+    def save(self):
+        'State and CMDB changes are written as they happen.'
+        pass
+
+    @staticmethod
+    def _allocate(dbase, var, var2, forced, sysname, records):
+        '''Allocate a CMDB entry in memory.
+
+The journal record of the allocation is appended to records. Returns
+the index and the content of the entry or None and None if there is no
+CMDB.
+'''
+        if not dbase:
+            return None, None
+        idx, orig = lazycmdb.update_cmdb(dbase, var, var2, forced)
+        # var is modified by the caller afterwards
+        dbase[idx] = dict(dbase[idx])
+        if dbase[idx] != orig:
+            records.append(journal.cmdb_record(idx, orig, dbase[idx],
+                                               sysname))
+        return idx, dbase[idx]
+
+    def _batch_cmdb(self, name):
+        'Return the CMDB of a profile read and locked for the batch.'
+        if name not in self._batch_cmdbs:
+            self._batch_locks.append(
+                self._acquire(self._profile_lockname(name)))
+            fname = cmdb.cmdb_filename(self._cfg_dir, name)
+            self._batch_cmdbs[name] = (fname, self._read_cmdb(fname), [])
+        return self._batch_cmdbs[name]
+
+    def _update_cmdb(self, name, var, var2, forced, sysname):
+        '''Allocate a CMDB entry of a profile under the profile lock.
+
+Returns the index and the content of the entry.
+'''
+        if self._batch_locks is not None:
+            _, dbase, records = self._batch_cmdb(name)
+            return self._allocate(dbase, var, var2, forced, sysname,
+                                  records)
+        with self._locked(self._profile_lockname(name)):
+            fname = cmdb.cmdb_filename(self._cfg_dir, name)
+            dbase = self._read_cmdb(fname)
+            records = []
+            result = self._allocate(dbase, var, var2, forced, sysname,
+                                    records)
+            if records:
+                self._save_cmdb(fname, dbase, records)
+        return result
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''Match several hosts in a single transaction.
+
+The state lock is held during the whole batch and the lock of each
+profile from its first use. Changes are written when leaving the
+batch.
+'''
+        if self._cache is None:
+            # read each specs file once
+            self._cache = cache.FileCache()
+        self._batch_locks = [self._acquire(self._lockname)]
+        self._batch_times = {}
+        self._batch_cmdbs = {}
+        try:
+            self._read_state()
+            yield self
+            if self._batch_times:
+                self._save_times(self._batch_times)
+            for fname, dbase, records in self._batch_cmdbs.values():
+                if records:
+                    self._save_cmdb(fname, dbase, records)
+        finally:
+            for qlock in reversed(self._batch_locks):
+                qlock.release()
+            self._batch_locks = None
+
+    def _find_known(self, fpr):
+        '''Return the previous assignment of a fingerprint.
+
+Returns the profile and the variables sent to the host, or None if the
+fingerprint is unknown or its CMDB entry has been changed since.
+'''
+        assignment = fingerprint.load(self._fingerprint_dir, fpr)
+        if assignment is None:
+            return None
+        name = assignment['profile']
+        if name not in [prof for prof, _ in self._data]:
+            return None
+        if assignment['idx'] is not None:
+            if self._batch_locks is not None:
+                dbase = self._batch_cmdb(name)[1]
+            else:
+                # _read_cmdb may compact the journal
+                with self._locked(self._profile_lockname(name)):
+                    dbase = self._read_cmdb(
+                        cmdb.cmdb_filename(self._cfg_dir, name))
+            if (not dbase or assignment['idx'] >= len(dbase) or
+                    dbase[assignment['idx']] != assignment['entry']):
+                LOG.info('CMDB entry of %s changed' % fpr)
+                return None
+        return name, dict(assignment['var'])
+
+    def forget(self, hw_items):
+        'Match the host again on its next request.'
+        if self._fingerprint_dir:
+            fingerprint.remove(self._fingerprint_dir,
+                               fingerprint.fingerprint(hw_items))
+
+    def compact(self):
+        'Fold the journals back into the state and CMDB files.'
+        with self._locked(self._lockname):
+            self._read_state(compact=True)
+        for name, _ in self._data:
+            with self._locked(self._profile_lockname(name)):
+                self._read_cmdb(cmdb.cmdb_filename(self._cfg_dir, name),
+                                compact=True)
+
+    def find_match(self, hw_items):
+        '''Finds an hardware profile matching the hardware items in the state
+
+If a profiles matches, its count is decremented.
+
+Returns the name of the matching profile.
+'''
+        if self._fingerprint_dir:
+            fpr = fingerprint.fingerprint(hw_items)
+            known = self._find_known(fpr)
+            if known:
+                LOG.info('Known hardware %s: reusing %s' % (fpr, known[0]))
+                return known
+        valid_roles = []
+        hw_counts = matchindex.HwCounts(hw_items)
+        sysname = (self._journal and
+                   matcher.generate_filename_and_macs(hw_items)['sysname'])
+        for name, times in list(self._data):
+            LOG.info('testing %s' % name)
+            if times != '*' and int(times) <= 0:
+                continue
+            valid_roles.append(name)
+            specs, requirements = self._load_specs(name)
+            if requirements is not None and \
+                    not hw_counts.satisfies(requirements):
+                LOG.info('Specs %s rejected by the index' % name)
+                continue
+            var = {}
+            var2 = {}
+            if not matcher.match_all(hw_items, specs, var, var2):
+                continue
+
+            LOG.info('Specs %s matches' % name)
+
+            forced = (var2 != {})
+
+            if var2 == {}:
+                var2 = var
+
+            if times != '*':
+                if not self._update_times(name, -1):
+                    LOG.info('No more %s available' % name)
+                    continue
+                LOG.info('Decrementing %s' % name)
+
+            allocated = False
+            try:
+                idx, entry = self._update_cmdb(name, var, var2, forced,
+                                               sysname)
+                allocated = True
+            finally:
+                if not allocated and times != '*':
+                    self._update_times(name, 1)
+
+            if self._fingerprint_dir:
+                fingerprint.save(self._fingerprint_dir, fpr,
+                                 {'profile': name, 'idx': idx,
+                                  'entry': entry, 'var': dict(var)})
+            return name, var
+
+        if not valid_roles:
+            raise state.StateError('No more role available in %s' %
+                                   (self._state_filename,))
+        else:
+            raise state.StateError(
+                'Unable to match requirements on the following available '
+                'roles in %s: %s'
+                % (self._cfg_dir, ', '.join(valid_roles)))
+
+    def lock(self):
+        'Lock the state file until unlock is called.'
+        self._validate_lockname()
+        if not self._qlock:
+            self._qlock = locking.QueueLock(self._lockname)
+            self.lock_waits.append((os.path.basename(self._lockname),
+                                    self._qlock.acquire()))
+
+    def unlock(self):
+        'Called after the lock function to release a lock.'
+        if self._qlock:
+            self._qlock.release()
+            self._qlock = None
+
+# upload_state.py ends here
@@ -16,26 +16,71 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import sys
+'''Find if a value is used in CMDB files.
+
+$ verify-cmdb.py [-d <cache dir>] <key> <value> <cmdb>...
+
+exits with 0 if a used entry has <value> for <key> (ip, hostname, mac,
+sysname...) and 1 otherwise.
 
+$ verify-cmdb.py [-d <cache dir>] -b <cmdb>...
 
-def generate(g):
-    return []
+reads "<key> <value>" lines on stdin and prints "used" or "free" for
+each of them.
+
+The indexes of the CMDBs are kept in <cache dir> between calls when
+it is set.
+'''
+
+import getopt
+import sys
 
-key = sys.argv[1]
-val = sys.argv[2]
-cmdb = []
+import cache
+import cmdbindex
 
-for fname in sys.argv[3:]:
-    cmdb = cmdb + eval(open(fname).read(-1))
 
-for entry in cmdb:
+def main():
+    'Command line entry point.'
     try:
-        if entry[key] == val and entry['used'] == 1:
+        opts, args = getopt.getopt(sys.argv[1:], 'hd:b')
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    cache_dir = None
+    batch = False
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print __doc__
             sys.exit(0)
-    except KeyError:
-        pass
+        elif opt == '-d':
+            cache_dir = arg
+        elif opt == '-b':
+            batch = True
+
+    if len(args) < (1 if batch else 3):
+        print __doc__
+        sys.exit(2)
+
+    if batch:
+        index = cmdbindex.CmdbIndex(args, cache.create(cache_dir))
+        for line in sys.stdin:
+            query = line.split(None, 1)
+            if len(query) != 2:
+                continue
+            key, value = query[0], query[1].strip()
+            print '%s %s %s' % (key, value,
+                                'used' if index.is_used(key, value)
+                                else 'free')
+            sys.stdout.flush()
+        sys.exit(0)
+
+    index = cmdbindex.CmdbIndex(args[2:], cache.create(cache_dir))
+    sys.exit(0 if index.is_used(args[0], args[1]) else 1)
+
 
-sys.exit(1)
+if __name__ == "__main__":
+    main()
 
 # verify-cmdb.py ends here
@@ -20,6 +20,7 @@ import atexit
 import json
 import logging
 import sys
+import time
 
 from socket import socket, AF_INET, SOCK_STREAM
 from health_messages import Health_Message as HM
@@ -75,6 +76,14 @@ def ack(socket, msg):
     return
 
 
+def sync(socket, msg):
+    'Answer at once with our clock so the server can estimate its offset.'
+    reply = HM(HM.SYNC)
+    reply.sync_sent = msg.sync_sent
+    reply.peer_clock = time.time()
+    HP.send_hm_message(socket, reply)
+
+
 def nack(socket, msg):
     return
 
@@ -131,8 +140,8 @@ def module(socket, msg):
     handlers[msg.module](socket, msg)
 
 
-def encode_hardware(hrdw_json, msg):
-    'Init the hw part of a message from a json object'
+def encode_hardware(hrdw_json):
+    'Return the hw items of a json object'
 
     def encode(elt):
         'Encode unicode strings as strings else return the object'
@@ -141,9 +150,7 @@ def encode_hardware(hrdw_json, msg):
         except AttributeError:
             return elt
 
-    msg.hw = []
-    for info in hrdw_json:
-        msg.hw.append(tuple(map(encode, info)))
+    return [tuple(map(encode, info)) for info in hrdw_json]
 
 
 def connect_to_server(hostname):
@@ -159,8 +166,10 @@ def connect_to_server(hostname):
 
     msg = HM(HM.CONNECT)
 
-    hrdw_json = json.loads(open(sys.argv[1]).read(-1))
-    encode_hardware(hrdw_json, msg)
+    # the inventory is only sent with CONNECT: the benchmarks send back
+    # the items they add to it
+    inventory = encode_hardware(json.loads(open(sys.argv[1]).read(-1)))
+    msg.hw = list(inventory)
 
     HP.send_hm_message(s, msg, True)
     while True:
@@ -183,8 +192,7 @@ def connect_to_server(hostname):
             return True
             break
 
-        hrdw_json = json.loads(open(sys.argv[1]).read(-1))
-        encode_hardware(hrdw_json, msg)
+        msg.hw = list(inventory)
 
         handlers = {HM.NONE: none,
                     HM.CONNECT: connect,
@@ -192,6 +200,7 @@ def connect_to_server(hostname):
                     HM.ACK: ack,
                     HM.NACK: nack,
                     HM.MODULE: module,
+                    HM.SYNC: sync,
                     }
 
         HP.logger.info("Received %d" % msg.message)
@@ -207,6 +216,7 @@ def cleanup():
         s.shutdown(1)
         s.close()
 
+
 if __name__ == '__main__':
     HP.start_log('/var/log/health-client.log', logging.INFO)
     atexit.register(cleanup)
@@ -16,12 +16,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-from SocketServer import BaseRequestHandler, ThreadingTCPServer
 import ConfigParser
 import socket
 import struct
 from health_messages import Health_Message as HM
+import health_codec
 import health_libs as HL
+import health_loop
+import health_registry
+import health_scheduler
 import health_protocol as HP
 import logging
 import os
@@ -38,8 +41,11 @@ import getopt
 socket_list = {}
 lock_socket_list = threading.RLock()
 hosts = {}
+# inventory sent by each host with CONNECT
+inventories = {}
 lock_host = threading.RLock()
-hosts_state = {}
+# notified when a host connects, disconnects or changes of state
+hosts_changed = threading.Condition(lock_host)
 results_cpu = {}
 results_memory = {}
 results_network = {}
@@ -51,12 +57,35 @@ CPU_RUN = 1 << 0
 MEMORY_RUN = 1 << 1
 STORAGE_RUN = 1 << 2
 NETWORK_RUN = 1 << 3
+RUN_ITEMS = (CPU_RUN, MEMORY_RUN, STORAGE_RUN, NETWORK_RUN)
+# the state and the hypervisor of the hosts
+registry = health_registry.HostRegistry(RUN_ITEMS)
+# hosts whose result is waited for by the current iteration of each
+# benchmark: late results of the previous ones are dropped
+expected_results = dict([(item, set()) for item in RUN_ITEMS])
+# number of results of the stragglers given up on, dropped when they
+# arrive as the hosts may have been started again since
+abandoned_results = dict([(item, {}) for item in RUN_ITEMS])
 
 SCHED_FAIR = "fair"
+# the health_scheduler.Scheduler running the jobs
+scheduler = None
 
 start_jitter = {}
 stop_jitter = {}
-running_jitter = False
+# hosts whose benchmark is being timed
+jitter_hosts = set()
+# scheduled start of the hosts and how late they really started
+scheduled_start = {}
+start_skew = {}
+
+# the round trip time and the clock offset of the hosts, from the SYNC
+# exchange with the smallest round trip time
+clock_offsets = {}
+# number of SYNC exchanges left for the hosts being synchronized
+sync_pending = {}
+SYNC_SAMPLES = 5
+SYNC_TIMEOUT = 2
 average = lambda x: sum(x) * 1.0 / len(x)
 variance = lambda x: map(lambda y: (y - average(x)) ** 2, x)
 stdev = lambda x: math.sqrt(average(variance(x)))
@@ -69,21 +98,22 @@ def print_help():
     print '-f <file>  or --file <file>   : Mandatory option to select the benchmark file'
     print '-t <title> or --title <title> : Optinal option to define a title to this benchmark'
     print '                                 This is useful to describe a temporary context'
+    print '-p or --accept-pickle         : Accept the pickled messages of the clients'
+    print '                                 older than protocol version 4'
 
 
-def init_jitter():
-    global start_jitter
-    global stop_jitter
-    global running_jitter
-
-    start_jitter = {}
-    stop_jitter = {}
-    running_jitter = True
+def init_jitter(hosts_list):
+    # only the hosts of the job: other jobs may be running
+    for host in hosts_list:
+        start_jitter.pop(host, None)
+        stop_jitter.pop(host, None)
+        scheduled_start.pop(host, None)
+        start_skew.pop(host, None)
+    jitter_hosts.update(hosts_list)
 
 
-def disable_jitter():
-    global running_jitter
-    running_jitter = False
+def disable_jitter(hosts_list):
+    jitter_hosts.difference_update(hosts_list)
 
 
 def start_time(host):
@@ -103,69 +133,174 @@ def stop_time(host):
     stop_jitter[host] = timestamp
 
 
-class SocketHandler(BaseRequestHandler):
-    global hosts
-    global lock_host
-    timeout = 5
-    disable_nagle_algorithm = False  # Set TCP_NODELAY socket option
+def record_start_skew(host, msg):
+    'Record how late a host started compared to its scheduled start.'
+    if host in scheduled_start and host in clock_offsets and msg.peer_clock:
+        start_skew[host] = (msg.peer_clock - clock_offsets[host][1] -
+                            scheduled_start[host])
 
-    def handle(self):
-        lock_socket_list.acquire()
-        socket_list[self.client_address] = self.request
-        lock_socket_list.release()
 
-        HP.logger.debug('Got connection from %s' % self.client_address[0])
-        while True:
-            msg = HP.recv_hm_message(socket_list[self.client_address])
-            if not msg:
-                continue
-            if msg.message != HM.ACK:
+def send_sync(host):
+    msg = HM(HM.SYNC)
+    msg.sync_sent = time.time()
+    lock_socket_list.acquire()
+    HP.send_hm_message(socket_list[host], msg)
+    lock_socket_list.release()
 
-                # If we do receive a STARTING message, let's record the starting time
-                # No need to continue processing the packet, we can wait the next one
-                if msg.action == HM.STARTING:
-                    start_time(self.client_address)
-                    continue
 
-                if msg.message == HM.DISCONNECT:
-                    HP.logger.debug('Disconnecting from %s' %
-                                    self.client_address[0])
+def sync_received(host, msg):
+    '''Estimate the clock offset of a host from its answer to SYNC.
+
+Like NTP, the clock of the host is assumed to have been read in the
+middle of the round trip. Another SYNC is sent until SYNC_SAMPLES
+answers are received.
+'''
+    now = time.time()
+    rtt = now - msg.sync_sent
+    offset = msg.peer_clock - (msg.sync_sent + now) / 2
+    lock_host.acquire()
+    if host not in sync_pending:
+        # answer arriving after SYNC_TIMEOUT
+        lock_host.release()
+        return
+    if host not in clock_offsets or rtt < clock_offsets[host][0]:
+        clock_offsets[host] = (rtt, offset)
+    sync_pending[host] -= 1
+    left = sync_pending[host]
+    if left == 0:
+        del sync_pending[host]
+        hosts_changed.notify_all()
+    lock_host.release()
+    if left > 0:
+        send_sync(host)
+
+
+def sync_clocks(hosts_list):
+    '''Estimate the clock offsets of the hosts supporting it.
+
+Waits at most SYNC_TIMEOUT seconds for the answers.
+'''
+    synced = []
+    lock_host.acquire()
+    for host in hosts_list:
+        clock_offsets.pop(host, None)
+        if HP.peer_version(socket_list[host]) >= HM.sync_version:
+            sync_pending[host] = SYNC_SAMPLES
+            synced.append(host)
+    lock_host.release()
+    for host in synced:
+        send_sync(host)
+
+    def unsynced():
+        # other jobs may be synchronizing their hosts
+        return [host for host in synced if host in sync_pending]
+
+    if not wait_hosts(lambda: not unsynced(), SYNC_TIMEOUT):
+        HP.logger.error("No clock offset for hosts %s" % str(unsynced()))
+    lock_host.acquire()
+    for host in unsynced():
+        del sync_pending[host]
+        clock_offsets.pop(host, None)
+    lock_host.release()
+
+
+def schedule_start(bench, hosts_list):
+    '''Return the time at which the hosts have to start the benchmark.
+
+The clocks of the hosts are synchronized first. Returns 0 if they have
+to start when they receive the START message.
+'''
+    if bench['start-delay'] <= 0:
+        return 0
+    sync_clocks(hosts_list)
+    return time.time() + bench['start-delay']
+
+
+def host_start_at(host, start_at):
+    'Return start_at on the clock of host, 0 if its clock is unknown.'
+    if not start_at or host not in clock_offsets:
+        return 0
+    scheduled_start[host] = start_at
+    return start_at + clock_offsets[host][1]
+
+
+class HealthHandler(object):
+    'Handle the connections and the messages of the health clients.'
+
+    def connected(self, sock, address):
+        lock_socket_list.acquire()
+        socket_list[address] = sock
+        lock_socket_list.release()
+        HP.logger.debug('Got connection from %s' % address[0])
+
+    def received(self, address, msg):
+        if msg.message == HM.ACK:
+            return True
 
-                    lock_host.acquire()
-                    del hosts[self.client_address]
-                    del hosts_state[self.client_address]
-                    lock_host.release()
+        # If we do receive a STARTING message, let's record the starting time
+        # No need to continue processing the packet, we can wait the next one
+        if msg.action == HM.STARTING:
+            start_time(address)
+            record_start_skew(address, msg)
+            return True
 
-                    socket_list[self.client_address].close()
+        if msg.message == HM.SYNC:
+            sync_received(address, msg)
+            return True
 
-                    lock_socket_list.acquire()
-                    del socket_list[self.client_address]
-                    lock_socket_list.release()
-                    return
-                else:
-                    lock_host.acquire()
-                    hosts[self.client_address] = msg
-                    hosts_state[self.client_address] = NOTHING_RUN
-                    lock_host.release()
+        if msg.message == HM.DISCONNECT:
+            HP.logger.debug('Disconnecting from %s' % address[0])
+            # closed() forgets the host
+            return False
 
-                    if msg.message == HM.MODULE and msg.action == HM.COMPLETED:
-                        if running_jitter is True:
-                            stop_time(self.client_address)
+        lock_host.acquire()
+        if msg.hw_delta:
+            # only the results: merge them with the inventory
+            msg.hw = inventories.get(address, []) + msg.hw
+            msg.hw_delta = False
+        else:
+            inventories[address] = msg.hw
+        hosts[address] = msg
+        if address not in registry:
+            registry.add(address, HL.get_value(msg.hw, "system", "product",
+                                               "serial"))
+        set_host_state(address, NOTHING_RUN)
+        lock_host.release()
+
+        if msg.message == HM.MODULE and msg.action == HM.COMPLETED:
+            if address in jitter_hosts:
+                stop_time(address)
+
+            if msg.module == HM.CPU:
+                cpu_completed(address, msg)
+            elif msg.module == HM.MEMORY:
+                memory_completed(address, msg)
+            elif msg.module == HM.NETWORK:
+                network_completed(address, msg)
+            elif msg.module == HM.STORAGE:
+                storage_completed(address, msg)
+        return True
+
+    def closed(self, address):
+        lock_host.acquire()
+        registry.remove(address)
+        hosts.pop(address, None)
+        inventories.pop(address, None)
+        clock_offsets.pop(address, None)
+        sync_pending.pop(address, None)
+        for abandoned in abandoned_results.values():
+            abandoned.pop(address, None)
+        hosts_changed.notify_all()
+        lock_host.release()
 
-                        if msg.module == HM.CPU:
-                            cpu_completed(self.client_address, msg)
-                        elif msg.module == HM.MEMORY:
-                            memory_completed(self.client_address, msg)
-                        elif msg.module == HM.NETWORK:
-                            network_completed(self.client_address, msg)
-                        elif msg.module == HM.STORAGE:
-                            storage_completed(self.client_address, msg)
+        lock_socket_list.acquire()
+        del socket_list[address]
+        lock_socket_list.release()
 
 
 def createAndStartServer():
     global serv
-    ThreadingTCPServer.allow_reuse_address = True
-    serv = ThreadingTCPServer(('', 20000), SocketHandler,
+    serv = health_loop.Server(('', 20000), HealthHandler(),
                               bind_and_activate=False)
     l_onoff = 1
     l_linger = 0
@@ -178,70 +313,165 @@ def createAndStartServer():
 
 
 def cpu_completed(host, msg):
-    global hosts_state
-    global results_cpu
-    hosts_state[host] &= ~CPU_RUN
-    results_cpu[host] = msg.hw
+    store_result(host, CPU_RUN, results_cpu, msg)
 
 
 def memory_completed(host, msg):
-    global hosts_state
-    global results_memory
-    hosts_state[host] &= ~MEMORY_RUN
-    results_memory[host] = msg.hw
+    store_result(host, MEMORY_RUN, results_memory, msg)
 
 
 def network_completed(host, msg):
-    global hosts_state
-    global results_network
-    hosts_state[host] &= ~NETWORK_RUN
-    results_network[host] = msg.hw
+    store_result(host, NETWORK_RUN, results_network, msg)
 
 
 def storage_completed(host, msg):
-    global hosts_state
-    global results_storage
-    hosts_state[host] &= ~STORAGE_RUN
-    results_storage[host] = msg.hw
+    store_result(host, STORAGE_RUN, results_storage, msg)
 
 
-def get_host_list(item):
-    global hosts
-    global hosts_state
-    selected_hosts = {}
-    for host in hosts.keys():
-        if hosts_state[host] & item == item:
-            selected_hosts[host] = True
+def set_host_state(host, state):
+    'Change the state of a host and wake up the threads waiting for it.'
+    lock_host.acquire()
+    registry.set_state(host, state)
+    hosts_changed.notify_all()
+    lock_host.release()
 
-    return selected_hosts
 
+def add_host_state(host, item):
+    lock_host.acquire()
+    set_host_state(host, registry.state(host) | item)
+    lock_host.release()
 
-def compute_affinity(bench=[]):
-    affinity = {}
-    global hosts
 
-    def acceptable_host(host_list, host):
-        if (len(host_list) == 0):
-            return True
-        if host in host_list:
-            return True
-        return False
+def clear_host_state(host, item):
+    lock_host.acquire()
+    set_host_state(host, registry.state(host) & ~item)
+    lock_host.release()
 
-    for host in hosts.keys():
-        hw = hosts[host].hw
-        system_id = HL.get_value(hw, "system", "product", "serial")
 
-        if len(bench) > 0:
-            if acceptable_host(bench['affinity-hosts'], system_id) is False:
-                continue
+def is_running(host, item):
+    return registry.is_running(host, item)
+
+
+def wait_hosts(predicate, timeout=None):
+    '''Wait until predicate() is True or for timeout seconds.
+
+predicate() is called with lock_host held each time a host connects,
+disconnects or changes of state. Returns its last result.
+'''
+    if timeout is not None:
+        deadline = time.time() + timeout
+    hosts_changed.acquire()
+    try:
+        result = predicate()
+        while not result:
+            if timeout is None:
+                hosts_changed.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                hosts_changed.wait(remaining)
+            result = predicate()
+        return result
+    finally:
+        hosts_changed.release()
+
+
+def wait_completion(bench, item):
+    '''Wait until all the hosts of the job running item completed it.
+
+Returns as soon as the last host reported its result. Hosts still
+running after runtime + straggler-timeout seconds are logged and not
+waited for anymore if straggler-timeout is set: they are no longer
+running item for the next iterations and their late result is dropped.
+'''
+    timeout = None
+    if bench['straggler-timeout'] > 0:
+        # the hosts wait start-delay seconds before starting
+        timeout = (max(bench['start-delay'], 0) + bench['runtime'] +
+                   bench['straggler-timeout'])
+    if wait_hosts(lambda: registry.running_hosts(item).isdisjoint(
+            bench['pool']), timeout):
+        return True
+    lock_host.acquire()
+    stragglers = [host for host in registry.running_hosts(item)
+                  if host in bench['pool']]
+    HP.logger.error("Hosts still running after %d seconds: %s" %
+                    (timeout, str(stragglers)))
+    expected_results[item].difference_update(bench['pool'])
+    abandoned = abandoned_results[item]
+    for host in stragglers:
+        abandoned[host] = abandoned.get(host, 0) + 1
+        set_host_state(host, registry.state(host) & ~item)
+    lock_host.release()
+    return False
+
+
+def expect_results(bench, item, results, hosts_list):
+    '''Wait for the results of hosts_list only in the job of bench.
+
+The results of the previous iterations of the job are forgotten.
+'''
+    lock_host.acquire()
+    expected_results[item].difference_update(bench['pool'])
+    expected_results[item].update(hosts_list)
+    for host in bench['pool']:
+        results.pop(host, None)
+    lock_host.release()
+
+
+def store_result(host, item, results, msg):
+    '''Record the result of a host if the current iteration waits for it
+and mark the host as done.
+
+The late result of a straggler given up on is dropped.
+'''
+    lock_host.acquire()
+    abandoned = abandoned_results[item]
+    if abandoned.get(host):
+        # the host may run the next iteration: it keeps its state
+        abandoned[host] -= 1
+        if not abandoned[host]:
+            del abandoned[host]
+        HP.logger.debug("Ignoring the late result of %s" % str(host))
+        lock_host.release()
+        return
+    if host in expected_results[item]:
+        expected_results[item].discard(host)
+        results[host] = msg.hw
+    else:
+        HP.logger.debug("Ignoring a result of %s not waited for" % str(host))
+    lock_host.release()
+    clear_host_state(host, item)
+
+
+def running_hosts(bench, item):
+    'Return the hosts of the job running item.'
+    return [host for host in get_host_list(item) if host in bench['pool']]
 
-        if system_id not in affinity.keys():
-            affinity[system_id] = [host]
-        else:
-            # If the system is already known, it means that several
-            # virtual machines are sharing the same Hypervisor
-            affinity[system_id].append(host)
 
+def get_host_list(item):
+    lock_host.acquire()
+    selected_hosts = dict.fromkeys(registry.running_hosts(item), True)
+    lock_host.release()
+    return selected_hosts
+
+
+def compute_affinity(bench=[]):
+    lock_host.acquire()
+    if len(bench) > 0:
+        affinity = registry.affinity(bench['affinity-hosts'])
+    else:
+        affinity = registry.affinity()
+    lock_host.release()
+    if bench and bench.get('pool') is not None:
+        # only the hosts given to the job
+        affinity = dict([(serial, [host for host in hosts_list
+                                   if host in bench['pool']])
+                         for serial, hosts_list in affinity.items()])
+        affinity = dict([(serial, hosts_list)
+                         for serial, hosts_list in affinity.items()
+                         if hosts_list])
     return affinity
 
 
@@ -311,26 +541,25 @@ def dump_affinity(bench, bench_type):
 
 
 def start_cpu_bench(bench):
-    global hosts_state
     nb_hosts = bench['nb-hosts']
     msg = HM(HM.MODULE, HM.CPU, HM.START)
     msg.cpu_instances = bench['cores']
     msg.running_time = bench['runtime']
 
-    for host in bench['hosts-list']:
-        if nb_hosts == 0:
-            break
-        if host not in get_host_list(CPU_RUN).keys():
-            hosts_state[host] |= CPU_RUN
-            nb_hosts = nb_hosts - 1
-            lock_socket_list.acquire()
-            start_time(host)
-            HP.send_hm_message(socket_list[host], msg)
-            lock_socket_list.release()
+    selected_hosts = [host for host in bench['hosts-list']
+                      if not is_running(host, CPU_RUN)][:nb_hosts]
+    expect_results(bench, CPU_RUN, results_cpu, selected_hosts)
+    start_at = schedule_start(bench, selected_hosts)
+    for host in selected_hosts:
+        add_host_state(host, CPU_RUN)
+        lock_socket_list.acquire()
+        start_time(host)
+        msg.start_at = host_start_at(host, start_at)
+        HP.send_hm_message(socket_list[host], msg)
+        lock_socket_list.release()
 
 
 def start_memory_bench(bench):
-    global hosts_state
     nb_hosts = bench['nb-hosts']
     msg = HM(HM.MODULE, HM.MEMORY, HM.START)
     msg.cpu_instances = bench['cores']
@@ -338,20 +567,20 @@ def start_memory_bench(bench):
     msg.running_time = bench['runtime']
     msg.mode = bench['mode']
 
-    for host in bench['hosts-list']:
-        if nb_hosts == 0:
-            break
-        if host not in get_host_list(MEMORY_RUN).keys():
-            hosts_state[host] |= MEMORY_RUN
-            nb_hosts = nb_hosts - 1
-            lock_socket_list.acquire()
-            start_time(host)
-            HP.send_hm_message(socket_list[host], msg)
-            lock_socket_list.release()
+    selected_hosts = [host for host in bench['hosts-list']
+                      if not is_running(host, MEMORY_RUN)][:nb_hosts]
+    expect_results(bench, MEMORY_RUN, results_memory, selected_hosts)
+    start_at = schedule_start(bench, selected_hosts)
+    for host in selected_hosts:
+        add_host_state(host, MEMORY_RUN)
+        lock_socket_list.acquire()
+        start_time(host)
+        msg.start_at = host_start_at(host, start_at)
+        HP.send_hm_message(socket_list[host], msg)
+        lock_socket_list.release()
 
 
 def start_storage_bench(bench):
-    global hosts_state
     nb_hosts = bench['nb-hosts']
     msg = HM(HM.MODULE, HM.STORAGE, HM.START)
     msg.block_size = bench['block-size']
@@ -361,20 +590,20 @@ def start_storage_bench(bench):
     msg.device = bench['device']
     msg.rampup_time = bench['rampup-time']
 
-    for host in bench['hosts-list']:
-        if nb_hosts == 0:
-            break
-        if host not in get_host_list(STORAGE_RUN).keys():
-            hosts_state[host] |= STORAGE_RUN
-            nb_hosts = nb_hosts - 1
-            lock_socket_list.acquire()
-            start_time(host)
-            HP.send_hm_message(socket_list[host], msg)
-            lock_socket_list.release()
+    selected_hosts = [host for host in bench['hosts-list']
+                      if not is_running(host, STORAGE_RUN)][:nb_hosts]
+    expect_results(bench, STORAGE_RUN, results_storage, selected_hosts)
+    start_at = schedule_start(bench, selected_hosts)
+    for host in selected_hosts:
+        add_host_state(host, STORAGE_RUN)
+        lock_socket_list.acquire()
+        start_time(host)
+        msg.start_at = host_start_at(host, start_at)
+        HP.send_hm_message(socket_list[host], msg)
+        lock_socket_list.release()
 
 
 def prepare_network_bench(bench, mode):
-    global hosts_state
     nb_hosts = bench['nb-hosts']
     msg = HM(HM.MODULE, HM.NETWORK, mode)
     msg.network_test = bench['mode']
@@ -386,8 +615,8 @@ def prepare_network_bench(bench, mode):
         for host in bench['hosts-list'][hv]:
             if nb_hosts == 0:
                 break
-            if host not in get_host_list(NETWORK_RUN).keys():
-                hosts_state[host] |= NETWORK_RUN
+            if not is_running(host, NETWORK_RUN):
+                add_host_state(host, NETWORK_RUN)
                 nb_hosts = nb_hosts - 1
                 lock_socket_list.acquire()
                 msg.my_peer_name = bench['ip-list'][host]
@@ -402,18 +631,14 @@ def prepare_network_bench(bench, mode):
 
     HP.logger.info("NETWORK: %s in progress" % string_mode)
     max_timeout = 45
-    timeout = 0
-    while (get_host_list(NETWORK_RUN).keys()):
-        timeout = timeout + 1
-        time.sleep(1)
-        if timeout == max_timeout:
-            HP.logger.error("NETWORK: Failed to %s the following hosts : " % string_mode + str(get_host_list(NETWORK_RUN).keys()))
-            return False
+    if not wait_hosts(lambda: registry.running_hosts(NETWORK_RUN).isdisjoint(
+            bench['pool']), max_timeout):
+        HP.logger.error("NETWORK: Failed to %s the following hosts : " % string_mode + str(running_hosts(bench, NETWORK_RUN)))
+        return False
     return True
 
 
 def start_network_bench(bench):
-    global hosts_state
     nb_hosts = bench['nb-hosts']
     msg = HM(HM.MODULE, HM.NETWORK, HM.START)
     msg.block_size = bench['block-size']
@@ -425,6 +650,9 @@ def start_network_bench(bench):
     arity_group = []
     used_hosts = []
     ip_list = {}
+    # the started hosts are added below
+    expect_results(bench, NETWORK_RUN, results_network, [])
+    start_at = schedule_start(bench, bench['ip-list'].keys())
 
     while nb_hosts > 0:
         for hv in bench['hosts-list']:
@@ -442,11 +670,16 @@ def start_network_bench(bench):
                     bench['arity_groups'].append(arity_group)
                     msg.peer_servers = ip_list.items()
                     for peer_server in arity_group:
-                        if peer_server not in get_host_list(NETWORK_RUN).keys():
+                        if not is_running(peer_server, NETWORK_RUN):
                             msg.my_peer_name = bench['ip-list'][peer_server]
-                            hosts_state[peer_server] |= NETWORK_RUN
+                            lock_host.acquire()
+                            expected_results[NETWORK_RUN].add(peer_server)
+                            lock_host.release()
+                            add_host_state(peer_server, NETWORK_RUN)
                             lock_socket_list.acquire()
                             start_time(peer_server)
+                            msg.start_at = host_start_at(peer_server,
+                                                         start_at)
                             HP.send_hm_message(socket_list[peer_server], msg)
                             lock_socket_list.release()
                     arity_group = []
@@ -467,13 +700,12 @@ def disconnect_clients():
         HP.send_hm_message(socket_list[host], msg)
         lock_socket_list.release()
 
-    while(hosts.keys()):
-        time.sleep(1)
+    while not wait_hosts(lambda: not hosts, 1):
         HP.logger.info("Still %d hosts connected" % len(hosts.keys()))
 
     HP.logger.info("All hosts disconnected")
     serv.shutdown()
-    serv.socket.close()
+    serv.server_close()
 
 
 def save_hw(items, name, hwdir):
@@ -486,16 +718,19 @@ def save_hw(items, name, hwdir):
 
 
 def dump_hosts(log_dir):
-    global hosts
-    unique_hosts_list = []
-    for host in hosts.keys():
-        uuid = HL.get_value(hosts[host].hw, "system", "product", "serial")
-        if uuid not in unique_hosts_list:
-            unique_hosts_list.append(uuid)
+    lock_host.acquire()
+    unique_hosts_list = registry.by_serial.keys()
+    lock_host.release()
     pprint.pprint(unique_hosts_list, stream=open(log_dir+"/hosts", 'w'))
     pprint.pprint(compute_affinity(), stream=open(log_dir+"/affinity", 'w'))
 
 
+def bench_settings(bench):
+    'Return the settings of a benchmark without its pool of hosts.'
+    return dict([(key, value) for key, value in bench.items()
+                 if key != 'pool'])
+
+
 def prepare_metrics(log_dir, bench, bench_type):
     dest_dir = log_dir + '/%d/' % bench['nb-hosts']
     if bench_type == HM.CPU:
@@ -516,7 +751,7 @@ def prepare_metrics(log_dir, bench, bench_type):
         HL.fatal_error("Cannot create %s directory (%s)" % (dest_dir, e.errno))
 
     output = {}
-    output['bench'] = bench
+    output['bench'] = bench_settings(bench)
     output['affinity'] = dump_affinity(bench, bench_type)
     pprint.pprint(output, stream=open(dest_dir+"/metrics", 'w'))
     return dest_dir
@@ -534,6 +769,10 @@ def compute_metrics(dest_dir, bench, bench_type):
     else:
         HL.fatal_error("Unknown benchmark type in compute_metrics")
 
+    # the results of the other jobs running at the same time are not ours
+    results = dict([(host, hw) for host, hw in results.items()
+                    if host in bench['pool']])
+
     delta_start_jitter = {}
     duration = {}
     real_start = {}
@@ -557,12 +796,27 @@ def compute_metrics(dest_dir, bench, bench_type):
         save_hw(results[host], filename_and_macs['sysname'], dest_dir)
 
     output = {}
-    output['bench'] = bench
+    output['bench'] = bench_settings(bench)
     output['hosts'] = results.keys()
     output['affinity'] = dump_affinity(bench, bench_type)
     output['start_time'] = real_start
     output['start_lag'] = delta_start_jitter
     output['duration'] = duration
+    # time between the scheduled start and the real start of the hosts,
+    # known to the round trip time of their clock synchronization
+    output['start_skew'] = dict([(host, start_skew[host])
+                                 for host in results.keys()
+                                 if host in start_skew])
+    output['clock_rtt'] = dict([(host, clock_offsets[host][0])
+                                for host in results.keys()
+                                if host in clock_offsets])
+    if output['start_skew']:
+        skews = output['start_skew'].values()
+        output['start_skew_spread'] = max(skews) - min(skews)
+    # the jobs which ran on the same hypervisors and may have disturbed
+    # this one
+    if scheduler:
+        output['shared_hypervisors'] = scheduler.shared_with(bench['name'])
     pprint.pprint(output, stream=open(dest_dir+"/metrics", 'w'))
 
 
@@ -621,6 +875,12 @@ def parse_job_config(bench, job, component, log_dir):
     bench['name'] = get_default_value(job, 'name', '')
     bench['affinity'] = get_default_value(job, 'affinity', SCHED_FAIR)
     bench['runtime'] = get_default_value(job, 'runtime', bench['runtime'])
+    bench['straggler-timeout'] = get_default_value(job, 'straggler-timeout',
+                                                   bench['straggler-timeout'])
+    bench['start-delay'] = get_default_value(job, 'start-delay',
+                                             bench['start-delay'])
+    bench['share-hypervisors'] = get_default_value(job, 'share-hypervisors',
+                                                   False)
     affinity_list = get_default_value(job, 'affinity-hosts', '')
     affinity_hosts = []
     if affinity_list:
@@ -629,9 +889,11 @@ def parse_job_config(bench, job, component, log_dir):
 
     bench['affinity-hosts'] = affinity_hosts
     if len(bench['affinity-hosts']) > 0:
-        if len(bench['affinity-hosts']) != len(compute_affinity(bench)):
+        # all the hypervisors, not only the ones of the pool of the job
+        hypervisors = compute_affinity({'affinity-hosts': bench['affinity-hosts']})
+        if len(bench['affinity-hosts']) != len(hypervisors):
             HP.logger.error("ERROR: Available hypervisors is different than affinity-hosts")
-            HP.logger.error("ERROR: %d hypervisors while we expect %d" % (len(compute_affinity(bench)), len(bench['affinity-hosts'])))
+            HP.logger.error("ERROR: %d hypervisors while we expect %d" % (len(hypervisors), len(bench['affinity-hosts'])))
             HP.logger.error("ERROR: Please check %s/affinity to see detected hypervisors" % log_dir)
             return False
 
@@ -764,16 +1026,13 @@ def do_network_job(bench_all, current_job, log_dir, total_runtime):
                                                 iter_bench['nb-hosts'], iter_bench['step-hosts'],
                                                 iter_bench['runtime']))
 
-            init_jitter()
+            init_jitter(iter_bench['pool'])
 
             start_network_bench(iter_bench)
 
-            time.sleep(bench['runtime'])
-
-            while (get_host_list(NETWORK_RUN).keys()):
-                time.sleep(1)
+            wait_completion(iter_bench, NETWORK_RUN)
 
-            disable_jitter()
+            disable_jitter(iter_bench['pool'])
 
             compute_metrics(metrics_log_dir, iter_bench, HM.NETWORK)
 
@@ -822,16 +1081,13 @@ def do_storage_job(bench_all, current_job, log_dir, total_runtime):
 
             metrics_log_dir = prepare_metrics(log_dir, iter_bench, HM.STORAGE)
 
-            init_jitter()
+            init_jitter(iter_bench['pool'])
 
             start_storage_bench(iter_bench)
 
-            time.sleep(bench['runtime'])
-
-            while (get_host_list(STORAGE_RUN).keys()):
-                time.sleep(1)
+            wait_completion(iter_bench, STORAGE_RUN)
 
-            disable_jitter()
+            disable_jitter(iter_bench['pool'])
 
             compute_metrics(metrics_log_dir, iter_bench, HM.STORAGE)
     else:
@@ -868,16 +1124,13 @@ def do_memory_job(bench_all, current_job, log_dir, total_runtime):
 
             metrics_log_dir = prepare_metrics(log_dir, iter_bench, HM.MEMORY)
 
-            init_jitter()
+            init_jitter(iter_bench['pool'])
 
             start_memory_bench(iter_bench)
 
-            time.sleep(bench['runtime'])
+            wait_completion(iter_bench, MEMORY_RUN)
 
-            while (get_host_list(MEMORY_RUN).keys()):
-                time.sleep(1)
-
-            disable_jitter()
+            disable_jitter(iter_bench['pool'])
 
             compute_metrics(metrics_log_dir, iter_bench, HM.MEMORY)
     else:
@@ -912,16 +1165,13 @@ def do_cpu_job(bench_all, current_job, log_dir, total_runtime):
 
             metrics_log_dir = prepare_metrics(log_dir, iter_bench, HM.CPU)
 
-            init_jitter()
+            init_jitter(iter_bench['pool'])
 
             start_cpu_bench(iter_bench)
 
-            time.sleep(bench['runtime'])
-
-            while (get_host_list(CPU_RUN).keys()):
-                time.sleep(1)
+            wait_completion(iter_bench, CPU_RUN)
 
-            disable_jitter()
+            disable_jitter(iter_bench['pool'])
 
             compute_metrics(metrics_log_dir, iter_bench, HM.CPU)
     else:
@@ -930,6 +1180,7 @@ def do_cpu_job(bench_all, current_job, log_dir, total_runtime):
 
 def non_interactive_mode(filename, title):
     global hosts
+    global scheduler
     total_runtime = 0
     name = "undefined"
     bench_all = {}
@@ -956,6 +1207,9 @@ def non_interactive_mode(filename, title):
         return
 
     bench_all['runtime'] = get_default_value(job, 'runtime', 10)
+    bench_all['straggler-timeout'] = get_default_value(job, 'straggler-timeout', 0)
+    # synchronized starts are opt-in: they cost a SYNC round per step
+    bench_all['start-delay'] = get_default_value(job, 'start-delay', 0)
     bench_all['required-hypervisors'] = get_default_value(job, 'required-hypervisors', 0)
 
     log_dir = prepare_log_dir(name)
@@ -970,14 +1224,16 @@ def non_interactive_mode(filename, title):
         HP.logger.info("Expecting %d hosts to start job %s" %
                        (bench_all['required-hosts'], name))
     hosts_count = len(hosts.keys())
-    previous_hosts_count = hosts_count
+    last_dump = 0
     while (int(hosts_count) < bench_all['required-hosts']):
-        if (hosts_count != previous_hosts_count):
-            HP.logger.info("Still %d hosts to connect" % (bench_all['required-hosts'] - int(hosts_count)))
-            previous_hosts_count = hosts_count
-            dump_hosts(log_dir)
+        previous_hosts_count = hosts_count
+        wait_hosts(lambda: len(hosts) != previous_hosts_count)
         hosts_count = len(hosts.keys())
-        time.sleep(1)
+        # hosts connect in bursts: report them once per second
+        if time.time() - last_dump >= 1:
+            HP.logger.info("Still %d hosts to connect" % max(0, bench_all['required-hosts'] - int(hosts_count)))
+            dump_hosts(log_dir)
+            last_dump = time.time()
 
     dump_hosts(log_dir)
 
@@ -989,29 +1245,37 @@ def non_interactive_mode(filename, title):
         return
 
     HP.logger.info("Starting %s" % name)
+
+    def run_job(job_name, current_job, pool):
+        for results in (results_cpu, results_memory, results_network,
+                        results_storage):
+            for host in pool:
+                results.pop(host, None)
+        bench = dict(bench_all)
+        bench['pool'] = pool
+        if "cpu" in current_job['component']:
+            do_cpu_job(bench, current_job, log_dir, total_runtime)
+        if "memory" in current_job['component']:
+            do_memory_job(bench, current_job, log_dir, total_runtime)
+        if "network" in current_job['component']:
+            do_network_job(bench, current_job, log_dir, total_runtime)
+        if "storage" in current_job['component']:
+            do_storage_job(bench, current_job, log_dir, total_runtime)
+
+    plan = []
     for next_job in job['jobs']:
-        HP.logger.info("Starting job %s" % next_job)
-        global results_network
-        global results_cpu
-        global results_memory
-        global results_storage
-        results_network = {}
-        results_cpu = {}
-        results_memory = {}
-        results_storage = {}
         current_job = job['jobs'][next_job]
         current_job['name'] = next_job
         if 'component' not in current_job.keys():
             HP.logger.error("Missing component in job %s, canceling job" % current_job['name'])
             continue
-        if "cpu" in current_job['component']:
-                do_cpu_job(bench_all, current_job, log_dir, total_runtime)
-        if "memory" in current_job['component']:
-                do_memory_job(bench_all, current_job, log_dir, total_runtime)
-        if "network" in current_job['component']:
-                do_network_job(bench_all, current_job, log_dir, total_runtime)
-        if "storage" in current_job['component']:
-                do_storage_job(bench_all, current_job, log_dir, total_runtime)
+        plan.append((next_job, current_job))
+
+    # jobs run at the same time on different hypervisors unless exclusive
+    scheduler = health_scheduler.Scheduler(plan, compute_affinity(), run_job,
+                                           bench_all['required-hosts'],
+                                           HP.logger)
+    pprint.pprint(scheduler.run(), stream=open(log_dir + "/plan", 'w'))
 
     HP.logger.info("End of %s" % name)
     HP.logger.info("Results are available here : %s" % log_dir)
@@ -1026,7 +1290,8 @@ if __name__ == '__main__':
     startup_date = time.strftime("%Y_%m_%d-%Hh%M", time.localtime())
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hf:t:", ['file', 'title'])
+        opts, args = getopt.getopt(sys.argv[1:], "hf:t:p",
+                                   ['file', 'title', 'accept-pickle'])
     except getopt.GetoptError:
         print "Error: One of the options passed to the cmdline was not supported"
         print "Please fix your command line or read the help (-h option)"
@@ -1040,6 +1305,9 @@ if __name__ == '__main__':
             input_file = arg
         elif opt in ("-t", "--title"):
             title = arg
+        elif opt in ("-p", "--accept-pickle"):
+            # unpickling runs code sent by the clients
+            health_codec.ACCEPT_PICKLE = True
 
     if not input_file:
         HP.logger.error("You must provide a yaml file as argument")
@@ -19,6 +19,7 @@ from health_messages import Health_Message as HM
 import health_protocol as HP
 import health_libs as HL
 import logging
+import time
 
 
 class Health_Bench():
@@ -41,31 +42,62 @@ class Health_Bench():
     def none(self):
         return
 
+    def send(self):
+        '''Send the message with the hw items added since the bench
+started if the server already knows the inventory.'''
+        if HP.peer_version(self.socket) < HM.hw_delta_version:
+            HP.send_hm_message(self.socket, self.message)
+            return
+        hw = self.message.hw
+        self.message.hw = hw[self.hw_start:]
+        self.message.hw_delta = True
+        try:
+            HP.send_hm_message(self.socket, self.message)
+        finally:
+            self.message.hw = hw
+            del self.message.hw_delta
+
     def notcompleted(self, module):
         self.message.message = HM.MODULE
         self.message.module = module
         self.message.action = HM.NOTCOMPLETED
         HL.check_mce_status(self.message.hw)
-        HP.send_hm_message(self.socket, self.message)
+        self.send()
 
     def completed(self, module):
         self.message.message = HM.MODULE
         self.message.module = module
         self.message.action = HM.COMPLETED
         HL.check_mce_status(self.message.hw)
-        HP.send_hm_message(self.socket, self.message)
+        self.send()
+
+    def wait_start(self):
+        'Sleep until the start time given by the server if any.'
+        if not self.message.start_at:
+            return
+        delay = self.message.start_at - time.time()
+        if delay > 0:
+            self.logger.info("Starting in %.3f seconds" % delay)
+        while delay > 0:
+            time.sleep(delay)
+            delay = self.message.start_at - time.time()
 
     def starting(self, module):
+        self.wait_start()
+        # the server computes the start skew from it
+        self.message.peer_clock = time.time()
         self.message.message = HM.MODULE
         self.message.module = module
         self.message.action = HM.STARTING
-        HP.send_hm_message(self.socket, self.message)
+        self.send()
 
     def __init__(self, msg, socket, logger):
         logger.info("INIT BENCH")
         self.message = msg
         self.socket = socket
         self.logger = logger
+        # the inventory: the results are appended after it
+        self.hw_start = len(msg.hw)
 
 
 class Health_CPU(Health_Bench):
@@ -0,0 +1,333 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Binary encoding of the health messages.
+
+A frame is:
+
+- a magic byte, the protocol version and a flags byte. The COMPRESSED
+  flag is set when the rest of the frame is compressed with zlib, which
+  is only done above COMPRESS_THRESHOLD bytes.
+- the string table: the number of strings then each string prefixed by
+  its length. All the strings of the message, like the keys of the hw
+  tuples, are sent once.
+- the references to the string table of all the strings of the message
+  in order, as an array of 1, 2 or 4 bytes integers.
+- the message, module and action numbers and the need_ack flag.
+- the fields set on the message, each one as its number in FIELDS and
+  its value.
+
+Integers are varints. Values are tagged so only None, booleans,
+integers, floats, strings, tuples, lists and dicts can be decoded:
+decoding never runs code from the peer, unlike pickle. Tuples and
+lists of strings, like the hw tuples, are only their tag and length
+in the frame and are rebuilt from the references by slicing.
+
+Frames from peers older than PROTOCOL_VERSION are zlib compressed
+pickles; they are recognized because they cannot start with MAGIC and
+are only decoded if ACCEPT_PICKLE is True. Unpickling runs code from
+the peer so it is False unless health-server is started with
+--accept-pickle for legacy clients.
+'''
+
+import array
+import sys
+import pickle
+import struct
+import zlib
+
+from health_messages import Health_Message as HM
+
+MAGIC = 0xed
+PROTOCOL_VERSION = HM.protocol_version
+# the last version sending pickles
+PICKLE_VERSION = 3
+COMPRESSED = 1
+COMPRESS_THRESHOLD = 1024
+ACCEPT_PICKLE = False
+
+# the fields of Health_Message sent on the wire, numbered by their
+# position: only append to this list
+FIELDS = ('hw', 'running_time', 'cpu_instances', 'block_size', 'mode',
+          'access', 'device', 'rampup_time', 'network_test',
+          'network_connection', 'ports_list', 'peer_servers',
+          'my_peer_name', 'port_base', 'hw_delta', 'start_at', 'sync_sent',
+          'peer_clock')
+_FIELD_IDS = dict([(name, idx) for idx, name in enumerate(FIELDS)])
+
+_HEADER = struct.Struct('!BBB')
+_DOUBLE = struct.Struct('!d')
+
+(_NONE, _TRUE, _FALSE, _INT, _NEGINT, _FLOAT, _STR, _UNICODE, _TUPLE,
+ _LIST, _DICT, _STR_TUPLE, _STR_LIST) = [chr(tag) for tag in range(13)]
+
+# array type codes of the references by size
+_REF_TYPES = {1: 'B', 2: 'H', 4: 'I'}
+
+
+class CodecError(Exception):
+    'Raised when a frame cannot be decoded.'
+
+
+def _varint(value):
+    if value < 0x80:
+        return chr(value)
+    result = []
+    while value >= 0x80:
+        result.append(chr(value & 0x7f | 0x80))
+        value >>= 7
+    result.append(chr(value))
+    return ''.join(result)
+
+
+def _refs_array(refs, count):
+    'Return the smallest array of the references to count strings.'
+    for size in (1, 2, 4):
+        if count <= 1 << (8 * size):
+            result = array.array(_REF_TYPES[size], refs)
+            if sys.byteorder == 'big':
+                result.byteswap()
+            return result
+    raise CodecError('too many strings')
+
+
+class _Encoder(object):
+
+    def __init__(self):
+        self.strings = {}
+        self.refs = []
+        self.out = []
+
+    def string_seq(self, value):
+        strings = self.strings
+        setdefault = strings.setdefault
+        self.refs.extend([setdefault(elt, len(strings)) for elt in value])
+
+    def value(self, value):
+        out = self.out
+        if isinstance(value, str):
+            out.append(_STR)
+            self.refs.append(self.strings.setdefault(value,
+                                                     len(self.strings)))
+        elif isinstance(value, (tuple, list)):
+            is_tuple = isinstance(value, tuple)
+            if set(map(type, value)) == set([str]):
+                out.append((_STR_TUPLE if is_tuple else _STR_LIST) +
+                           _varint(len(value)))
+                self.string_seq(value)
+                return
+            out.append((_TUPLE if is_tuple else _LIST) + _varint(len(value)))
+            for elt in value:
+                self.value(elt)
+        elif value is None:
+            out.append(_NONE)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, (int, long)):
+            if value >= 0:
+                out.append(_INT + _varint(value))
+            else:
+                out.append(_NEGINT + _varint(-value))
+        elif isinstance(value, float):
+            out.append(_FLOAT + _DOUBLE.pack(value))
+        elif isinstance(value, unicode):
+            out.append(_UNICODE)
+            self.refs.append(self.strings.setdefault(value.encode('utf-8'),
+                                                     len(self.strings)))
+        elif isinstance(value, dict):
+            # keys then values so string keys are a single sequence
+            out.append(_DICT)
+            self.value(value.keys())
+            self.value(value.values())
+        else:
+            raise CodecError('cannot encode %s' % type(value).__name__)
+
+    def header(self):
+        'Return the string table and the references.'
+        strings = sorted(self.strings, key=self.strings.get)
+        refs = _refs_array(self.refs, len(strings))
+        return (_varint(len(strings)) +
+                ''.join([_varint(len(elt)) + elt for elt in strings]) +
+                _varint(len(refs)) + chr(refs.itemsize) + refs.tostring())
+
+
+def encode(msg, version=PROTOCOL_VERSION):
+    '''Return the frame of a Health_Message.
+
+Messages for peers of PICKLE_VERSION or older are pickled.
+'''
+    if version <= PICKLE_VERSION:
+        return zlib.compress(pickle.dumps(msg))
+    encoder = _Encoder()
+    encoder.out.append(_varint(msg.message) + _varint(msg.module) +
+                       _varint(msg.action) + chr(bool(msg.need_ack)))
+    # only the fields set on the message, not the class defaults
+    for name in FIELDS:
+        if name in msg.__dict__:
+            encoder.out.append(_varint(_FIELD_IDS[name]))
+            encoder.value(msg.__dict__[name])
+    body = encoder.header() + ''.join(encoder.out)
+    flags = 0
+    if len(body) > COMPRESS_THRESHOLD:
+        body = zlib.compress(body, 1)
+        flags |= COMPRESSED
+    return _HEADER.pack(MAGIC, PROTOCOL_VERSION, flags) + body
+
+
+class _Decoder(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        # the strings of the message in order
+        self.values = []
+        self.next_value = 0
+
+    def byte(self):
+        pos = self.pos
+        self.pos += 1
+        return self.data[pos]
+
+    def varint(self):
+        data = self.data
+        pos = self.pos
+        byte = ord(data[pos])
+        pos += 1
+        if byte < 0x80:
+            self.pos = pos
+            return byte
+        result = byte & 0x7f
+        shift = 7
+        while True:
+            byte = ord(data[pos])
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        self.pos = pos
+        return result
+
+    def count(self):
+        'Read a number of elements, each one needing at least a byte.'
+        count = self.varint()
+        if count > len(self.data) - self.pos:
+            raise CodecError('invalid count %d' % count)
+        return count
+
+    def header(self):
+        strings = []
+        for _ in xrange(self.count()):
+            length = self.count()
+            strings.append(self.data[self.pos:self.pos + length])
+            self.pos += length
+        count = self.count()
+        typecode = _REF_TYPES.get(ord(self.byte()))
+        if typecode is None:
+            raise CodecError('invalid reference size')
+        refs = array.array(typecode)
+        end = self.pos + count * refs.itemsize
+        refs.fromstring(self.data[self.pos:end])
+        if len(refs) != count:
+            raise CodecError('truncated references')
+        self.pos = end
+        if sys.byteorder == 'big':
+            refs.byteswap()
+        self.values = map(strings.__getitem__, refs)
+
+    def strings(self, count):
+        start = self.next_value
+        self.next_value += count
+        if self.next_value > len(self.values):
+            raise CodecError('missing references')
+        return self.values[start:self.next_value]
+
+    def value(self):
+        tag = self.byte()
+        if tag == _STR_TUPLE:
+            return tuple(self.strings(self.varint()))
+        elif tag == _STR:
+            return self.strings(1)[0]
+        elif tag == _STR_LIST:
+            return self.strings(self.varint())
+        elif tag == _TUPLE:
+            return tuple([self.value() for _ in xrange(self.count())])
+        elif tag == _INT:
+            return self.varint()
+        elif tag == _NEGINT:
+            return -self.varint()
+        elif tag == _LIST:
+            return [self.value() for _ in xrange(self.count())]
+        elif tag == _DICT:
+            keys = self.value()
+            values = self.value()
+            if (not isinstance(keys, list) or not isinstance(values, list) or
+                    len(keys) != len(values)):
+                raise CodecError('invalid dict')
+            return dict(zip(keys, values))
+        elif tag == _NONE:
+            return None
+        elif tag == _TRUE:
+            return True
+        elif tag == _FALSE:
+            return False
+        elif tag == _FLOAT:
+            self.pos += _DOUBLE.size
+            return _DOUBLE.unpack_from(self.data, self.pos - _DOUBLE.size)[0]
+        elif tag == _UNICODE:
+            return self.strings(1)[0].decode('utf-8')
+        raise CodecError('invalid tag %d' % ord(tag))
+
+
+def decode(payload):
+    '''Return the Health_Message of a frame and the protocol version of
+the peer.
+
+Raises CodecError if the frame is invalid.
+'''
+    if len(payload) < _HEADER.size or ord(payload[0]) != MAGIC:
+        if not ACCEPT_PICKLE:
+            raise CodecError('pickled messages are not accepted')
+        try:
+            return pickle.loads(zlib.decompress(payload)), PICKLE_VERSION
+        except Exception as excpt:
+            raise CodecError('invalid pickled message: %s' % str(excpt))
+    _, version, flags = _HEADER.unpack_from(payload)
+    if version <= PICKLE_VERSION:
+        raise CodecError('invalid protocol version %d' % version)
+    try:
+        if flags & COMPRESSED:
+            data = zlib.decompress(buffer(payload, _HEADER.size))
+        else:
+            data = str(buffer(payload, _HEADER.size))
+        decoder = _Decoder(data)
+        decoder.header()
+        msg = HM(decoder.varint(), decoder.varint(), decoder.varint())
+        msg.need_ack = decoder.byte() != '\0'
+        while decoder.pos < len(data):
+            field = decoder.varint()
+            value = decoder.value()
+            # fields added by newer versions are ignored
+            if field < len(FIELDS):
+                setattr(msg, FIELDS[field], value)
+        # a frame cut after a field still ends on a value
+        if decoder.next_value != len(decoder.values):
+            raise CodecError('unused references')
+    except (IndexError, TypeError, ValueError, zlib.error, struct.error,
+            RuntimeError) as excpt:
+        raise CodecError('invalid frame: %s' % str(excpt))
+    return msg, version
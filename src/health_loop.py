@@ -0,0 +1,182 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Event loop serving all the health clients from a single thread.
+
+Server replaces a ThreadingTCPServer: instead of a thread blocked in
+recv for each client, one thread waits with epoll (or poll) for the
+connections having data and decodes the messages they hold. The
+handler is notified of the connections and of their messages from this
+thread.
+
+The sockets stay in blocking mode so the other threads of the server
+can keep sending messages with health_protocol.send_hm_message; only
+one recv is done each time a connection is reported readable.
+'''
+
+import errno
+import select
+import socket
+import threading
+
+import health_protocol as HP
+
+_READ_EVENTS = select.POLLIN | select.POLLPRI
+_CLOSE_EVENTS = select.POLLHUP | select.POLLERR | select.POLLNVAL
+
+
+class _Poller(object):
+    'epoll if available else poll, with a timeout in seconds.'
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._scale = 1
+        else:
+            self._poller = select.poll()
+            self._scale = 1000
+
+    def register(self, fd):
+        self._poller.register(fd, _READ_EVENTS)
+
+    def unregister(self, fd):
+        self._poller.unregister(fd)
+
+    def poll(self, timeout):
+        try:
+            return self._poller.poll(timeout * self._scale)
+        except (IOError, OSError, select.error), excpt:
+            if excpt.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def close(self):
+        if hasattr(self._poller, 'close'):
+            self._poller.close()
+
+
+class Server(object):
+    '''TCP server handling all its connections from one thread.
+
+The handler methods are called from the thread running
+serve_forever():
+
+- connected(sock, address) for each accepted connection.
+- received(address, msg) for each message. If it returns False the
+  connection is closed.
+- closed(address) when a connection is closed, by the peer or after
+  received() returned False.
+
+The bind_and_activate, server_bind, server_activate, serve_forever,
+shutdown and socket members behave like the ones of SocketServer.
+'''
+
+    allow_reuse_address = True
+    # thousands of clients connect at the same time
+    request_queue_size = 1024
+
+    def __init__(self, server_address, handler, bind_and_activate=True):
+        self.server_address = server_address
+        self.handler = handler
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # the sockets of the connections and their address by fd
+        self.connections = {}
+        self._poller = _Poller()
+        self._shutdown_request = False
+        self._stopped = threading.Event()
+        if bind_and_activate:
+            self.server_bind()
+            self.server_activate()
+
+    def server_bind(self):
+        if self.allow_reuse_address:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.server_address)
+        self.server_address = self.socket.getsockname()
+
+    def server_activate(self):
+        self.socket.listen(self.request_queue_size)
+
+    def serve_forever(self, poll_interval=0.5):
+        '''Handle the connections until shutdown() is called.
+
+The shutdown request is checked every poll_interval seconds.
+'''
+        self._stopped.clear()
+        listen_fd = self.socket.fileno()
+        self._poller.register(listen_fd)
+        try:
+            while not self._shutdown_request:
+                for fd, events in self._poller.poll(poll_interval):
+                    if fd == listen_fd:
+                        self._accept()
+                    elif fd in self.connections:
+                        self._read(fd, events)
+        finally:
+            self._poller.unregister(listen_fd)
+            for fd in self.connections.keys():
+                self._close(fd)
+            self._shutdown_request = False
+            self._stopped.set()
+
+    def shutdown(self):
+        'Stop serve_forever() and wait for it. Call from another thread.'
+        self._shutdown_request = True
+        self._stopped.wait()
+
+    def server_close(self):
+        self.socket.close()
+        self._poller.close()
+
+    def _accept(self):
+        try:
+            sock, address = self.socket.accept()
+        except socket.error, excpt:
+            # the client may have given up in the meantime
+            HP.logger.error('accept: %s' % str(excpt))
+            return
+        self.connections[sock.fileno()] = (sock, address)
+        self._poller.register(sock.fileno())
+        self.handler.connected(sock, address)
+
+    def _read(self, fd, events):
+        sock, address = self.connections[fd]
+        try:
+            if events & _READ_EVENTS:
+                messages = HP.recv_hm_messages(sock)
+            elif events & _CLOSE_EVENTS:
+                messages = None
+            else:
+                return
+            if messages is None:
+                self._close(fd)
+                return
+            for msg in messages:
+                if self.handler.received(address, msg) is False:
+                    self._close(fd)
+                    return
+        except Exception:
+            # only this connection is lost, not the whole server
+            HP.logger.exception('closing %s' % str(address))
+            if fd in self.connections:
+                self._close(fd)
+
+    def _close(self, fd):
+        sock, address = self.connections.pop(fd)
+        self._poller.unregister(fd)
+        try:
+            sock.close()
+        finally:
+            self.handler.closed(address)
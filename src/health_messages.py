@@ -17,7 +17,11 @@
 
 
 class Health_Message():
-    protocol_version = 3
+    protocol_version = 6
+    # first version sending only the new hw items after CONNECT
+    hw_delta_version = 5
+    # first version answering SYNC and starting at start_at
+    sync_version = 6
 
     INVALID = 0
     NONE = 1 << 0
@@ -36,6 +40,7 @@ class Health_Message():
     ACK = 1 << 3
     NACK = 1 << 4
     MODULE = 1 << 5
+    SYNC = 1 << 6
 
     CPU = 1 << 1
     STORAGE = 1 << 2
@@ -62,7 +67,8 @@ class Health_Message():
                       DISCONNECT: 'DISCONNECT',
                       ACK: 'ACK',
                       NACK: 'NACK',
-                      MODULE: 'MODULE'}
+                      MODULE: 'MODULE',
+                      SYNC: 'SYNC'}
     module_string = {NONE: 'NONE',
                      CPU: 'CPU',
                      STORAGE: 'STORAGE',
@@ -82,6 +88,8 @@ class Health_Message():
 
     need_ack = False
     hw = []
+    # hw only holds the items added to the inventory sent at CONNECT
+    hw_delta = False
 
     running_time = 0
     cpu_instances = 0
@@ -99,9 +107,17 @@ class Health_Message():
     my_peer_name = ""
     port_base = 10000
 
+    # time at which to start a benchmark on the clock of the client, 0
+    # to start it at once
+    start_at = 0
+    # clock of the server when sending SYNC and of the client when
+    # answering it or starting a benchmark
+    sync_sent = 0
+    peer_clock = 0
+
     def get_message_list(self):
         return [self.NONE, self.CONNECT, self.DISCONNECT, self.ACK, self.NACK,
-                self.MODULE]
+                self.MODULE, self.SYNC]
 
     def get_action_list(self):
         return [self.NONE, self.STOP, self.START, self.COMPLETED,
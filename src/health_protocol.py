@@ -17,15 +17,33 @@
 
 import errno
 import logging
-import pickle
 import socket
 import struct
-import zlib
+import weakref
+import health_codec
 from health_messages import Health_Message as HM
 logger = 0
 hdlr = 0
 formatter = 0
 
+HEADER = struct.Struct('!I')
+# receive buffer of each connection, reused for all its frames
+_READERS = weakref.WeakKeyDictionary()
+# protocol version of the peer of each connection, from its last message
+_PEER_VERSIONS = weakref.WeakKeyDictionary()
+MIN_BUFFER_SIZE = 65536
+# largest frame accepted: the length of a frame comes from the peer
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+SEND_CHUNK = 65536
+# errors meaning the peer is gone
+DISCONNECT_ERRORS = (errno.ECONNRESET, errno.EBADF, errno.ESHUTDOWN,
+                     errno.ENOTCONN, errno.EHOSTUNREACH, errno.ECONNREFUSED)
+
+
+class FrameError(Exception):
+    'A frame header announcing more than MAX_FRAME_SIZE bytes.'
+    pass
+
 
 def start_log(filename, level=logging.INFO):
     global logger
@@ -44,13 +62,14 @@ def start_log(filename, level=logging.INFO):
 def send_hm_message(sock, data, need_ack=False):
     global logger
     data.need_ack = need_ack
-    logger.debug("Sent %s/%s/%s to %s (need_ack=%r)" %
-                 (data.get_message_type(), data.get_module_type(),
-                  data.get_action_type(), sock.getpeername(),
-                  data.need_ack))
-    to_be_sent = zlib.compress(pickle.dumps(data))
-    sock.sendall(struct.pack('!I', len(to_be_sent)))
-    sock.sendall(to_be_sent)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Sent %s/%s/%s to %s (need_ack=%r)" %
+                     (data.get_message_type(), data.get_module_type(),
+                      data.get_action_type(), sock.getpeername(),
+                      data.need_ack))
+    # answer older peers in the format they understand
+    send_frame(sock, health_codec.encode(
+        data, _PEER_VERSIONS.get(sock, health_codec.PROTOCOL_VERSION)))
     if data.need_ack is True:
         msg = HM()
         while True:
@@ -70,23 +89,79 @@ def send_hm_message(sock, data, need_ack=False):
                 break
 
 
+def peer_version(sock):
+    'Return the protocol version of the peer, the oldest one if unknown.'
+    return _PEER_VERSIONS.get(sock, health_codec.PICKLE_VERSION)
+
+
 def recv_hm_message(sock):
     global logger
     try:
-        lengthbuf = recvall(sock, 4)
+        payload = recv_frame(sock)
     except socket.error, e:
-        if e[0] in [errno.ECONNRESET, errno.EBADF, errno.ESHUTDOWN, errno.ENOTCONN, errno.EHOSTUNREACH, errno.ECONNREFUSED]:
+        if e[0] in DISCONNECT_ERRORS:
             return HM(HM.DISCONNECTED)
         logger.error("recv_hm_message :" + e[1])
         return HM(HM.INVALID)
+    except FrameError, e:
+        # the rest of the stream cannot be parsed
+        logger.error("recv_hm_message : %s, closing" % e)
+        _READERS.pop(sock, None)
+        return HM(HM.DISCONNECTED)
 
-    try:
-        length = struct.unpack('!I', lengthbuf)
-    except:
+    if payload is None:
         logger.error("Received incomplete message")
         return HM(HM.INVALID)
 
-    msg = pickle.loads(zlib.decompress(recvall(sock, int(length[0]))))
+    return _message(sock, payload)
+
+
+def recv_hm_messages(sock):
+    '''Receive the messages available on a readable socket.
+
+Reads only once from sock so it does not block when select or poll
+reported it readable. Returns the list of the complete messages
+received, possibly empty, or None if the connection was closed.
+'''
+    reader = _reader(sock)
+    try:
+        if not _recv_available(sock, reader):
+            return None
+    except socket.error, e:
+        if e[0] in (errno.EAGAIN, errno.EINTR):
+            return []
+        if e[0] not in DISCONNECT_ERRORS:
+            logger.error("recv_hm_messages :" + e[1])
+        return None
+    except FrameError, e:
+        logger.error("recv_hm_messages : %s, closing" % e)
+        return None
+    messages = []
+    try:
+        payload = _frame(reader)
+        while payload is not None:
+            # decoded before the next frame as they share the buffer
+            messages.append(_message(sock, payload))
+            payload = _frame(reader)
+    except FrameError, e:
+        logger.error("recv_hm_messages : %s, closing" % e)
+        return None
+    return messages
+
+
+def _message(sock, payload):
+    'Decode a received frame and acknowledge it if needed.'
+    try:
+        msg, version = health_codec.decode(payload)
+    except health_codec.CodecError, e:
+        logger.error("recv_hm_message : %s" % e)
+        return HM(HM.INVALID)
+    # a pickle can hold any object
+    if not isinstance(msg, HM):
+        logger.error("recv_hm_message : received a %s instead of a message" %
+                     type(msg).__name__)
+        return HM(HM.INVALID)
+    _PEER_VERSIONS[sock] = min(version, health_codec.PROTOCOL_VERSION)
     if msg.is_valid() is False:
         logger.error("Message %d is not part of the valid message_list" %
                      msg.message)
@@ -94,10 +169,11 @@ def recv_hm_message(sock):
             send_hm_message(sock, HM(HM.NACK), False)
         msg.message = HM.INVALID
     else:
-        logger.debug("Received %s/%s/%s from %s (need_ack=%r)" %
-                     (msg.get_message_type(), msg.get_module_type(),
-                      msg.get_action_type(), sock.getpeername(),
-                      msg.need_ack))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received %s/%s/%s from %s (need_ack=%r)" %
+                         (msg.get_message_type(), msg.get_module_type(),
+                          msg.get_action_type(), sock.getpeername(),
+                          msg.need_ack))
         if (msg.need_ack is True) and (msg.message != HM.DISCONNECT):
             message = HM(HM.ACK)
             message.module = msg.module
@@ -106,12 +182,138 @@ def recv_hm_message(sock):
     return msg
 
 
+def send_frame(sock, payload):
+    'Send payload prefixed by its length.'
+    # the header is sent with the start of the payload: sent alone, the
+    # payload would wait for its ACK because of Nagle's algorithm. The
+    # rest of a large payload is sent without copying it.
+    sock.sendall(HEADER.pack(len(payload)) + payload[:SEND_CHUNK])
+    if len(payload) > SEND_CHUNK:
+        sock.sendall(buffer(payload, SEND_CHUNK))
+
+
+class _Reader(object):
+    '''Receive buffer of a connection.
+
+The bytes received and not consumed yet are buf[start:end].
+'''
+
+    def __init__(self):
+        self.buf = bytearray(MIN_BUFFER_SIZE)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+
+def _reader(sock):
+    reader = _READERS.get(sock)
+    if reader is None:
+        reader = _READERS[sock] = _Reader()
+    return reader
+
+
+def _reserve(reader, count):
+    '''Make room for count bytes from the start of the pending ones.
+
+The pending bytes are moved to the start of the buffer, which is
+doubled until it is large enough.
+'''
+    if reader.start + count <= len(reader.buf):
+        return
+    pending = reader.end - reader.start
+    size = len(reader.buf)
+    while size < count:
+        size *= 2
+    buf = bytearray(size) if size != len(reader.buf) else reader.buf
+    buf[:pending] = reader.buf[reader.start:reader.end]
+    reader.buf = buf
+    reader.view = memoryview(buf)
+    reader.start = 0
+    reader.end = pending
+
+
+def _fill(sock, reader, count):
+    '''Receive until count bytes are available in the buffer.
+
+As much data as the buffer can hold is read at once so small frames
+need less than a recv call each. Returns False if the connection was
+closed before.
+'''
+    if reader.end - reader.start >= count:
+        return True
+    _reserve(reader, count)
+    while reader.end - reader.start < count:
+        nbytes = sock.recv_into(reader.view[reader.end:])
+        if nbytes == 0:
+            return False
+        reader.end += nbytes
+    return True
+
+
+def _recv_available(sock, reader):
+    '''Receive once in the buffer, making room for the next frame.
+
+Returns False if the connection was closed.
+'''
+    pending = reader.end - reader.start
+    if pending < HEADER.size:
+        _reserve(reader, HEADER.size)
+    else:
+        _reserve(reader, HEADER.size + _frame_length(reader))
+    nbytes = sock.recv_into(reader.view[reader.end:])
+    reader.end += nbytes
+    return nbytes != 0
+
+
+def _frame_length(reader):
+    'Return the length of the next frame, whose header is in the buffer.'
+    length = HEADER.unpack_from(reader.buf, reader.start)[0]
+    if length > MAX_FRAME_SIZE:
+        raise FrameError('frame of %d bytes, more than %d' %
+                         (length, MAX_FRAME_SIZE))
+    return length
+
+
+def _consume(reader, count):
+    'Return the offset of the next count bytes and skip them.'
+    start = reader.start
+    reader.start += count
+    if reader.start == reader.end:
+        reader.start = reader.end = 0
+    return start
+
+
+def _frame(reader):
+    'Return the next complete frame of the buffer or None.'
+    pending = reader.end - reader.start
+    if pending < HEADER.size:
+        return None
+    length = _frame_length(reader)
+    if pending < HEADER.size + length:
+        return None
+    start = _consume(reader, HEADER.size + length)
+    return buffer(reader.buf, start + HEADER.size, length)
+
+
+def recv_frame(sock):
+    '''Receive a frame in the receive buffer of the connection.
+
+Returns a read-only buffer on the payload, valid until the next frame
+is received on sock, or None if the connection was closed. Raises
+FrameError if the frame is larger than MAX_FRAME_SIZE.
+'''
+    reader = _reader(sock)
+    if not _fill(sock, reader, HEADER.size):
+        return None
+    length = _frame_length(reader)
+    if not _fill(sock, reader, HEADER.size + length):
+        return None
+    return _frame(reader)
+
+
 def recvall(sock, count):
-    buf = b''
-    while count:
-        newbuf = sock.recv(count)
-        if not newbuf:
-            return None
-        buf += newbuf
-        count -= len(newbuf)
-    return buf
+    reader = _reader(sock)
+    if not _fill(sock, reader, count):
+        return None
+    start = _consume(reader, count)
+    return bytes(reader.buf[start:start + count])
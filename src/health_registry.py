@@ -0,0 +1,99 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Indexes of the hosts connected to health-server.
+
+The registry is updated when a host connects, changes of state or
+disconnects so the scheduling of the benchmarks does not have to scan
+all the hosts or their hardware items:
+
+- the hosts by system serial. Virtual machines get the serial of their
+  hypervisor, so this is also the index of the hosts by hypervisor.
+- the hosts running each benchmark.
+
+It is not thread safe: health-server updates and reads it with the
+lock of its hosts held.
+'''
+
+
+class HostRegistry(object):
+    'Indexes of the connected hosts by serial and by running benchmark.'
+
+    def __init__(self, run_items):
+        # serial of each host
+        self.serials = {}
+        # set of the hosts of each serial
+        self.by_serial = {}
+        # state of each host, a mask of the run items
+        self.states = {}
+        # set of the hosts running each run item
+        self.running = dict([(item, set()) for item in run_items])
+
+    def __contains__(self, host):
+        return host in self.serials
+
+    def __len__(self):
+        return len(self.serials)
+
+    def add(self, host, serial):
+        'Index a new host. Nothing is done if it is already known.'
+        if host in self.serials:
+            return
+        self.serials[host] = serial
+        self.by_serial.setdefault(serial, set()).add(host)
+        self.states[host] = 0
+
+    def remove(self, host):
+        'Forget a host if it is known.'
+        if host not in self.serials:
+            return
+        self.set_state(host, 0)
+        del self.states[host]
+        serial = self.serials.pop(host)
+        self.by_serial[serial].discard(host)
+        if not self.by_serial[serial]:
+            del self.by_serial[serial]
+
+    def state(self, host):
+        return self.states[host]
+
+    def set_state(self, host, state):
+        'Set the state of a host, moving it between the running sets.'
+        previous = self.states[host]
+        for item, hosts in self.running.items():
+            if (previous ^ state) & item:
+                if state & item:
+                    hosts.add(host)
+                else:
+                    hosts.discard(host)
+        self.states[host] = state
+
+    def is_running(self, host, item):
+        return self.states[host] & item == item
+
+    def running_hosts(self, item):
+        'Return the set of the hosts running item.'
+        return self.running[item]
+
+    def affinity(self, serials=None):
+        '''Return the lists of the hosts indexed by serial.
+
+Only the given serials are returned if serials is not empty. The lists
+are new ones the caller can modify.
+'''
+        if not serials:
+            serials = self.by_serial.keys()
+        return dict([(serial, list(self.by_serial[serial]))
+                     for serial in serials if serial in self.by_serial])
@@ -0,0 +1,183 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Concurrent execution of the jobs of a health-server benchmark.
+
+Each job gets a pool of hosts, disjoint from the pools of the jobs
+running at the same time, and runs in its own thread. The jobs are
+started in the order of the plan as soon as enough hosts are free; a
+job not fitting yet lets the next ones start if they fit. A job with
+exclusive set runs alone on all the hosts, once the jobs before it are
+finished, and the jobs after it wait for its end.
+
+The hosts of a pool are taken in turn from each hypervisor so the fair
+affinity of the jobs keeps spreading their load. The jobs running at
+the same time use different hypervisors, so they do not disturb each
+other, unless they all set share-hypervisors: the jobs they shared
+their hypervisors with are then recorded in their history.
+'''
+
+import threading
+import time
+
+
+def job_size(job, required_hosts):
+    'Return the maximum number of hosts used by a job.'
+    size = str(job.get('required-hosts', required_hosts))
+    if '-' in size:
+        size = size.split('-')[1]
+    return int(size)
+
+
+def affinity_hosts(job):
+    'Return the serials of the affinity-hosts of a job.'
+    return [serial.strip()
+            for serial in job.get('affinity-hosts', '').split(',')
+            if serial.strip()]
+
+
+def allocate(affinity, free, count, serials=None, busy=()):
+    '''Select count hosts among the free ones.
+
+affinity maps the serials of the hypervisors to their hosts. Only the
+hypervisors in serials are used if it is not empty, and never the ones
+in busy. The hosts are taken in turn from each hypervisor. Returns the
+set of the selected hosts or None if there are not enough free hosts.
+'''
+    candidates = [[host for host in affinity[serial] if host in free]
+                  for serial in sorted(affinity)
+                  if (not serials or serial in serials) and
+                  serial not in busy]
+    selected = set()
+    while len(selected) < count:
+        candidates = [hosts for hosts in candidates if hosts]
+        if not candidates:
+            return None
+        for hosts in candidates:
+            selected.add(hosts.pop())
+            if len(selected) == count:
+                break
+    return selected
+
+
+class Scheduler(object):
+    '''Run the jobs of a plan on disjoint pools of hosts.
+
+plan is the list of the (name, job) in the order they have to be
+started, affinity the hosts of each hypervisor and run_job(name, job,
+pool) the function running a job on the set of hosts pool.
+'''
+
+    def __init__(self, plan, affinity, run_job, required_hosts, logger):
+        self.plan = plan
+        self.affinity = affinity
+        self.run_job = run_job
+        self.required_hosts = required_hosts
+        self.logger = logger
+        self.hosts = set()
+        # hypervisor of each host
+        self.serials = {}
+        for serial, hosts in affinity.items():
+            self.hosts.update(hosts)
+            for host in hosts:
+                self.serials[host] = serial
+        self.free = set(self.hosts)
+        self.running = {}
+        # running jobs on each hypervisor
+        self.jobs_on = {}
+        # jobs accepting to share their hypervisors
+        self.sharing = set()
+        # start and end time, pool, hypervisors and the jobs having
+        # shared them of each job
+        self.history = {}
+        self.done = threading.Condition()
+
+    def _busy(self, job):
+        'Return the hypervisors job cannot use because of the running jobs.'
+        share = job.get('share-hypervisors', False)
+        return set([serial for serial, names in self.jobs_on.items()
+                    if names and not (share and names <= self.sharing)])
+
+    def _start(self, name, job, pool):
+        self.logger.info("Starting job %s on %d hosts" % (name, len(pool)))
+        self.free -= pool
+        self.running[name] = pool
+        serials = set([self.serials[host] for host in pool])
+        self.history[name] = {'start': time.time(), 'hosts': sorted(pool),
+                              'hypervisors': sorted(serials),
+                              'shared-with': []}
+        if job.get('share-hypervisors', False):
+            self.sharing.add(name)
+        for serial in serials:
+            names = self.jobs_on.setdefault(serial, set())
+            for other in names:
+                if other not in self.history[name]['shared-with']:
+                    self.logger.info("Job %s shares hypervisor %s with %s" %
+                                     (name, serial, other))
+                    self.history[name]['shared-with'].append(other)
+                    self.history[other]['shared-with'].append(name)
+            names.add(name)
+        thread = threading.Thread(target=self._run, args=(name, job, pool))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, name, job, pool):
+        try:
+            self.run_job(name, job, pool)
+        except Exception, xcpt:
+            self.logger.error("Job %s failed: %s" % (name, str(xcpt)))
+        finally:
+            with self.done:
+                pool = self.running.pop(name)
+                self.free |= pool
+                for host in pool:
+                    self.jobs_on[self.serials[host]].discard(name)
+                self.sharing.discard(name)
+                self.history[name]['end'] = time.time()
+                self.done.notify()
+
+    def _start_jobs(self, pending):
+        'Start the pending jobs that can run now.'
+        for idx, (name, job) in enumerate(list(pending)):
+            if job.get('exclusive', False):
+                if not self.running:
+                    pending.remove((name, job))
+                    self._start(name, job, set(self.hosts))
+                # the next jobs wait for the end of the exclusive one
+                return
+            pool = allocate(self.affinity, self.free,
+                            job_size(job, self.required_hosts),
+                            affinity_hosts(job), self._busy(job))
+            if pool is None and not self.running and idx == 0:
+                # it will never fit: let it report the missing hosts
+                pool = set(self.free)
+            if pool is not None:
+                pending.remove((name, job))
+                self._start(name, job, pool)
+
+    def shared_with(self, name):
+        'Return the jobs having shared the hypervisors of a job so far.'
+        with self.done:
+            return sorted(self.history[name]['shared-with'])
+
+    def run(self):
+        'Run all the jobs of the plan and wait for their end.'
+        pending = list(self.plan)
+        with self.done:
+            while pending or self.running:
+                self._start_jobs(pending)
+                if self.running:
+                    self.done.wait()
+        return self.history
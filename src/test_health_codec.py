@@ -0,0 +1,130 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import random
+import unittest
+
+import health_codec
+from health_messages import Health_Message as HM
+
+# a value of each field like the ones sent by health-server and
+# health-client
+FIELDS = {
+    'hw': [('cpu', 'logical', 'number', '8'),
+           ('disk', 'sda', 'size', '100'),
+           ('cpu', 'logical', 'loops_per_sec', '1234')],
+    'running_time': 10,
+    'cpu_instances': 2,
+    'block_size': '4k',
+    'mode': 'randread',
+    'access': 'rand',
+    'device': 'sda',
+    'rampup_time': 5,
+    'network_test': 'bandwidth',
+    'network_connection': 'tcp',
+    'ports_list': {'10.0.0.1': [20000, 20001], '10.0.0.2': [20002]},
+    'peer_servers': [('10.0.0.1', 20000), ('10.0.0.2', 20002)],
+    'my_peer_name': u'h\xf4te',
+    'port_base': -1,
+    'hw_delta': True,
+    'start_at': 1431953021.125,
+    'sync_sent': 1431953020.5,
+    'peer_clock': None,
+}
+
+
+def message(**fields):
+    msg = HM(HM.MODULE, HM.CPU, HM.COMPLETED)
+    msg.need_ack = True
+    for name, value in fields.items():
+        setattr(msg, name, value)
+    return msg
+
+
+class TestHealthCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.accept_pickle = health_codec.ACCEPT_PICKLE
+
+    def tearDown(self):
+        health_codec.ACCEPT_PICKLE = self.accept_pickle
+
+    def roundtrip(self, msg):
+        decoded, version = health_codec.decode(health_codec.encode(msg))
+        self.assertEqual(version, health_codec.PROTOCOL_VERSION)
+        self.assertEqual(decoded.__dict__, msg.__dict__)
+        return decoded
+
+    def test_fields(self):
+        self.assertEqual(sorted(FIELDS), sorted(health_codec.FIELDS))
+        for name, value in FIELDS.items():
+            decoded = self.roundtrip(message(**{name: value}))
+            self.assertEqual(type(getattr(decoded, name)), type(value))
+        self.roundtrip(message(**FIELDS))
+
+    def test_values(self):
+        self.roundtrip(message(hw=[('a', 'b', 1, -2**40), ('c', ('d',)),
+                                   [], {}, (), 0.5, False, u'\u20ac']))
+
+    def test_compressed(self):
+        msg = message(hw=[('disk', 'sd%d' % idx, 'size', str(idx))
+                          for idx in range(200)])
+        frame = health_codec.encode(msg)
+        self.assertTrue(ord(frame[2]) & health_codec.COMPRESSED)
+        self.roundtrip(msg)
+        self.assertFalse(ord(health_codec.encode(message())[2]) &
+                         health_codec.COMPRESSED)
+
+    def test_truncated(self):
+        frame = health_codec.encode(message(hw=FIELDS['hw']))
+        for size in range(len(frame)):
+            self.assertRaises(health_codec.CodecError, health_codec.decode,
+                              frame[:size])
+
+    def test_garbage(self):
+        rand = random.Random(0)
+        frame = health_codec.encode(message(**FIELDS))
+        for _ in range(2000):
+            data = bytearray(frame)
+            for _ in range(rand.randint(1, 4)):
+                data[rand.randrange(3, len(data))] = rand.randrange(256)
+            try:
+                health_codec.decode(str(data))
+            except health_codec.CodecError:
+                pass
+        for size in range(64):
+            garbage = chr(health_codec.MAGIC) + ''.join(
+                [chr(rand.randrange(256)) for _ in range(size)])
+            try:
+                health_codec.decode(garbage)
+            except health_codec.CodecError:
+                pass
+
+    def test_pickle_refused(self):
+        msg = message(hw=FIELDS['hw'])
+        frame = health_codec.encode(msg, health_codec.PICKLE_VERSION)
+        health_codec.ACCEPT_PICKLE = False
+        self.assertRaises(health_codec.CodecError, health_codec.decode,
+                          frame)
+        self.assertRaises(health_codec.CodecError, health_codec.decode,
+                          'garbage')
+        health_codec.ACCEPT_PICKLE = True
+        decoded, version = health_codec.decode(frame)
+        self.assertEqual(version, health_codec.PICKLE_VERSION)
+        self.assertEqual(decoded.hw, msg.hw)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import pickle
+import Queue
+import socket
+import struct
+import threading
+import unittest
+import zlib
+
+import health_codec
+import health_loop
+from health_messages import Health_Message as HM
+import health_protocol as HP
+
+
+class Handler(object):
+    'Record the events of the server, failing on the STORAGE messages.'
+
+    def __init__(self):
+        self.events = Queue.Queue()
+
+    def connected(self, sock, address):
+        self.events.put(('connected', address))
+
+    def received(self, address, msg):
+        if msg.module == HM.STORAGE:
+            raise ValueError('handler failure')
+        self.events.put(('received', address, msg.message))
+
+    def closed(self, address):
+        self.events.put(('closed', address))
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        HP.logger = logging.getLogger('test_health_loop')
+        HP.logger.addHandler(logging.NullHandler())
+        HP.logger.propagate = False
+        self.accept_pickle = health_codec.ACCEPT_PICKLE
+        self.handler = Handler()
+        self.server = health_loop.Server(('127.0.0.1', 0), self.handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.05,))
+        self.thread.start()
+        self.clients = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        for client in self.clients:
+            client.close()
+        health_codec.ACCEPT_PICKLE = self.accept_pickle
+
+    def event(self):
+        return self.handler.events.get(timeout=5)
+
+    def connect(self):
+        client = socket.create_connection(self.server.server_address)
+        self.clients.append(client)
+        event = self.event()
+        self.assertEqual(event[0], 'connected')
+        return client, event[1]
+
+    def test_received(self):
+        client, address = self.connect()
+        HP.send_hm_message(client, HM(HM.MODULE, HM.CPU, HM.COMPLETED))
+        self.assertEqual(self.event(), ('received', address, HM.MODULE))
+        client.close()
+        self.assertEqual(self.event(), ('closed', address))
+
+    def test_handler_failure(self):
+        client, address = self.connect()
+        other, other_address = self.connect()
+        HP.send_hm_message(client, HM(HM.MODULE, HM.STORAGE, HM.COMPLETED))
+        self.assertEqual(self.event(), ('closed', address))
+        # the other connections are still served
+        HP.send_hm_message(other, HM(HM.MODULE, HM.CPU, HM.COMPLETED))
+        self.assertEqual(self.event(), ('received', other_address,
+                                        HM.MODULE))
+
+    def test_oversized_header(self):
+        client, address = self.connect()
+        other, other_address = self.connect()
+        client.sendall(struct.pack('!I', HP.MAX_FRAME_SIZE + 1))
+        self.assertEqual(self.event(), ('closed', address))
+        HP.send_hm_message(other, HM(HM.MODULE, HM.CPU, HM.COMPLETED))
+        self.assertEqual(self.event(), ('received', other_address,
+                                        HM.MODULE))
+
+    def test_pickled_object(self):
+        health_codec.ACCEPT_PICKLE = True
+        client, address = self.connect()
+        HP.send_frame(client, zlib.compress(pickle.dumps(42)))
+        self.assertEqual(self.event(), ('received', address, HM.INVALID))
+        HP.send_hm_message(client, HM(HM.MODULE, HM.CPU, HM.COMPLETED))
+        self.assertEqual(self.event(), ('received', address, HM.MODULE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import socket
+import struct
+import threading
+import unittest
+
+import health_codec
+from health_messages import Health_Message as HM
+import health_protocol as HP
+
+
+def message(hw):
+    msg = HM(HM.MODULE, HM.CPU, HM.COMPLETED)
+    msg.hw = hw
+    return msg
+
+
+class TestHealthProtocol(unittest.TestCase):
+
+    def setUp(self):
+        HP.logger = logging.getLogger('test_health_protocol')
+        self.sock, self.peer = socket.socketpair()
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer.close()
+
+    def assertMessage(self, msg, hw):
+        self.assertEqual((msg.message, msg.module, msg.action),
+                         (HM.MODULE, HM.CPU, HM.COMPLETED))
+        self.assertEqual(msg.hw, hw)
+
+    def test_partial_frame(self):
+        hw = [('cpu', 'logical', 'loops_per_sec', '1234')]
+        frame = health_codec.encode(message(hw))
+        data = struct.pack('!I', len(frame)) + frame
+        for idx in range(len(data) - 1):
+            self.peer.sendall(data[idx])
+            self.assertEqual(HP.recv_hm_messages(self.sock), [])
+        self.peer.sendall(data[-1])
+        messages = HP.recv_hm_messages(self.sock)
+        self.assertEqual(len(messages), 1)
+        self.assertMessage(messages[0], hw)
+
+    def test_several_frames(self):
+        hws = [[('cpu', 'logical', 'loops_per_sec', str(idx))]
+               for idx in range(3)]
+        data = ''.join([struct.pack('!I', len(frame)) + frame
+                        for frame in [health_codec.encode(message(hw))
+                                      for hw in hws]])
+        self.peer.sendall(data)
+        messages = HP.recv_hm_messages(self.sock)
+        self.assertEqual(len(messages), 3)
+        for msg, hw in zip(messages, hws):
+            self.assertMessage(msg, hw)
+
+    def test_large_frame(self):
+        hw = [('disk', 'sd%d' % idx, 'serial', 'S%08d' % idx)
+              for idx in range(10000)]
+        frame = health_codec.encode(message(hw))
+        self.assertTrue(len(frame) > HP.MIN_BUFFER_SIZE)
+        sender = threading.Thread(target=HP.send_frame,
+                                  args=(self.peer, frame))
+        sender.start()
+        messages = []
+        while not messages:
+            messages = HP.recv_hm_messages(self.sock)
+        sender.join()
+        self.assertEqual(len(messages), 1)
+        self.assertMessage(messages[0], hw)
+        # the buffer grown for the large frame keeps working
+        HP.send_hm_message(self.peer, message(hw[:1]))
+        self.assertMessage(HP.recv_hm_message(self.sock), hw[:1])
+
+    def test_eof(self):
+        self.peer.close()
+        self.assertEqual(HP.recv_hm_messages(self.sock), None)
+
+    def test_eof_in_frame(self):
+        frame = health_codec.encode(message([]))
+        self.peer.sendall(struct.pack('!I', len(frame)) + frame[:-1])
+        self.assertEqual(HP.recv_hm_messages(self.sock), [])
+        self.peer.close()
+        self.assertEqual(HP.recv_hm_messages(self.sock), None)
+
+    def test_oversized_header(self):
+        self.peer.sendall(struct.pack('!I', HP.MAX_FRAME_SIZE + 1) + 'x')
+        self.assertEqual(HP.recv_hm_messages(self.sock), None)
+        reader = HP._reader(self.sock)
+        self.assertEqual(len(reader.buf), HP.MIN_BUFFER_SIZE)
+
+    def test_oversized_header_blocking(self):
+        self.peer.sendall(struct.pack('!I', 0xffffffff))
+        self.assertEqual(HP.recv_hm_message(self.sock).message,
+                         HM.DISCONNECTED)
+
+    def test_reset(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        client = socket.create_connection(server.getsockname())
+        conn = server.accept()[0]
+        server.close()
+        # closing with a zero linger time sends a RST
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                          struct.pack('ii', 1, 0))
+        client.close()
+        try:
+            self.assertEqual(HP.recv_hm_messages(conn), None)
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
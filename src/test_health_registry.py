@@ -0,0 +1,104 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+import health_registry
+
+CPU = 1
+MEMORY = 2
+STORAGE = 4
+
+
+class TestHostRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = health_registry.HostRegistry((CPU, MEMORY, STORAGE))
+        self.registry.add('vm1', 'hv1')
+        self.registry.add('vm2', 'hv1')
+        self.registry.add('vm3', 'hv2')
+
+    def assertConsistent(self):
+        'Check the indexes against the serials and states of the hosts.'
+        registry = self.registry
+        by_serial = {}
+        for host, serial in registry.serials.items():
+            by_serial.setdefault(serial, set()).add(host)
+        self.assertEqual(registry.by_serial, by_serial)
+        self.assertEqual(sorted(registry.states), sorted(registry.serials))
+        for item, hosts in registry.running.items():
+            self.assertEqual(hosts, set([host for host, state
+                                         in registry.states.items()
+                                         if state & item]))
+
+    def test_add(self):
+        self.assertEqual(len(self.registry), 3)
+        self.assertTrue('vm1' in self.registry)
+        self.assertEqual(self.registry.by_serial,
+                         {'hv1': set(['vm1', 'vm2']), 'hv2': set(['vm3'])})
+        # a known host keeps its serial and its state
+        self.registry.set_state('vm1', CPU)
+        self.registry.add('vm1', 'hv2')
+        self.assertEqual(self.registry.serials['vm1'], 'hv1')
+        self.assertEqual(self.registry.state('vm1'), CPU)
+        self.assertConsistent()
+
+    def test_set_state(self):
+        self.registry.set_state('vm1', CPU | MEMORY)
+        self.registry.set_state('vm2', CPU)
+        self.assertEqual(self.registry.running_hosts(CPU),
+                         set(['vm1', 'vm2']))
+        self.assertEqual(self.registry.running_hosts(MEMORY), set(['vm1']))
+        self.assertTrue(self.registry.is_running('vm1', MEMORY))
+        self.assertConsistent()
+        self.registry.set_state('vm1', MEMORY | STORAGE)
+        self.assertEqual(self.registry.running_hosts(CPU), set(['vm2']))
+        self.assertFalse(self.registry.is_running('vm1', CPU))
+        self.assertConsistent()
+        self.registry.set_state('vm1', 0)
+        self.registry.set_state('vm2', 0)
+        for item in (CPU, MEMORY, STORAGE):
+            self.assertEqual(self.registry.running_hosts(item), set())
+        self.assertConsistent()
+
+    def test_remove(self):
+        self.registry.set_state('vm3', CPU | STORAGE)
+        self.registry.remove('vm3')
+        self.assertFalse('vm3' in self.registry)
+        self.assertEqual(len(self.registry), 2)
+        # the serial without hosts is gone
+        self.assertEqual(self.registry.by_serial, {'hv1': set(['vm1',
+                                                               'vm2'])})
+        self.assertEqual(self.registry.running_hosts(CPU), set())
+        self.assertEqual(self.registry.running_hosts(STORAGE), set())
+        self.assertConsistent()
+        # unknown hosts are ignored
+        self.registry.remove('vm3')
+        self.assertConsistent()
+
+    def test_affinity(self):
+        affinity = self.registry.affinity()
+        self.assertEqual(dict([(serial, sorted(hosts))
+                               for serial, hosts in affinity.items()]),
+                         {'hv1': ['vm1', 'vm2'], 'hv2': ['vm3']})
+        # the lists belong to the caller
+        affinity['hv1'].pop()
+        self.assertEqual(len(self.registry.by_serial['hv1']), 2)
+        self.assertEqual(self.registry.affinity(['hv2', 'hv3']),
+                         {'hv2': ['vm3']})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import Queue
+import threading
+import unittest
+
+import health_scheduler
+
+AFFINITY = {'hv1': ['a1', 'a2', 'a3'], 'hv2': ['b1', 'b2']}
+
+
+class TestAllocate(unittest.TestCase):
+
+    def setUp(self):
+        self.affinity = dict([(serial, list(hosts))
+                              for serial, hosts in AFFINITY.items()])
+        self.free = set(['a1', 'a2', 'a3', 'b1', 'b2'])
+
+    def test_round_robin(self):
+        self.assertEqual(health_scheduler.allocate(self.affinity, self.free,
+                                                   3),
+                         set(['a3', 'b2', 'a2']))
+        # the lists of the hypervisors are left untouched
+        self.assertEqual(self.affinity, AFFINITY)
+        self.assertEqual(health_scheduler.allocate(self.affinity,
+                                                   set(['a1', 'b1']), 2),
+                         set(['a1', 'b1']))
+
+    def test_serials(self):
+        self.assertEqual(health_scheduler.allocate(self.affinity, self.free,
+                                                   2, ['hv2']),
+                         set(['b1', 'b2']))
+        self.assertEqual(health_scheduler.allocate(self.affinity, self.free,
+                                                   3, ['hv2']), None)
+
+    def test_busy(self):
+        self.assertEqual(health_scheduler.allocate(self.affinity, self.free,
+                                                   2, None, ['hv1']),
+                         set(['b1', 'b2']))
+        self.assertEqual(health_scheduler.allocate(self.affinity, self.free,
+                                                   3, None, ['hv1']), None)
+
+    def test_not_enough(self):
+        self.assertEqual(health_scheduler.allocate(self.affinity, self.free,
+                                                   6), None)
+        self.assertEqual(health_scheduler.allocate(self.affinity, set(), 1),
+                         None)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test_health_scheduler')
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+        self.started = Queue.Queue()
+        self.pools = {}
+        self.finish = {}
+        self.thread = None
+
+    def tearDown(self):
+        for event in self.finish.values():
+            event.set()
+        if self.thread:
+            self.thread.join()
+
+    def run_job(self, name, job, pool):
+        self.pools[name] = pool
+        self.started.put(name)
+        self.finish[name].wait()
+
+    def start(self, plan, affinity=AFFINITY):
+        'Run the jobs of plan in a thread, each until it is finished.'
+        for name, _ in plan:
+            self.finish[name] = threading.Event()
+        self.scheduler = health_scheduler.Scheduler(plan, affinity,
+                                                    self.run_job, 1,
+                                                    self.logger)
+        self.thread = threading.Thread(target=self.scheduler.run)
+        self.thread.start()
+
+    def assertStarted(self, *names):
+        started = [self.started.get(timeout=5) for _ in names]
+        self.assertEqual(sorted(started), sorted(names))
+        self.assertRaises(Queue.Empty, self.started.get, timeout=0.2)
+
+    def end(self, name):
+        self.finish[name].set()
+
+    def hypervisors(self, name):
+        return set([serial for serial, hosts in AFFINITY.items()
+                    if set(hosts) & self.pools[name]])
+
+    def test_disjoint_hypervisors(self):
+        self.start([('job1', {}), ('job2', {}), ('job3', {})])
+        self.assertStarted('job1', 'job2')
+        self.assertFalse(self.hypervisors('job1') & self.hypervisors('job2'))
+        self.end('job1')
+        self.assertStarted('job3')
+        self.assertEqual(self.hypervisors('job3'), self.hypervisors('job1'))
+        self.end('job2')
+        self.end('job3')
+        self.thread.join()
+        self.assertEqual(self.scheduler.history['job1']['shared-with'], [])
+
+    def test_shared_hypervisors(self):
+        share = {'share-hypervisors': True}
+        self.start([('job1', share), ('job2', {}), ('job3', share)],
+                   {'hv1': ['a1', 'a2', 'a3']})
+        self.assertStarted('job1', 'job3')
+        self.assertEqual(self.scheduler.shared_with('job1'), ['job3'])
+        self.assertEqual(self.scheduler.shared_with('job3'), ['job1'])
+        # job2 does not share its hypervisor
+        self.end('job1')
+        self.assertStarted()
+        self.end('job3')
+        self.assertStarted('job2')
+        self.end('job2')
+        self.thread.join()
+        self.assertEqual(self.scheduler.shared_with('job2'), [])
+
+    def test_exclusive(self):
+        self.start([('job1', {'required-hosts': 2}),
+                    ('exclusive', {'exclusive': True}), ('job2', {})])
+        # the exclusive job waits for job1 and job2 for it
+        self.assertStarted('job1')
+        self.end('job1')
+        self.assertStarted('exclusive')
+        self.assertEqual(self.pools['exclusive'],
+                         set(['a1', 'a2', 'a3', 'b1', 'b2']))
+        self.end('exclusive')
+        self.assertStarted('job2')
+        self.end('job2')
+        self.thread.join()
+        history = self.scheduler.history
+        self.assertTrue(history['job1']['end'] <=
+                        history['exclusive']['start'])
+        self.assertTrue(history['exclusive']['end'] <=
+                        history['job2']['start'])
+
+    def test_never_fits(self):
+        self.start([('job1', {'required-hosts': '1-10'}),
+                    ('job2', {'required-hosts': 10})])
+        # the jobs get all the hosts to report the missing ones
+        self.assertStarted('job1')
+        self.assertEqual(self.pools['job1'],
+                         set(['a1', 'a2', 'a3', 'b1', 'b2']))
+        self.end('job1')
+        self.assertStarted('job2')
+        self.end('job2')
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
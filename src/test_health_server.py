@@ -0,0 +1,100 @@
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import imp
+import logging
+import os
+import unittest
+
+from health_messages import Health_Message as HM
+import health_protocol as HP
+import health_registry
+
+health_server = imp.load_source(
+    'health_server', os.path.join(os.path.dirname(__file__),
+                                  'health-server.py'))
+
+
+class Socket(object):
+    'Record the frames sent to a host.'
+
+    def __init__(self):
+        self.frames = []
+
+    def sendall(self, data):
+        self.frames.append(data)
+
+
+def result(value):
+    msg = HM(HM.MODULE, HM.CPU, HM.COMPLETED)
+    msg.hw = [('cpu', 'logical', 'loops_per_sec', value)]
+    return msg
+
+
+class TestStragglers(unittest.TestCase):
+
+    def setUp(self):
+        HP.logger = logging.getLogger('test_health_server')
+        HP.logger.addHandler(logging.NullHandler())
+        HP.logger.propagate = False
+        HP.logger.setLevel(logging.INFO)
+        health_server.registry = health_registry.HostRegistry(
+            health_server.RUN_ITEMS)
+        health_server.expected_results = dict(
+            [(item, set()) for item in health_server.RUN_ITEMS])
+        health_server.abandoned_results = dict(
+            [(item, {}) for item in health_server.RUN_ITEMS])
+        health_server.results_cpu.clear()
+        health_server.socket_list = {}
+        for host in ('vm1', 'vm2'):
+            health_server.registry.add(host, 'hv1')
+            health_server.socket_list[host] = Socket()
+        self.bench = {'pool': set(['vm1', 'vm2']), 'nb-hosts': 2,
+                      'hosts-list': ['vm1', 'vm2'], 'cores': 1,
+                      'runtime': 0, 'start-delay': 0,
+                      'straggler-timeout': 0.1}
+
+    def test_next_iteration(self):
+        health_server.start_cpu_bench(self.bench)
+        health_server.cpu_completed('vm1', result('1'))
+        self.assertFalse(health_server.wait_completion(self.bench,
+                                                       health_server.CPU_RUN))
+        self.assertFalse(health_server.is_running('vm2',
+                                                  health_server.CPU_RUN))
+        # the straggler is started again by the next iteration
+        health_server.start_cpu_bench(self.bench)
+        self.assertEqual(len(health_server.socket_list['vm2'].frames), 2)
+        # its late result is not taken for the one of this iteration
+        health_server.cpu_completed('vm2', result('late'))
+        self.assertTrue(health_server.is_running('vm2',
+                                                 health_server.CPU_RUN))
+        health_server.cpu_completed('vm1', result('2'))
+        health_server.cpu_completed('vm2', result('3'))
+        self.assertTrue(health_server.wait_completion(self.bench,
+                                                      health_server.CPU_RUN))
+        self.assertEqual(sorted(health_server.results_cpu.items()),
+                         [('vm1', result('2').hw), ('vm2', result('3').hw)])
+
+    def test_disconnected_straggler(self):
+        health_server.start_cpu_bench(self.bench)
+        health_server.cpu_completed('vm1', result('1'))
+        health_server.wait_completion(self.bench, health_server.CPU_RUN)
+        health_server.HealthHandler().closed('vm2')
+        self.assertEqual(health_server.abandoned_results[
+            health_server.CPU_RUN], {})
+
+
+if __name__ == "__main__":
+    unittest.main()
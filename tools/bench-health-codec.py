@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Compare the health message encoding with pickle and zlib.
+
+Encodes and decodes typical messages of a run of <hosts> VMs, first as
+zlib compressed pickles like protocol version 3, then with
+health_codec:
+
+$ bench-health-codec.py [-n <iterations>] [-H <hosts>] [<hw file>]
+
+The hw file, health/*.hw by default, gives the results sent back by
+each VM. The size of the frames and the encoding and decoding times
+are printed.
+'''
+
+import getopt
+import glob
+import os
+import sys
+import time
+
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOPDIR, 'src'))
+
+import health_codec  # noqa
+from health_messages import Health_Message as HM  # noqa
+
+
+def messages(hw_items, hosts):
+    'Return the list of (name, message) to benchmark.'
+    ack = HM(HM.ACK, HM.CPU, HM.START)
+    start = HM(HM.MODULE, HM.CPU, HM.START)
+    start.cpu_instances = 8
+    start.running_time = 10
+    names = ['vm%04d' % idx for idx in range(hosts)]
+    network = HM(HM.MODULE, HM.NETWORK, HM.START)
+    network.block_size = '128k'
+    network.running_time = 10
+    network.peer_servers = [(name, '10.0.%d.%d' % (idx // 250, idx % 250))
+                            for idx, name in enumerate(names)]
+    network.ports_list = dict([(name, HM.port_base + idx)
+                               for idx, name in enumerate(names)])
+    network.my_peer_name = '10.0.0.1'
+    completed = HM(HM.MODULE, HM.STORAGE, HM.COMPLETED)
+    completed.hw = hw_items
+    return [('ack', ack), ('cpu start', start),
+            ('network start', network), ('completed', completed)]
+
+
+def measure(func, arg, iterations):
+    'Return the result of func(arg) and its duration in microseconds.'
+    start = time.time()
+    for _ in xrange(iterations):
+        result = func(arg)
+    return result, (time.time() - start) * 1e6 / iterations
+
+
+def main():
+    'Command line entry point.'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hn:H:')
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    iterations = 200
+    hosts = 1000
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print __doc__
+            sys.exit(0)
+        elif opt == '-n':
+            iterations = int(arg)
+        elif opt == '-H':
+            hosts = int(arg)
+
+    hw_file = (args[0] if args else
+               sorted(glob.glob(os.path.join(TOPDIR, 'health', '*.hw')))[0])
+    hw_items = eval(open(hw_file).read(-1))
+
+    # to measure the decoding of the pickles of the old clients
+    health_codec.ACCEPT_PICKLE = True
+    print '%-14s %-7s %8s %12s %12s' % ('message', 'format', 'bytes',
+                                        'encode us', 'decode us')
+    for name, msg in messages(hw_items, hosts):
+        for fmt, version in (('pickle', health_codec.PICKLE_VERSION),
+                             ('codec', health_codec.PROTOCOL_VERSION)):
+            frame, encode_time = measure(
+                lambda msg: health_codec.encode(msg, version), msg,
+                iterations)
+            _, decode_time = measure(health_codec.decode, frame, iterations)
+            print '%-14s %-7s %8d %12.1f %12.1f' % (
+                name, fmt, len(frame), encode_time, decode_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Compare the framing of health_protocol with the former one.
+
+Sends frames of each size over a socketpair, first with two sendall()
+calls and a receive loop concatenating strings like health_protocol
+used to do, then with health_protocol.send_frame and recv_frame:
+
+$ bench-health-protocol.py [-m <MB per size>] [<frame size in KB>...]
+
+The default sizes go from 1 KB to 5 MB. The throughput, the number of
+recv calls and the bytes allocated by the receive path per frame are
+printed.
+'''
+
+import getopt
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOPDIR, 'src'))
+
+import health_protocol as HP  # noqa
+
+SIZES = (1, 16, 256, 1024, 5120)
+
+
+class OldFraming(object):
+    'Framing of health_protocol before the use of recv_into.'
+
+    def __init__(self):
+        self.recvs = 0
+        self.allocated = 0
+
+    def send(self, sock, payload):
+        sock.sendall(struct.pack('!I', len(payload)))
+        sock.sendall(payload)
+
+    def recvall(self, sock, count):
+        buf = b''
+        while count:
+            newbuf = sock.recv(count)
+            self.recvs += 1
+            if not newbuf:
+                return None
+            buf += newbuf
+            # the received string and the concatenated one
+            self.allocated += len(newbuf) + len(buf)
+            count -= len(newbuf)
+        return buf
+
+    def recv(self, sock):
+        length = struct.unpack('!I', self.recvall(sock, 4))[0]
+        return self.recvall(sock, length)
+
+
+class NewFraming(object):
+    'Framing of health_protocol counting the calls and allocations.'
+
+    def __init__(self):
+        self.recvs = 0
+        self.allocated = 0
+
+    def send(self, sock, payload):
+        HP.send_frame(sock, payload)
+
+    def recv(self, sock):
+        reader = HP._READERS.get(sock)
+        before = reader and reader.buf
+        payload = HP.recv_frame(sock)
+        buf = HP._READERS[sock].buf
+        if buf is not before:
+            self.allocated += len(buf)
+        return payload
+
+
+class CountingSocket(object):
+    'Socket wrapper counting the recv calls.'
+
+    def __init__(self, sock, framing):
+        self._sock = sock
+        self._framing = framing
+
+    def recv_into(self, buf):
+        self._framing.recvs += 1
+        return self._sock.recv_into(buf)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+def run(framing, size, count):
+    'Send count frames of size bytes and return the elapsed time.'
+    sender, receiver = socket.socketpair()
+    payload = os.urandom(size)
+
+    def send():
+        for _ in xrange(count):
+            framing.send(sender, payload)
+
+    if isinstance(framing, NewFraming):
+        receiver = CountingSocket(receiver, framing)
+    thread = threading.Thread(target=send)
+    start = time.time()
+    thread.start()
+    for _ in xrange(count):
+        if len(framing.recv(receiver)) != size:
+            raise RuntimeError('truncated frame')
+    elapsed = time.time() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return elapsed
+
+
+def main():
+    'Command line entry point.'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hm:')
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    volume = 64
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print __doc__
+            sys.exit(0)
+        elif opt == '-m':
+            volume = int(arg)
+
+    sizes = [int(arg) for arg in args] or SIZES
+
+    print '%8s %-4s %10s %10s %12s %14s' % ('size', '', 'MB/s', 'frames/s',
+                                            'recv/frame', 'alloc/frame')
+    for size_kb in sizes:
+        size = size_kb * 1024
+        count = max(3, min(10000, volume * 1024 * 1024 // size))
+        for name, framing in (('old', OldFraming()), ('new', NewFraming())):
+            elapsed = run(framing, size, count)
+            print '%6dKB %-4s %10.1f %10.0f %12.1f %12.0fKB' % (
+                size_kb, name, size * count / elapsed / 1024 / 1024,
+                count / elapsed, float(framing.recvs) / count,
+                framing.allocated / 1024.0 / count)
+
+
+if __name__ == "__main__":
+    main()
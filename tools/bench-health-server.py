@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Compare the thread per client server of health-server with the
+event loop of health_loop.
+
+For each number of clients, opens the connections to the server then
+sends messages from all of them in turn, like hosts reporting their
+results, until the server has received them all:
+
+$ bench-health-server.py [-m <messages per client>] [<clients>...]
+
+The clients run in a child process. The default numbers of clients go
+from 10 to 2000. The messages received per second, the CPU time used
+by the server per message and its number of threads are printed.
+'''
+
+import getopt
+import os
+import socket
+import sys
+import threading
+import time
+from SocketServer import BaseRequestHandler, ThreadingTCPServer
+
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOPDIR, 'src'))
+
+import health_codec  # noqa
+import health_loop  # noqa
+from health_messages import Health_Message as HM  # noqa
+import health_protocol as HP  # noqa
+
+CLIENTS = (10, 100, 500, 1000, 2000)
+
+
+class Counter(object):
+    'Count the received messages and signal when all are there.'
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.count = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def add(self):
+        with self.lock:
+            self.count += 1
+            if self.count == self.expected:
+                self.done.set()
+
+
+def threaded_server(counter):
+    'Return a ThreadingTCPServer receiving like health-server used to.'
+
+    class Handler(BaseRequestHandler):
+        def handle(self):
+            while True:
+                msg = HP.recv_hm_message(self.request)
+                if msg.message in (HM.DISCONNECTED, HM.INVALID):
+                    return
+                counter.add()
+
+    ThreadingTCPServer.allow_reuse_address = True
+    ThreadingTCPServer.daemon_threads = True
+    ThreadingTCPServer.request_queue_size = 1024
+    return ThreadingTCPServer(('127.0.0.1', 0), Handler)
+
+
+def loop_server(counter):
+    'Return a health_loop.Server counting the messages.'
+
+    class Handler(object):
+        def connected(self, sock, address):
+            pass
+
+        def received(self, address, msg):
+            counter.add()
+
+        def closed(self, address):
+            pass
+
+    return health_loop.Server(('127.0.0.1', 0), Handler())
+
+
+def send(address, nclients, nmessages, frame, go_fd):
+    '''Open nclients connections then send nmessages frames from each
+once a byte is read from go_fd.'''
+    clients = []
+    for _ in xrange(nclients):
+        clients.append(socket.create_connection(address))
+    os.read(go_fd, 1)
+    for _ in xrange(nmessages):
+        for client in clients:
+            HP.send_frame(client, frame)
+
+
+def run(factory, nclients, nmessages, frame):
+    '''Receive nmessages frames from nclients connections opened by
+another process.
+
+Returns the elapsed time, the CPU time of the server and its number of
+threads.
+'''
+    counter = Counter(nclients * nmessages)
+    server = factory(counter)
+    go_read, go_write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        server.socket.close()
+        send(server.server_address, nclients, nmessages, frame, go_read)
+        os._exit(0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    # wait for the connections to be accepted
+    if factory is threaded_server:
+        while threading.active_count() < nclients + 2:
+            time.sleep(0.01)
+    else:
+        while len(server.connections) < nclients:
+            time.sleep(0.01)
+    threads = threading.active_count()
+    start = time.time()
+    cpu_start = sum(os.times()[:2])
+    os.write(go_write, 'x')
+    counter.done.wait()
+    elapsed = time.time() - start
+    cpu = sum(os.times()[:2]) - cpu_start
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    os.waitpid(pid, 0)
+    os.close(go_read)
+    os.close(go_write)
+    return elapsed, cpu, threads
+
+
+def main():
+    'Command line entry point.'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hm:')
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    nmessages = 20
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print __doc__
+            sys.exit(0)
+        elif opt == '-m':
+            nmessages = int(arg)
+
+    HP.start_log('/dev/null')
+    msg = HM(HM.MODULE, HM.CPU, HM.COMPLETED)
+    msg.hw = [('cpu', 'logical', 'loops_per_sec', '1234')]
+    frame = health_codec.encode(msg)
+
+    print '%8s %-8s %10s %14s %8s' % ('clients', '', 'msg/s', 'CPU us/msg',
+                                      'threads')
+    for nclients in [int(arg) for arg in args] or CLIENTS:
+        for name, factory in (('threads', threaded_server),
+                              ('loop', loop_server)):
+            elapsed, cpu, threads = run(factory, nclients, nmessages, frame)
+            count = nclients * nmessages
+            print '%8d %-8s %10.0f %14.1f %8d' % (
+                nclients, name, count / elapsed, cpu * 1e6 / count, threads)
+
+
+if __name__ == "__main__":
+    main()
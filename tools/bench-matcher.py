@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Compare the full matcher with the index-pruned matcher.
+
+Replays .hw files against all the .specs of a config directory, first
+by trying every profile with matcher.match_all like State.find_match
+used to do, then by pruning the profiles with server/matchindex.py.
+
+$ bench-matcher.py [-c <config dir>] [-n <iterations>] [<hw file>...]
+
+Without hw files, the samples from config/hw, health and tools/grapher
+are used.
+'''
+
+import getopt
+import glob
+import os
+import sys
+import time
+
+from hardware import matcher
+
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOPDIR, 'server'))
+
+import matchindex  # noqa
+
+
+def load_specs(cfg_dir):
+    'Load all the specs of a config directory.'
+    specs = {}
+    for fname in sorted(glob.glob(os.path.join(cfg_dir, '*.specs'))):
+        try:
+            specs[os.path.basename(fname)[:-6]] = eval(open(fname).read(-1))
+        except Exception as excpt:
+            sys.stderr.write('skipping %s: %s\n' % (fname, excpt))
+    return specs
+
+
+def full_match(hw_items, specs):
+    'Try every profile in order.'
+    for name in sorted(specs):
+        if matcher.match_all(hw_items, specs[name], {}, {}):
+            return name
+    return None
+
+
+def indexed_match(hw_items, specs, index):
+    'Try only the profiles selected by the index.'
+    candidates = index.candidates(hw_items)
+    for name in sorted(specs):
+        if name in candidates and matcher.match_all(hw_items, specs[name],
+                                                    {}, {}):
+            return name
+    return None
+
+
+def bench(func, iterations, *args):
+    'Return the result of func and its average duration in ms.'
+    start = time.time()
+    for _ in range(iterations):
+        result = func(*args)
+    return result, (time.time() - start) * 1000.0 / iterations
+
+
+def main():
+    'Command line entry point.'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hc:n:')
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    cfg_dir = os.path.join(TOPDIR, 'config')
+    iterations = 20
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print __doc__
+            sys.exit(0)
+        elif opt == '-c':
+            cfg_dir = arg
+        elif opt == '-n':
+            iterations = int(arg)
+
+    hw_files = args or (glob.glob(os.path.join(TOPDIR, 'config', 'hw',
+                                               '*.hw')) +
+                        glob.glob(os.path.join(TOPDIR, 'health', '*.hw')) +
+                        glob.glob(os.path.join(TOPDIR, 'tools', 'grapher',
+                                               '*.hw')))
+
+    specs = load_specs(cfg_dir)
+    start = time.time()
+    index = matchindex.SpecIndex(
+        dict([(name, matchindex.compile_specs(specs[name]))
+              for name in specs]))
+    print 'index of %d profiles built in %.3f ms' % (
+        len(specs), (time.time() - start) * 1000.0)
+
+    total_full = total_indexed = 0.0
+    for hw_file in hw_files:
+        hw_items = eval(open(hw_file).read(-1))
+        full, full_ms = bench(full_match, iterations, hw_items, specs)
+        indexed, indexed_ms = bench(indexed_match, iterations, hw_items,
+                                    specs, index)
+        if full != indexed:
+            print 'MISMATCH %s: %s != %s' % (hw_file, full, indexed)
+            sys.exit(1)
+        candidates = len(index.candidates(hw_items))
+        print '%-60s %5d lines %2d/%2d candidates full %8.3f ms ' \
+            'indexed %8.3f ms -> %s' % (os.path.basename(hw_file)[:60],
+                                        len(hw_items), candidates,
+                                        len(specs), full_ms, indexed_ms,
+                                        full)
+        total_full += full_ms
+        total_indexed += indexed_ms
+
+    if hw_files:
+        print 'total: full %.3f ms indexed %.3f ms (x%.1f)' % (
+            total_full, total_indexed,
+            total_full / max(total_indexed, 0.001))
+
+
+if __name__ == "__main__":
+    main()
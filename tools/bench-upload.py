@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Boot storm load generator for the provisioning endpoint.
+
+Replays .hw files, with randomized serials and MAC addresses, against a
+throwaway copy of a config directory whose CMDBs are replaced by
+synthetic ones of <entries> entries. Requests are sent by <concurrency>
+threads either to upload.py -f or, with -s, to a local upload_server.py
+or, with -u, to an already running endpoint:
+
+$ bench-upload.py [-c <config dir>] [-n <requests>] [-p <concurrency>]
+                  [-e <entries>] [-j] [-s | -u <url>] [<hw file>...]
+
+-j enables the journal mode. Without hw files, the samples from
+config/hw, health and tools/grapher are used. The throughput, the
+latency percentiles and the percentiles of the phases logged by
+upload.py, including the lock waits, are printed. The lock waits are
+not available with -u.
+'''
+
+import getopt
+import glob
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+SERVERDIR = os.path.join(TOPDIR, 'server')
+sys.path.insert(0, SERVERDIR)
+
+import timing  # noqa
+
+PERCENTILES = (50, 95, 99)
+
+
+def random_mac():
+    'Return a random locally administered MAC address.'
+    return '52:54:%s' % ':'.join(['%02x' % random.randint(0, 255)
+                                  for _ in range(4)])
+
+
+def randomize(hw_items):
+    'Return a copy of hw_items with a new serial and new MAC addresses.'
+    result = []
+    for item in hw_items:
+        if item[0:3] == ('system', 'product', 'serial'):
+            item = item[0:3] + ('BENCH%08X' % random.getrandbits(32),)
+        elif item[0] == 'network' and item[2] == 'serial':
+            item = item[0:3] + (random_mac(),)
+        result.append(item)
+    return result
+
+
+def setup_config(src_dir, work_dir, requests, entries, use_journal):
+    '''Copy a config directory with synthetic CMDBs.
+
+Returns the name of the configuration file to use.
+'''
+    cfg_dir = os.path.join(work_dir, 'config')
+    os.makedirs(cfg_dir)
+    for subdir in ('hw', 'logs'):
+        os.makedirs(os.path.join(work_dir, subdir))
+    profiles = []
+    for fname in sorted(glob.glob(os.path.join(src_dir, '*.specs'))):
+        name = os.path.basename(fname)[:-6]
+        configure = os.path.join(src_dir, name + '.configure')
+        if not os.path.exists(configure):
+            continue
+        try:
+            eval(open(fname).read(-1))
+        except Exception as excpt:
+            sys.stderr.write('skipping %s: %s\n' % (fname, excpt))
+            continue
+        shutil.copy(fname, cfg_dir)
+        shutil.copy(configure, cfg_dir)
+        with open(os.path.join(cfg_dir, name + '.cmdb'), 'w') as cmdb:
+            cmdb.write("generate({'ip': '10.%d.0-255.0-255',\n"
+                       "          'hostname': '%s-1-%d'})\n" %
+                       (len(profiles), name, entries))
+        profiles.append(name)
+    with open(os.path.join(cfg_dir, 'state'), 'w') as state:
+        state.write(repr([(prof, requests) for prof in profiles]) + '\n')
+    conf = os.path.join(work_dir, 'edeploy.conf')
+    with open(conf, 'w') as out:
+        out.write('[SERVER]\nCONFIGDIR=%s\nHWDIR=%s\nLOGDIR=%s\n'
+                  'LOCKFILE=%s\nJOURNAL=%s\n' %
+                  (cfg_dir, os.path.join(work_dir, 'hw'),
+                   os.path.join(work_dir, 'logs'),
+                   os.path.join(work_dir, 'edeploy.lock'), use_journal))
+    return conf
+
+
+def encode_form(fields, files):
+    'Return the content type and the body of a multipart form.'
+    boundary = '----bench%x' % random.getrandbits(64)
+    body = []
+    for name, value in fields:
+        body.append('--%s\r\nContent-Disposition: form-data; name="%s"'
+                    '\r\n\r\n%s\r\n' % (boundary, name, value))
+    for name, filename, content in files:
+        body.append('--%s\r\nContent-Disposition: form-data; name="%s"; '
+                    'filename="%s"\r\nContent-Type: application/json'
+                    '\r\n\r\n%s\r\n' % (boundary, name, filename, content))
+    body.append('--%s--\r\n' % boundary)
+    return 'multipart/form-data; boundary=%s' % boundary, ''.join(body)
+
+
+class Runner(object):
+    'Send the requests and collect their results.'
+
+    def __init__(self, samples, requests, conf, url=None):
+        self.samples = samples
+        self.remaining = requests
+        self.conf = conf
+        self.url = url
+        self.mutex = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.logs = []
+
+    def next_request(self):
+        'Return the next hardware to send or None when done.'
+        with self.mutex:
+            if self.remaining == 0:
+                return None
+            self.remaining -= 1
+        return json.dumps(randomize(random.choice(self.samples)))
+
+    def send_cli(self, content):
+        'Run upload.py -f and return its success and its log.'
+        fd, fname = tempfile.mkstemp(suffix='.json')
+        os.write(fd, content)
+        os.close(fd)
+        try:
+            env = dict(os.environ, EDEPLOY_CONF=self.conf)
+            proc = subprocess.Popen([sys.executable,
+                                     os.path.join(SERVERDIR, 'upload.py'),
+                                     '-f', fname],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, env=env)
+            out, err = proc.communicate()
+            return (proc.returncode == 0 and
+                    out.startswith('#!/usr/bin/env python')), err
+        finally:
+            os.unlink(fname)
+
+    def send_http(self, content):
+        'Post the hardware to the endpoint and return its success.'
+        ctype, body = encode_form([('section', 'SERVER')],
+                                  [('file', 'hw.json', content)])
+        request = urllib2.Request(self.url, body, {'Content-Type': ctype})
+        try:
+            out = urllib2.urlopen(request).read()
+        except urllib2.URLError:
+            return False, ''
+        return out.startswith('#!/usr/bin/env python'), ''
+
+    def worker(self):
+        'Send requests until there is none left.'
+        while True:
+            content = self.next_request()
+            if content is None:
+                return
+            start = time.time()
+            if self.url:
+                success, log = self.send_http(content)
+            else:
+                success, log = self.send_cli(content)
+            latency = time.time() - start
+            with self.mutex:
+                self.latencies.append(latency)
+                self.logs.append(log)
+                if not success:
+                    self.errors += 1
+
+    def run(self, concurrency):
+        'Run the workers and return the elapsed time.'
+        threads = [threading.Thread(target=self.worker)
+                   for _ in range(concurrency)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+
+def free_port():
+    'Return a free TCP port.'
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(conf, log_file):
+    'Start upload_server.py on the configuration and return (proc, url).'
+    port = free_port()
+    proc = subprocess.Popen([sys.executable,
+                             os.path.join(SERVERDIR, 'upload_server.py'),
+                             '-c', conf, '-l', '127.0.0.1',
+                             '-p', str(port)],
+                            stderr=log_file)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except socket.error:
+            time.sleep(0.1)
+    return proc, 'http://127.0.0.1:%d/cgi-bin/upload.py' % port
+
+
+def format_ms(values, maximum):
+    'Format percentiles and a max given in seconds as ms.'
+    return ' '.join(['p%d %8.1f' % (pct, value * 1000)
+                     for pct, value in zip(PERCENTILES, values)] +
+                    ['max %8.1f ms' % (maximum * 1000)])
+
+
+def report(runner, elapsed, log_lines):
+    'Print the results of a run.'
+    count = len(runner.latencies)
+    print 'requests: %d errors: %d elapsed: %.3f s' % (count, runner.errors,
+                                                       elapsed)
+    print 'throughput: %.1f req/s %.0f nodes/min' % (
+        count / elapsed, count * 60.0 / elapsed)
+    if count:
+        latencies = sorted(runner.latencies)
+        print 'latency:     %s' % format_ms(
+            [timing.percentile(latencies, pct) for pct in PERCENTILES],
+            latencies[-1])
+    records = [data for data in [timing.parse_line(line)
+                                 for line in log_lines]
+               if data is not None]
+    summary = timing.summarize(records, PERCENTILES)
+    for name in sorted(summary):
+        _, values, maximum = summary[name]
+        print '%-12s %s' % (name + ':', format_ms(values, maximum))
+
+
+def main():
+    'Command line entry point.'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hc:n:p:e:jsu:')
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    cfg_dir = os.path.join(TOPDIR, 'config')
+    requests = 100
+    concurrency = 8
+    entries = 65536
+    use_journal = False
+    spawn_server = False
+    url = None
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print __doc__
+            sys.exit(0)
+        elif opt == '-c':
+            cfg_dir = arg
+        elif opt == '-n':
+            requests = int(arg)
+        elif opt == '-p':
+            concurrency = int(arg)
+        elif opt == '-e':
+            entries = int(arg)
+        elif opt == '-j':
+            use_journal = True
+        elif opt == '-s':
+            spawn_server = True
+        elif opt == '-u':
+            url = arg
+
+    hw_files = args or (glob.glob(os.path.join(TOPDIR, 'config', 'hw',
+                                               '*.hw')) +
+                        glob.glob(os.path.join(TOPDIR, 'health', '*.hw')) +
+                        glob.glob(os.path.join(TOPDIR, 'tools', 'grapher',
+                                               '*.hw')))
+    samples = [eval(open(hw_file).read(-1)) for hw_file in hw_files]
+    if not samples:
+        print 'no hw file'
+        sys.exit(1)
+
+    work_dir = tempfile.mkdtemp(prefix='bench-upload')
+    server = None
+    try:
+        conf = setup_config(cfg_dir, work_dir, requests, entries,
+                            use_journal)
+        server_log = os.path.join(work_dir, 'server.log')
+        if spawn_server:
+            server, url = start_server(conf, open(server_log, 'w'))
+        runner = Runner(samples, requests, conf, url)
+        elapsed = runner.run(concurrency)
+        if server:
+            server.terminate()
+            server.wait()
+            server = None
+            log_lines = open(server_log).readlines()
+        else:
+            log_lines = '\n'.join(runner.logs).split('\n')
+        report(runner, elapsed, log_lines)
+    finally:
+        if server:
+            server.terminate()
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Rebuild the .hw files of health check results stored with
+HEALTHBLOBDIR.
+
+$ health-export.py [-o <output dir>] <.hwref file or dir>...
+
+Directories are searched recursively. Each .hwref file is written as a
+.hw file with the same relative path in <output dir>, or printed on
+stdout without -o, so the results can be read by cardiff or grapher.
+'''
+
+import getopt
+import os
+import pprint
+import sys
+
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOPDIR, 'server'))
+
+import healthblobs  # noqa
+
+
+def ref_files(arg):
+    'Return the list of (relative path, path) of the .hwref files of arg.'
+    if not os.path.isdir(arg):
+        return [(os.path.basename(arg), arg)]
+    result = []
+    for dirpath, _, filenames in os.walk(arg):
+        for fname in sorted(filenames):
+            if fname.endswith(healthblobs.REF_EXTENSION):
+                path = os.path.join(dirpath, fname)
+                result.append((os.path.relpath(path, arg), path))
+    return result
+
+
+def main():
+    'Command line entry point.'
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'ho:')
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    output_dir = None
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print __doc__
+            sys.exit(0)
+        elif opt == '-o':
+            output_dir = arg
+
+    if not args:
+        print __doc__
+        sys.exit(2)
+
+    for arg in args:
+        for relpath, path in ref_files(arg):
+            hw_items = healthblobs.load(path)
+            if not output_dir:
+                pprint.pprint(hw_items)
+                continue
+            dest = os.path.join(output_dir, os.path.splitext(relpath)[0] +
+                                '.hw')
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            with open(dest, 'w') as out:
+                pprint.pprint(hw_items, stream=out)
+
+
+if __name__ == "__main__":
+    main()
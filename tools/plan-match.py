@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 eNovance SAS <licensing@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+'''Plan which profile and CMDB entry each host would get.
+
+Reads the state, specs and CMDB files of a config directory once,
+without modifying them, matches the hardware files against every
+profile in a pool of processes and then simulates the allocations of
+upload.py in the order of the file names:
+
+$ plan-match.py [-c <config dir>] [-p <processes>] [-J] <hw dir or file>...
+
+The assignments, the hosts matching no profile and the state counts or
+CMDB ranges exhausted by the plan are printed, or dumped as JSON with
+-J. Hardware files can be .hw, .json or .json.gz files.
+'''
+
+import getopt
+import json
+import multiprocessing
+import os
+import sys
+
+from hardware import cmdb
+from hardware import matcher
+
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, os.path.join(TOPDIR, 'server'))
+
+import journal  # noqa
+import lazycmdb  # noqa
+import matchindex  # noqa
+import upload  # noqa
+import upload_state  # noqa
+
+# profiles of the state as (name, specs), set before forking the pool
+PROFILES = []
+INDEX = None
+
+
+def load_config_dir(cfg_dir):
+    '''Read the state, specs and CMDBs of a config directory.
+
+Returns the state as a list of (name, count), a dict of the specs and a
+dict of the CMDBs with their journals applied.
+'''
+    state_file = os.path.join(cfg_dir, 'state')
+    data = list(upload_state.load_state(state_file))
+    journal.apply_state(data, journal.read(state_file))
+    specs = {}
+    cmdbs = {}
+    for name, _ in data:
+        try:
+            specs[name] = upload_state.load_specs(
+                os.path.join(cfg_dir, name + '.specs'))
+        except Exception as excpt:
+            # upload.py fails the requests reaching this profile
+            sys.stderr.write('ignoring profile %s: %s\n' % (name, excpt))
+            specs[name] = None
+        fname = cmdb.cmdb_filename(cfg_dir, name)
+        if os.path.exists(fname):
+            # not upload_state.load_cmdb which writes a .orig copy
+            dbase = lazycmdb.copy_cmdb(lazycmdb.parse(open(fname).read(-1)))
+            journal.apply_cmdb(dbase, journal.read(fname))
+            cmdbs[name] = dbase
+    return data, specs, cmdbs
+
+
+def match_file(path):
+    '''Match a hardware file against all the profiles.
+
+Returns the path, the system name and the list of (name, var, var2)
+of the matching profiles in the state order, or an error.
+'''
+    try:
+        hw_items = upload.file_loader(path)()
+    except upload.UploadError as excpt:
+        return path, None, [], str(excpt)
+    sysname = matcher.generate_filename_and_macs(hw_items)['sysname']
+    candidates = INDEX.candidates(hw_items)
+    matches = []
+    for name, specs in PROFILES:
+        if specs is None or name not in candidates:
+            continue
+        var = {}
+        var2 = {}
+        if matcher.match_all(hw_items, specs, var, var2):
+            matches.append((name, var, var2))
+    return path, sysname, matches, None
+
+
+def simulate(data, cmdbs, results):
+    '''Allocate the profiles and CMDB entries like State.find_match.
+
+results are the return values of match_file in the allocation order.
+Returns the list of assignments, the set of exhausted profiles and the
+counts left in the state.
+'''
+    times = dict(data)
+    assignments = []
+    exhausted = set()
+    for path, sysname, matches, error in results:
+        assignment = {'file': path, 'sysname': sysname}
+        assignments.append(assignment)
+        if error:
+            assignment['error'] = error
+            continue
+        for name, var, var2 in matches:
+            if times[name] != '*' and int(times[name]) <= 0:
+                exhausted.add(name)
+                continue
+            forced = (var2 != {})
+            if var2 == {}:
+                var2 = var
+            idx = None
+            if cmdbs.get(name):
+                try:
+                    idx, _ = lazycmdb.update_cmdb(cmdbs[name], var, var2,
+                                                  forced)
+                except cmdb.CmdbError as excpt:
+                    # upload.py fails the request in this case
+                    exhausted.add(name)
+                    assignment['error'] = '%s: %s' % (name, str(excpt))
+                    break
+            if times[name] != '*':
+                times[name] = int(times[name]) - 1
+            assignment.update({'profile': name, 'idx': idx, 'var': var})
+            break
+        else:
+            if matches:
+                assignment['error'] = 'no more %s available' % ', '.join(
+                    [match[0] for match in matches])
+            else:
+                assignment['error'] = 'no profile matched'
+    return assignments, exhausted, times
+
+
+def hw_files(args):
+    'Return the sorted list of the hardware files given as arguments.'
+    paths = []
+    for arg in args:
+        if os.path.isdir(arg):
+            paths.extend([os.path.join(arg, fname)
+                          for fname in os.listdir(arg)
+                          if fname.endswith(upload.HW_EXTENSIONS)])
+        else:
+            paths.append(arg)
+    return sorted(paths)
+
+
+def report(assignments, exhausted, times, cmdbs):
+    'Print the plan.'
+    failed = [elt for elt in assignments if 'error' in elt]
+    for elt in assignments:
+        if 'error' in elt:
+            continue
+        if elt['idx'] is None:
+            entry = '-'
+        else:
+            entry = '#%d %s' % (elt['idx'], elt['var'].get(
+                'hostname', elt['var'].get('ip', '')))
+        print '%-50s %-20s %s' % (os.path.basename(elt['file'])[:50],
+                                  elt['profile'], entry)
+    for elt in failed:
+        print '%-50s NO MATCH: %s' % (os.path.basename(elt['file'])[:50],
+                                      elt['error'])
+    print
+    print '%d hosts, %d assigned, %d not matching' % (
+        len(assignments), len(assignments) - len(failed), len(failed))
+    for name in sorted(times):
+        dbase = cmdbs.get(name)
+        free = (dbase and len(dbase) - len(lazycmdb.allocated(dbase)))
+        print '%-20s count left %-6s CMDB free %-8s%s' % (
+            name, times[name], '-' if dbase is None else free,
+            ' EXHAUSTED' if name in exhausted else '')
+
+
+def main():
+    'Command line entry point.'
+    global INDEX
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hc:p:J')
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    cfg_dir = os.path.join(TOPDIR, 'config')
+    processes = multiprocessing.cpu_count()
+    as_json = False
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print __doc__
+            sys.exit(0)
+        elif opt == '-c':
+            cfg_dir = arg
+        elif opt == '-p':
+            processes = int(arg)
+        elif opt == '-J':
+            as_json = True
+
+    if not args:
+        print __doc__
+        sys.exit(2)
+
+    data, specs, cmdbs = load_config_dir(os.path.normpath(cfg_dir) + '/')
+    PROFILES[:] = [(name, specs[name]) for name, _ in data]
+    INDEX = matchindex.SpecIndex(
+        dict([(name, matchindex.compile_specs(specs[name]))
+              for name in specs if specs[name] is not None]))
+
+    paths = hw_files(args)
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.map(match_file, paths,
+                           max(1, len(paths) // (processes * 4)))
+        pool.close()
+    else:
+        results = map(match_file, paths)
+
+    assignments, exhausted, times = simulate(data, cmdbs, results)
+    if as_json:
+        print json.dumps({'assignments': assignments,
+                          'exhausted': sorted(exhausted),
+                          'counts': times}, indent=2)
+    else:
+        report(assignments, exhausted, times, cmdbs)
+
+
+if __name__ == "__main__":
+    main()